@@ -7,12 +7,11 @@
 
 import logging
 from datetime import datetime, timedelta
-from time import time, sleep
-import backoff
-import requests
-from qhue import Bridge
+from mhclock import now, time
 from mhexception import Mobihue_Exception
-from mobifunctions import backoff_handler
+from mobifunctions import retry_on_timeout, SAMPLED
+import mhrecorder
+import mhmetrics
 
 
 logger = logging.getLogger("mH." + __name__)
@@ -29,40 +28,44 @@ class Light:
         self.bridge = bridge
         self.states = states
         self.hue_light = self.bridge.lights[light_id]
-        self.initial_state = self._pop_redundant_state_vars(self.hue_light()["state"])
+        initial_light = self.hue_light()
+        mhrecorder.record("initial/lights/{}".format(light_id), initial_light)
+        self.initial_state = self._pop_redundant_state_vars(initial_light["state"])
         self.state_has_changed = False
 
     def _pop_redundant_state_vars(self, light_state):
         """Removes certain variables from the Hue light state that interfere with this program's commands and disables any alerts."""
-        for self.pair in self.redundant_pairs:
-            light_state.pop(self.pair, None)
+        for pair in self.redundant_pairs:
+            light_state.pop(pair, None)
         light_state["alert"] = "none"
         return light_state
 
     @property
     def is_on(self):
         """Returns True or False depending on whether the Hue light is on or off."""
-        self.is_on_result = self.hue_light()["state"]["on"]
-        logger.debug("  >> On / off state of light requested. Result: %s", self.is_on_result)
-        return self.is_on_result
+        is_on_result = self.hue_light()["state"]["on"]
+        logger.debug("  >> On / off state of light requested. Result: %s", is_on_result, extra=SAMPLED)
+        return is_on_result
     
     @property
     def initial_on(self):
         """Returns True or False depending on whether or not the Hue light was on or off at program start."""
-        logger.debug("  >> Initial on / off state of light requested. Result: %s", self.initial_state["on"])
+        logger.debug("  >> Initial on / off state of light requested. Result: %s", self.initial_state["on"], extra=SAMPLED)
         return self.initial_state["on"]
 
     def set_state(self, **new_state):
         """Changes the state of the Hue light."""
-        logger.debug("  >> Setting new light state: %s", str(new_state))
-        self.hue_light.state(**new_state)
+        logger.debug("  >> Setting new light state: %s", new_state)
+        with mhmetrics.bridge_command_seconds.time(endpoint="lights/state"):
+            self.hue_light.state(**new_state)
         self.state_has_changed = True
         return True
     
     def set_zone(self, zone):
         """Sets the Hue light's state according to a specific zone."""
-        logger.debug("  >> Setting new light state according to zone: %s. State: %s", zone, str(self.states[zone]))
-        self.hue_light.state(**self.states[zone])
+        logger.debug("  >> Setting new light state according to zone: %s. State: %s", zone, self.states[zone])
+        with mhmetrics.bridge_command_seconds.time(endpoint="lights/state"):
+            self.hue_light.state(**self.states[zone])
         self.state_has_changed = True
 
     def reset(self):
@@ -89,14 +92,14 @@ class Light:
     def on(self):
         """Turns the selected Hue light on."""
         if self.state_has_changed:
-            self.current_on_state = self.is_on
+            current_on_state = self.is_on
         elif not self.state_has_changed:
-            self.current_on_state = self.initial_state["on"]
-        if not self.current_on_state:
+            current_on_state = self.initial_state["on"]
+        if not current_on_state:
             logger.debug("  >> Light turned on.")
             self.set_state(on=True)
             return True
-        elif self.current_on_state:
+        elif current_on_state:
             logger.debug("  >> Light already on.")
             return True
         else:
@@ -122,75 +125,81 @@ class Scene_Manager:
 
     def _get_scene_lights(self):
         """Checks what lights are used for a given scene and returns corresponding Light class instances."""
-        self.raw_light_ids = self.bridge.scenes[self.scene_ids["imminent"]]()["lights"]
-        logger.debug("  >> Lights for scene mode requested. Ids: %s", str(self.raw_light_ids))
-        return [Light(self.bridge, self.current_light_id) for self.current_light_id in self.raw_light_ids]
+        scene = self.bridge.scenes[self.scene_ids["imminent"]]()
+        mhrecorder.record("initial/scenes/{}".format(self.scene_ids["imminent"]), scene)
+        raw_light_ids = scene["lights"]
+        logger.debug("  >> Lights for scene mode requested. Ids: %s", raw_light_ids)
+        return [Light(self.bridge, current_light_id) for current_light_id in raw_light_ids]
 
     def reset(self):
         """Resets all lights used in scene mode to their initial state."""
         logger.debug("  >> Light reset requested:")
-        for self.current_light in self.scene_lights:
-            logger.debug("    - Resetting light %s", str(self.current_light))
-            self.current_light.reset()
+        for current_light in self.scene_lights:
+            logger.debug("    - Resetting light %s", current_light)
+            current_light.reset()
         return True
 
     def set_zone(self, zone):
         """Sets the appropriate scene for a given zone."""
-        logger.debug("  >> Setting new scene according to zone: %s. Scene: %s", zone, str(self.scene_ids[zone]))
+        logger.debug("  >> Setting new scene according to zone: %s. Scene: %s", zone, self.scene_ids[zone])
         if not self.state_has_changed:
-            for self.current_light in self.scene_lights:
-                logger.debug("    - Setting state_has_changed to True for light %s", str(self.current_light))
-                self.current_light.state_has_changed = True
+            for current_light in self.scene_lights:
+                logger.debug("    - Setting state_has_changed to True for light %s", current_light)
+                current_light.state_has_changed = True
             self.state_has_changed = True
-        self.bridge.groups[0].action(scene=self.scene_ids[zone])
+        with mhmetrics.bridge_command_seconds.time(endpoint="groups/action"):
+            self.bridge.groups[0].action(scene=self.scene_ids[zone])
         return True
 
     def on(self):
         """Turns all Hue lights of a given scene on."""
         logger.debug("  >> Turning lights on for given scene.")
-        for self.current_light in self.scene_lights:
-            logger.debug("    - Turning light %s on.", str(self.current_light))
-            self.current_light.on()
+        for current_light in self.scene_lights:
+            logger.debug("    - Turning light %s on.", current_light)
+            current_light.on()
         return True
     
     @property
     def initial_on(self):
         """Returns True or False depending on whether or not all Hue lights for a given scene were on or off at program start."""
-        self._initial_on = False
-        for self.current_light in self.scene_lights:
-            if self.current_light.initial_on:
-                self._initial_on = True
+        initial_on = False
+        for current_light in self.scene_lights:
+            if current_light.initial_on:
+                initial_on = True
                 break
-        logger.debug("Checking if all lights for given scene were on to start with. Result: %s", str(self._initial_on))
-        return self._initial_on
+        logger.debug("Checking if all lights for given scene were on to start with. Result: %s", initial_on)
+        return initial_on
 
 class Sensor:
     """Class representing the Hue sensor acting as a kill switch."""
 
     def __init__(self, bridge, sensor_id):
         """Initialise the Sensor class."""
+        self.sensor_id = sensor_id
         self.hue_sensor = bridge.sensors[sensor_id]
-        self.reference_time = datetime.now().replace(microsecond=0) + timedelta(seconds=1)
+        self.reference_time = now().replace(microsecond=0) + timedelta(seconds=1)
         self.current_sensor_state = None
         self.has_been_polled = False
 
     def _datetime_from_utc_to_local(self, utc_datetime):
         """Converts UTC time to the local timezone."""
-        self.current_time = time()
-        self.offset = datetime.fromtimestamp(self.current_time) - datetime.utcfromtimestamp(self.current_time)
-        self.local_time = utc_datetime + self.offset
-        return self.local_time
+        current_time = time()
+        offset = datetime.fromtimestamp(current_time) - datetime.utcfromtimestamp(current_time)
+        local_time = utc_datetime + offset
+        return local_time
 
     def reset_reference_time(self):
         """Resets the reference time used to check for a relevant button press."""
-        self.reference_time = datetime.now().replace(microsecond=0) + timedelta(seconds=1)
+        self.reference_time = now().replace(microsecond=0) + timedelta(seconds=1)
         return True
 
-    @backoff.on_exception(backoff.expo, requests.exceptions.Timeout, max_tries=3, on_backoff=backoff_handler)
+    @retry_on_timeout
     def poll(self):
         """Polls the Hue bridge for the current status of the sensor."""
-        self.current_sensor_state = self.hue_sensor()["state"]
-        logger.debug("  >> Polling kill switch sensor. Current sensor state : %s", str(self.current_sensor_state))
+        with mhmetrics.bridge_command_seconds.time(endpoint="sensors"):
+            self.current_sensor_state = self.hue_sensor()["state"]
+        mhrecorder.record("sensors/{}".format(self.sensor_id), self.current_sensor_state)
+        logger.debug("  >> Polling kill switch sensor. Current sensor state : %s", self.current_sensor_state, extra=SAMPLED)
         self.has_been_polled = True
         return True
 
@@ -198,18 +207,18 @@ class Sensor:
     def last_action(self):
         """Returns a list with a datetime object of the last time the Hue sensor has been actioned and with what code"""
         if self.has_been_polled:
-            self.friendly_sensor_time = self._datetime_from_utc_to_local(datetime.strptime(self.current_sensor_state["lastupdated"], "%Y-%m-%dT%H:%M:%S"))
-            if self.friendly_sensor_time >= self.reference_time:
-                self.actioned_response = True
-            elif self.friendly_sensor_time < self.reference_time:
-                self.actioned_response = False
-            self.friendly_current_sensor_state = {
-                    "time": self.friendly_sensor_time,
+            friendly_sensor_time = self._datetime_from_utc_to_local(datetime.strptime(self.current_sensor_state["lastupdated"], "%Y-%m-%dT%H:%M:%S"))
+            if friendly_sensor_time >= self.reference_time:
+                actioned_response = True
+            elif friendly_sensor_time < self.reference_time:
+                actioned_response = False
+            friendly_current_sensor_state = {
+                    "time": friendly_sensor_time,
                     "button": self.current_sensor_state["buttonevent"],
-                    "actioned": self.actioned_response,
+                    "actioned": actioned_response,
                 }
-            logger.debug("  >> Last action of kill switch sensor has been requested: Returning parsed sensor data from cache. Data: %s", str(self.friendly_current_sensor_state))
-            return self.friendly_current_sensor_state
+            logger.debug("  >> Last action of kill switch sensor has been requested: Returning parsed sensor data from cache. Data: %s", friendly_current_sensor_state, extra=SAMPLED)
+            return friendly_current_sensor_state
         elif not self.has_been_polled:
             logger.warning("  >> Last action of kill switch sensor has been requested: Could not return data as it seems that the sensor has not been polled yet.")
             return False
@@ -220,28 +229,41 @@ class On_Switch:
 
     def __init__(self, bridge, on_switch_id):
         """Initialise the On_Switch class."""
+        self.on_switch_id = on_switch_id
         self.on_switch = bridge.sensors[on_switch_id]
 
-    @backoff.on_exception(backoff.expo, requests.exceptions.Timeout, max_tries=3, on_backoff=backoff_handler)
+    @retry_on_timeout
     def poll(self):
         """Polls the sensor acting as an on switch, exposes the result and resets it."""
-        self.current_on_switch_status = self.on_switch()["state"]["status"]
-        if self.current_on_switch_status == 1:
-            logger.debug("  >> Polling on switch sensor. Actioned. Current sensor state : %s - Resetting.", str(self.current_on_switch_status))
+        with mhmetrics.bridge_command_seconds.time(endpoint="sensors"):
+            current_on_switch_state = self.on_switch()["state"]
+        mhrecorder.record("sensors/{}".format(self.on_switch_id), current_on_switch_state)
+        current_on_switch_status = current_on_switch_state["status"]
+        if current_on_switch_status == 1:
+            logger.debug("  >> Polling on switch sensor. Actioned. Current sensor state : %s - Resetting.", current_on_switch_status)
             self.on_switch.state(status=0)
             return True
-        elif self.current_on_switch_status != 1:
-            logger.debug("  >> Polling on switch sensor. Not actioned. Current sensor state : %s", str(self.current_on_switch_status))
+        elif current_on_switch_status != 1:
+            logger.debug("  >> Polling on switch sensor. Not actioned. Current sensor state : %s", current_on_switch_status, extra=SAMPLED)
             return False
 
 
 class Hue_Control:
     """Master class representing both the Hue light and sensor."""
 
-    def __init__(self, ip, key, light_id=None, sensor_id=None, on_switch_id=None, states=None, scenes=None):
-        """Initialise the Hue_Control class."""
+    CONNECTION_SETTINGS = ("ip", "key", "light_id", "sensor_id", "on_switch_id", "entertainment", "bridge_schedules")
+
+    def __init__(self, ip, key, light_id=None, sensor_id=None, on_switch_id=None, states=None, scenes=None, entertainment=None, bridge_schedules=None, bridge=None):
+        """Initialise the Hue_Control class. A ready made bridge object can be passed to bypass qhue, e.g. for benchmarks.
+
+        Zone states are streamed to an entertainment group if its settings are given. With bridge
+        schedule settings, upcoming zone transitions are left to the bridge's own scheduler.
+        """
         #self._dev_scene_list = {"imminent": "MwukNidCo3cv4VG", "close": "vq2wD-0P9ijZnLz", "intermediate": "8LKStAFrDAOQA8g", "further": "fJIRDBtC7EpCc5p"}
-        self.bridge = Bridge(ip, key)
+        if bridge is None:
+            from qhue import Bridge
+            bridge = Bridge(ip, key)
+        self.bridge = bridge
         if sensor_id is not None:
             self.sensor = Sensor(self.bridge, sensor_id)
         else:
@@ -250,7 +272,12 @@ class Hue_Control:
             self.on_switch = On_Switch(self.bridge, on_switch_id)
         else:
             self.on_switch = False
-        if states is not None and scenes is None:
+        if states is not None and scenes is None and entertainment:
+            from mhentertainment import Entertainment_Manager
+            self.light_mode = "entertainment"
+            self.slave = Entertainment_Manager(self.bridge, ip, key, states, **entertainment)
+            logger.info("Using light mode: entertainment.")
+        elif states is not None and scenes is None:
             if light_id is None:
                 raise Mobihue_Exception("Light mode set to to states, but no light id has been provided.")
             self.light_mode = "states"
@@ -262,3 +289,20 @@ class Hue_Control:
             logger.info("Using light mode: scenes.")
         else:
             raise Mobihue_Exception("Could not determine light mode (states or scenes).")
+        if bridge_schedules is not None and self.light_mode != "entertainment":
+            from mhtransitions import Transition_Scheduler
+            self.transitions = Transition_Scheduler(self.bridge, key, self.slave, self.light_mode, **(bridge_schedules or {}))
+            logger.info("Leaving zone transitions to bridge schedules.")
+        else:
+            self.transitions = None
+
+    def update_zones(self, states=None, scenes=None):
+        """Replaces the zone states or scenes used by the running light or scene manager."""
+        if self.light_mode in ("states", "entertainment") and states is not None:
+            self.slave.states = states
+        elif self.light_mode == "scenes" and scenes is not None:
+            self.slave.scene_ids = scenes
+        else:
+            raise Mobihue_Exception("Zone update does not match the current light mode.")
+        logger.debug("  >> Zone states or scenes updated.")
+        return True
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# mobiHue.py - announces real time bus arrivals using Philipps Hue lights
+# (c) 2017, 2018 Federico Gentile
+# Transit backends providing departure boards: HAFAS / Mobiliteit.lu and GTFS-Realtime.
+
+import logging
+from datetime import datetime
+from mhclock import sleep
+from mobifunctions import lazy_import, SAMPLED
+import mhrecorder
+import mhmetrics
+
+requests = lazy_import("requests")
+
+
+logger = logging.getLogger("mH." + __name__)
+
+
+class Transit_Backend:
+    """Interface of all transit backends.
+
+    A backend returns the departures of the configured stop as a departure board in the HAFAS
+    departureBoard JSON format, which Schedule parses regardless of where the data came from.
+    """
+
+    def __init__(self):
+        """Initialises the Transit_Backend class."""
+        self.stop_id = None
+        self.connection_timeout = None
+
+    def configure(self, stop_id, api_base_url):
+        """Sets the stop to return departures for. Can be called again on a running instance."""
+        self.stop_id = stop_id
+
+    def departure_board(self):
+        """Returns a departure board with a "Departure" list, or False if no data could be retrieved."""
+        raise NotImplementedError
+
+
+class Hafas_Backend(Transit_Backend):
+    """Fetches the departureBoard of the Mobiliteit.lu HAFAS API."""
+
+    def __init__(self, allowed_error_count=3):
+        """Initialises the Hafas_Backend class."""
+        super(Hafas_Backend, self).__init__()
+        self.allowed_error_count = allowed_error_count
+        self.api_final_url = None
+
+    def configure(self, stop_id, api_base_url):
+        """Sets the stop and the API URL the stop id is appended to."""
+        super(Hafas_Backend, self).configure(stop_id, api_base_url)
+        self.api_final_url = api_base_url + stop_id
+
+    def _mobi_api_request(self):
+        """Executes a Mobiliteit.lu API HTTP request."""
+        for error_count in range(self.allowed_error_count):
+            try:
+                with mhmetrics.api_request_seconds.time():
+                    api_request = requests.get(self.api_final_url, timeout=self.connection_timeout, headers={"host":"travelplanner.mobiliteit.lu"})
+                mhmetrics.api_response_bytes.inc(len(api_request.content))
+                api_request.raise_for_status()
+            except (requests.ConnectionError, requests.HTTPError, requests.TooManyRedirects, requests.Timeout) as e:
+                if error_count < self.allowed_error_count - 1:
+                    mhmetrics.api_retries.inc()
+                    logger.warning("The HTTP request to the Mobiliteit.lu API raised an exception. Waiting 2 seconds. Try %s of %s ...", error_count + 2, self.allowed_error_count)
+                    sleep(2)
+                    continue
+                else:
+                    logger.error("The HTTP request to the Mobiliteit.lu API failed an raised exceptions for a total of %s tries. Returning empty result.", self.allowed_error_count)
+                    mhmetrics.api_failures.inc()
+                    return False
+            break
+        return api_request
+
+    def departure_board(self):
+        """Executes the Mobiliteit.lu API request function and turns the result into a JSON object."""
+        api_request = self._mobi_api_request()
+        if not api_request:
+            return False
+        else:
+            try:
+                api_json = api_request.json()
+            except ValueError:
+                logger.critical("A JSON decoding error was encountered.")
+                raise
+            else:
+                mhrecorder.record("departures", api_json)
+                return api_json
+
+
+# Protocol buffer wire types
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+FIXED32 = 5
+
+# GTFS-Realtime field numbers
+FEED_ENTITY = 2
+ENTITY_TRIP_UPDATE = 3
+TRIP_UPDATE_TRIP = 1
+TRIP_UPDATE_STOP_TIME_UPDATE = 2
+TRIP_UPDATE_DELAY = 5
+TRIP_TRIP_ID = 1
+TRIP_START_TIME = 2
+TRIP_START_DATE = 3
+TRIP_SCHEDULE_RELATIONSHIP = 4
+TRIP_ROUTE_ID = 5
+TRIP_DIRECTION_ID = 6
+STOP_TIME_ARRIVAL = 2
+STOP_TIME_DEPARTURE = 3
+STOP_TIME_STOP_ID = 4
+STOP_TIME_SCHEDULE_RELATIONSHIP = 5
+EVENT_DELAY = 1
+EVENT_TIME = 2
+
+TRIP_CANCELED = 3
+STOP_SKIPPED = 1
+STOP_NO_DATA = 2
+
+
+def _read_varint(buffer, position):
+    """Decodes the varint starting at position and returns it together with the position following it."""
+    result = 0
+    shift = 0
+    while True:
+        byte = buffer[position]
+        position += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, position
+        shift += 7
+
+def _signed(value):
+    """Returns a varint decoded as unsigned as the signed 64 bit integer it encodes."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def _fields(buffer, start, end):
+    """Yields (field number, wire type, value) for the fields of the message between start and end.
+
+    Varints are decoded, length-delimited fields are returned as (start, end) offsets into the
+    buffer so that nested messages are only decoded when needed. Fixed-width fields are skipped.
+    """
+    position = start
+    while position < end:
+        key, position = _read_varint(buffer, position)
+        field_number = key >> 3
+        wire_type = key & 0x07
+        if wire_type == VARINT:
+            value, position = _read_varint(buffer, position)
+            yield field_number, wire_type, value
+        elif wire_type == LENGTH_DELIMITED:
+            length, position = _read_varint(buffer, position)
+            yield field_number, wire_type, (position, position + length)
+            position += length
+        elif wire_type == FIXED64:
+            position += 8
+        elif wire_type == FIXED32:
+            position += 4
+        else:
+            raise ValueError("Unsupported protocol buffer wire type {} at offset {}.".format(wire_type, position))
+
+def _text(buffer, span):
+    """Returns the string stored at the given offsets."""
+    return bytes(buffer[span[0]:span[1]]).decode("utf-8")
+
+def _stop_time_event(buffer, span):
+    """Returns the (delay, time) pair of a StopTimeEvent, either of which may be None."""
+    delay = event_time = None
+    for field_number, wire_type, value in _fields(buffer, *span):
+        if field_number == EVENT_DELAY and wire_type == VARINT:
+            delay = _signed(value)
+        elif field_number == EVENT_TIME and wire_type == VARINT:
+            event_time = _signed(value)
+    return delay, event_time
+
+def _trip_descriptor(buffer, span):
+    """Returns the fields of a TripDescriptor that are needed for departure boards."""
+    trip = {"trip_id": None, "route_id": None, "direction_id": None, "start_date": None, "start_time": None, "schedule_relationship": 0}
+    for field_number, wire_type, value in _fields(buffer, *span):
+        if field_number == TRIP_TRIP_ID and wire_type == LENGTH_DELIMITED:
+            trip["trip_id"] = _text(buffer, value)
+        elif field_number == TRIP_ROUTE_ID and wire_type == LENGTH_DELIMITED:
+            trip["route_id"] = _text(buffer, value)
+        elif field_number == TRIP_DIRECTION_ID and wire_type == VARINT:
+            trip["direction_id"] = value
+        elif field_number == TRIP_START_DATE and wire_type == LENGTH_DELIMITED:
+            trip["start_date"] = _text(buffer, value)
+        elif field_number == TRIP_START_TIME and wire_type == LENGTH_DELIMITED:
+            trip["start_time"] = _text(buffer, value)
+        elif field_number == TRIP_SCHEDULE_RELATIONSHIP and wire_type == VARINT:
+            trip["schedule_relationship"] = value
+    return trip
+
+def _stop_time_update(buffer, span, stop_id):
+    """Returns the departure (or arrival) of a StopTimeUpdate as (delay, time, schedule relationship) if it concerns the given stop, None otherwise."""
+    departure = arrival = None
+    matches = False
+    relationship = 0
+    for field_number, wire_type, value in _fields(buffer, *span):
+        if field_number == STOP_TIME_STOP_ID and wire_type == LENGTH_DELIMITED:
+            if _text(buffer, value) != stop_id:
+                return None
+            matches = True
+        elif field_number == STOP_TIME_DEPARTURE and wire_type == LENGTH_DELIMITED:
+            departure = value
+        elif field_number == STOP_TIME_ARRIVAL and wire_type == LENGTH_DELIMITED:
+            arrival = value
+        elif field_number == STOP_TIME_SCHEDULE_RELATIONSHIP and wire_type == VARINT:
+            relationship = value
+    if not matches:
+        return None
+    event = departure or arrival
+    delay, event_time = _stop_time_event(buffer, event) if event else (None, None)
+    return delay, event_time, relationship
+
+def decode_trip_updates(feed, stop_id):
+    """Yields the trip updates of a GTFS-Realtime FeedMessage that concern the given stop.
+
+    Entities are decoded one at a time and those not mentioning the stop id are skipped without
+    being decoded, so only the configured stop's updates are ever materialised.
+    """
+    stop_id_bytes = stop_id.encode("utf-8")
+    for field_number, wire_type, entity in _fields(feed, 0, len(feed)):
+        if field_number != FEED_ENTITY or wire_type != LENGTH_DELIMITED or feed.find(stop_id_bytes, *entity) == -1:
+            continue
+        for entity_field, entity_wire_type, trip_update in _fields(feed, *entity):
+            if entity_field != ENTITY_TRIP_UPDATE or entity_wire_type != LENGTH_DELIMITED:
+                continue
+            trip = None
+            trip_delay = None
+            stop_update = None
+            for update_field, update_wire_type, value in _fields(feed, *trip_update):
+                if update_field == TRIP_UPDATE_TRIP and update_wire_type == LENGTH_DELIMITED:
+                    trip = value
+                elif update_field == TRIP_UPDATE_DELAY and update_wire_type == VARINT:
+                    trip_delay = _signed(value)
+                elif update_field == TRIP_UPDATE_STOP_TIME_UPDATE and update_wire_type == LENGTH_DELIMITED and stop_update is None:
+                    stop_update = _stop_time_update(feed, value, stop_id)
+            if trip is None or stop_update is None:
+                continue
+            delay, event_time, relationship = stop_update
+            update = _trip_descriptor(feed, trip)
+            update["delay"] = delay if delay is not None else trip_delay
+            update["time"] = event_time
+            update["stop_schedule_relationship"] = relationship
+            yield update
+
+def index_by_route(updates):
+    """Returns the given trip updates grouped by route id."""
+    index = {}
+    for update in updates:
+        index.setdefault(update["route_id"], []).append(update)
+    return index
+
+
+class Gtfs_Realtime_Backend(Transit_Backend):
+    """Builds departure boards from a GTFS-Realtime TripUpdates feed, read from a URL or a local file.
+
+    GTFS-Realtime carries route and direction ids rather than line names and headsigns, so routes
+    maps route ids to the line numbers used in the transport settings and directions maps
+    "route_id:direction_id" (or just the route id) to the direction text the settings match against.
+    Updates giving only a delay without a time cannot be placed and are skipped.
+    """
+
+    def __init__(self, feed, stop_id=None, routes=None, directions=None, allowed_error_count=3):
+        """Initialises the Gtfs_Realtime_Backend class. A stop_id given here takes precedence over the stop setting."""
+        super(Gtfs_Realtime_Backend, self).__init__()
+        self.feed = feed
+        self.feed_stop_id = stop_id
+        self.routes = routes or {}
+        self.directions = directions or {}
+        self.allowed_error_count = allowed_error_count
+        self.updates_by_route = {}
+
+    def configure(self, stop_id, api_base_url):
+        """Sets the stop, unless one was given for the feed."""
+        super(Gtfs_Realtime_Backend, self).configure(self.feed_stop_id or stop_id, api_base_url)
+
+    def _read_feed(self):
+        """Returns the raw feed, or False if it could not be read."""
+        if not self.feed.startswith(("http://", "https://")):
+            try:
+                with open(self.feed, "rb") as feed_file:
+                    return feed_file.read()
+            except IOError as io_error:
+                logger.error("Could not read GTFS-Realtime feed %s: %s", self.feed, io_error)
+                return False
+        for error_count in range(self.allowed_error_count):
+            try:
+                with mhmetrics.api_request_seconds.time():
+                    feed_request = requests.get(self.feed, timeout=self.connection_timeout)
+                feed_request.raise_for_status()
+            except (requests.ConnectionError, requests.HTTPError, requests.TooManyRedirects, requests.Timeout) as e:
+                if error_count < self.allowed_error_count - 1:
+                    mhmetrics.api_retries.inc()
+                    logger.warning("The GTFS-Realtime feed request raised an exception. Waiting 2 seconds. Try %s of %s ...", error_count + 2, self.allowed_error_count)
+                    sleep(2)
+                    continue
+                logger.error("The GTFS-Realtime feed request failed for a total of %s tries. Returning empty result.", self.allowed_error_count)
+                mhmetrics.api_failures.inc()
+                return False
+            mhmetrics.api_response_bytes.inc(len(feed_request.content))
+            return feed_request.content
+
+    def _direction(self, update):
+        """Returns the direction text of a trip update."""
+        direction = self.directions.get("{}:{}".format(update["route_id"], update["direction_id"]))
+        if direction is None:
+            direction = self.directions.get(update["route_id"], "")
+        return direction
+
+    def _journey(self, update):
+        """Returns a trip update as a departureBoard journey, or None if it cannot be placed in time."""
+        if update["schedule_relationship"] == TRIP_CANCELED or update["stop_schedule_relationship"] == STOP_SKIPPED or update["time"] is None:
+            return None
+        real_time = datetime.fromtimestamp(update["time"])
+        scheduled = datetime.fromtimestamp(update["time"] - (update["delay"] or 0))
+        journey = {
+            "Product": {"line": self.routes.get(update["route_id"], update["route_id"])},
+            "direction": self._direction(update),
+            "date": scheduled.strftime("%Y-%m-%d"),
+            "time": scheduled.strftime("%H:%M:%S"),
+            "JourneyDetailRef": {"ref": update["trip_id"]},
+            }
+        if update["stop_schedule_relationship"] != STOP_NO_DATA:
+            journey["rtDate"] = real_time.strftime("%Y-%m-%d")
+            journey["rtTime"] = real_time.strftime("%H:%M:%S")
+        return journey
+
+    def departure_board(self):
+        """Reads the feed and returns the departures of the configured stop as a departure board."""
+        feed = self._read_feed()
+        if feed is False:
+            return False
+        try:
+            self.updates_by_route = index_by_route(decode_trip_updates(feed, self.stop_id))
+        except (IndexError, ValueError, UnicodeDecodeError) as decode_error:
+            logger.error("Could not decode GTFS-Realtime feed: %s", decode_error)
+            return False
+        journeys = [journey for updates in self.updates_by_route.values() for journey in map(self._journey, updates) if journey is not None]
+        logger.debug("  >> %d trip update(s) for stop %s found in GTFS-Realtime feed.", len(journeys), self.stop_id, extra=SAMPLED)
+        departure_board = {"Departure": journeys}
+        mhrecorder.record("departures", departure_board)
+        return departure_board
+
+
+BACKENDS = {
+    "hafas": Hafas_Backend,
+    "gtfs_realtime": Gtfs_Realtime_Backend,
+    }
+
+
+def create_backend(type="hafas", **options):
+    """Returns the backend of the given type, configured with the given options."""
+    if type not in BACKENDS:
+        raise ValueError("Unknown transit backend {!r}, expected one of: {}".format(type, ", ".join(sorted(BACKENDS))))
+    return BACKENDS[type](**options)
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# mobiHue.py - announces real time bus arrivals using Philipps Hue lights
+# (c) 2017, 2018 Federico Gentile
+# Benchmark suite for the schedule, colour conversion and control loop hot paths.
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import zipfile
+from datetime import datetime, timedelta
+from time import perf_counter
+from mobifunctions import VERSION
+from mhbackends import Gtfs_Realtime_Backend
+from mhfakebridge import Fake_Bridge
+from mhtimetable import build_index, Timetable
+from rgb_xy import Converter, GamutC
+from schedule import Schedule
+
+
+logger = logging.getLogger("mH." + __name__)
+
+BOARD_SIZES = (10, 100, 1000, 5000)
+
+BENCHMARK_CONFIG = """
+stop: id=A=1@O=Benchmark@L=1@
+interval: 10
+transport:
+ - number   : 5
+   direction: Bertrange
+ - number   : 6
+   direction: Bertrange
+ - number   : 15
+   direction: Merl
+zones:
+ imminent:     {minutes: 0, scene: , colour: red, effect: blink}
+ close:        {minutes: 2, scene: , colour: red, effect: None}
+ intermediate: {minutes: 5, scene: , colour: orange, effect: None}
+ further:      {scene: , colour: green, effect: None}
+ warning:      {scene: , colour: cyan, effect: None}
+hue:
+ ip : 127.0.0.1
+ key: benchmark
+ light_id: 1
+ sensor_id:
+ on_switch_id:
+use_on_switch:   False
+use_kill_switch: False
+mobiliteit_url: http://127.0.0.1/departureBoard?accessId=cdt&format=json&
+"""
+
+
+def synthetic_board(journeys, now=None, seed=0):
+    """Returns a HAFAS departureBoard response with the given number of journeys, roughly a third of which match the benchmark configuration."""
+    rng = random.Random(seed)
+    now = (now or datetime.now()).replace(second=0, microsecond=0)
+    lines = (("5", "Luxembourg, Bertrange"), ("6", "Bertrange, Gare"), ("15", "Merl, Centre"), ("16", "Kirchberg"), ("22", "Cents"), ("30", "Bettembourg"))
+    departures = []
+    for index in range(journeys):
+        line, direction = lines[index % len(lines)]
+        scheduled = now + timedelta(minutes=index * 60 // max(journeys, 1) + 1)
+        journey = {
+            "Product": {"line": line, "name": "Bus " + line},
+            "direction": direction,
+            "date": scheduled.strftime("%Y-%m-%d"),
+            "time": scheduled.strftime("%H:%M:%S"),
+            "JourneyDetailRef": {"ref": "1|{}|0|82|{}".format(index, scheduled.strftime("%d%m%Y"))},
+            }
+        if rng.random() < 0.7:
+            real_time = scheduled + timedelta(minutes=rng.choice((0, 0, 1, 2, 3)))
+            journey["rtDate"] = real_time.strftime("%Y-%m-%d")
+            journey["rtTime"] = real_time.strftime("%H:%M:%S")
+        departures.append(journey)
+    return {"Departure": departures}
+
+
+def _varint(value):
+    """Returns the protocol buffer encoding of a non-negative or 64 bit signed integer."""
+    value &= (1 << 64) - 1
+    encoded = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+
+def _field(number, value):
+    """Returns a protocol buffer field holding an integer, a string or an already encoded message."""
+    if isinstance(value, int):
+        return _varint(number << 3) + _varint(value)
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    return _varint(number << 3 | 2) + _varint(len(value)) + value
+
+def synthetic_feed(trips, stop_id="1001", stops_per_trip=20, now=None, seed=0):
+    """Returns a GTFS-Realtime TripUpdates feed with the given number of trips, each with updates for several stops, roughly a third of which serve the given stop."""
+    rng = random.Random(seed)
+    timestamp = int((now or datetime.now()).timestamp())
+    routes = ("5", "6", "15", "16", "22", "30")
+    entities = []
+    for index in range(trips):
+        route = routes[index % len(routes)]
+        trip = _field(1, "trip-{}".format(index)) + _field(5, route) + _field(6, index % 2)
+        served = index % 3 == 0
+        stop_time_updates = b""
+        for sequence in range(stops_per_trip):
+            stop = stop_id if served and sequence == stops_per_trip // 2 else "{}".format(2000 + sequence)
+            delay = rng.choice((0, 0, 60, 120, 180))
+            departure = _field(1, delay) + _field(2, timestamp + index * 60 + sequence * 90 + delay)
+            stop_time_updates += _field(2, _field(1, sequence) + _field(4, stop) + _field(3, departure))
+        entities.append(_field(2, _field(1, "entity-{}".format(index)) + _field(3, _field(1, trip) + stop_time_updates)))
+    header = _field(1, _field(1, "2.0") + _field(3, timestamp))
+    return header + b"".join(entities)
+
+
+def synthetic_gtfs(path, trips_per_line=100, stop_id="1001", stops_per_trip=20):
+    """Writes a static GTFS zip with weekday and weekend services of six lines, each trip serving the given stop half way."""
+    routes = ("5", "6", "15", "16", "22", "30")
+    stop_times = ["trip_id,arrival_time,departure_time,stop_id,stop_sequence"]
+    trips = ["route_id,service_id,trip_id,trip_headsign,direction_id"]
+    for route in routes:
+        for index in range(trips_per_line):
+            trip_id = "{}-{}".format(route, index)
+            service_id = "weekday" if index % 3 else "weekend"
+            trips.append("{},{},{},{} Terminus,{}".format(route, service_id, trip_id, route, index % 2))
+            start = 5 * 3600 + index * 18 * 3600 // trips_per_line
+            for sequence in range(stops_per_trip):
+                stop = stop_id if sequence == stops_per_trip // 2 else str(2000 + sequence)
+                departure = start + sequence * 90
+                stop_times.append("{},{},{},{},{}".format(trip_id, *["{:02d}:{:02d}:{:02d}".format(departure // 3600, departure // 60 % 60, departure % 60)] * 2, stop, sequence))
+    with zipfile.ZipFile(path, "w") as gtfs_zip:
+        gtfs_zip.writestr("routes.txt", "route_id,route_short_name,route_long_name\n" + "\n".join("{0},{0},Line {0}".format(route) for route in routes))
+        gtfs_zip.writestr("trips.txt", "\n".join(trips))
+        gtfs_zip.writestr("stop_times.txt", "\n".join(stop_times))
+        gtfs_zip.writestr("calendar.txt", "service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date\nweekday,1,1,1,1,1,0,0,20170101,20991231\nweekend,0,0,0,0,0,1,1,20170101,20991231")
+
+
+def measure(func, min_time=0.2, repeat=5):
+    """Calls func repeatedly and returns timing statistics in microseconds per call."""
+    iterations = 1
+    while True:
+        start = perf_counter()
+        for _ in range(iterations):
+            func()
+        elapsed = perf_counter() - start
+        if elapsed >= min_time / repeat or iterations >= 1 << 20:
+            break
+        iterations *= 2
+    samples = []
+    for _ in range(repeat):
+        start = perf_counter()
+        for _ in range(iterations):
+            func()
+        samples.append((perf_counter() - start) / iterations)
+    return {
+        "iterations": iterations * repeat,
+        "mean_us": statistics.mean(samples) * 1e6,
+        "median_us": statistics.median(samples) * 1e6,
+        "min_us": min(samples) * 1e6,
+        "ops_per_s": 1 / min(samples),
+        }
+
+
+class Benchmark:
+    """Runs all benchmarks and collects their results."""
+
+    def __init__(self, min_time=0.2, board_sizes=BOARD_SIZES):
+        """Initialises the Benchmark class."""
+        self.min_time = min_time
+        self.board_sizes = board_sizes
+        self.results = {}
+        self.work_dir = tempfile.mkdtemp(prefix="mobihue-benchmark-")
+        self.config_file_path = os.path.join(self.work_dir, "config.yaml")
+        with open(self.config_file_path, "w") as config_file:
+            config_file.write(BENCHMARK_CONFIG)
+
+    def _record(self, name, func, **params):
+        """Measures func and stores the result under the given name. Benchmarks with missing dependencies are reported as skipped."""
+        try:
+            result = measure(func, self.min_time)
+        except ImportError as import_error:
+            logger.warning("Skipping benchmark %s: %s", name, import_error)
+            result = {"skipped": str(import_error)}
+        result.update(params)
+        self.results[name] = result
+        return result
+
+    def _settings(self):
+        """Returns benchmark settings, importing the settings module on demand."""
+        from settings import Settings
+        return Settings(self.config_file_path)
+
+    def schedule_update(self):
+        """Measures updates from unchanged synthetic departure boards of different sizes, served from the journey cache, and the same updates with an empty cache."""
+        zones = {"imminent": {"minutes": 0}, "close": {"minutes": 2}, "intermediate": {"minutes": 5}}
+        transport = [{"number": 5, "direction": "Bertrange"}, {"number": 6, "direction": "Bertrange"}, {"number": 15, "direction": "Merl"}]
+        for size in self.board_sizes:
+            board = synthetic_board(size)
+            schedule = Schedule(transport, "id=1", "http://127.0.0.1/", zones, source=lambda: board)
+            result = self._record("schedule_update_{}".format(size), schedule.update, journeys=size)
+            result["us_per_journey"] = result["min_us"] / size
+
+            def cold_update():
+                schedule.journey_cache = {}
+                return schedule.update()
+            result = self._record("schedule_update_cold_{}".format(size), cold_update, journeys=size)
+            result["us_per_journey"] = result["min_us"] / size
+
+    def gtfs_realtime_update(self):
+        """Measures reading and decoding a local GTFS-Realtime feed and parsing the resulting departures."""
+        zones = {"imminent": {"minutes": 0}, "close": {"minutes": 2}, "intermediate": {"minutes": 5}}
+        transport = [{"number": 5, "direction": "Bertrange"}, {"number": 6, "direction": "Bertrange"}, {"number": 15, "direction": "Merl"}]
+        directions = {"5": "Luxembourg, Bertrange", "6": "Bertrange, Gare", "15": "Merl, Centre"}
+        for size in self.board_sizes:
+            feed_path = os.path.join(self.work_dir, "feed-{}.pb".format(size))
+            with open(feed_path, "wb") as feed_file:
+                feed_file.write(synthetic_feed(size))
+            backend = Gtfs_Realtime_Backend(feed_path, "1001", directions=directions)
+            schedule = Schedule(transport, "id=1", "http://127.0.0.1/", zones, backend=backend)
+            result = self._record("gtfs_realtime_update_{}".format(size), schedule.update, trips=size)
+            result["us_per_trip"] = result["min_us"] / size
+            result["departures"] = schedule.total_departures
+
+    def timetable_lookup(self):
+        """Measures building a static timetable index and looking up the next scheduled departures in it."""
+        gtfs_path = os.path.join(self.work_dir, "gtfs.zip")
+        index_path = os.path.join(self.work_dir, "timetable.idx")
+        synthetic_gtfs(gtfs_path)
+        self._record("timetable_build", lambda: build_index(gtfs_path, "1001", ["5", "6", "15"], index_path))
+        timetable = Timetable(index_path)
+        moment = datetime.now().replace(hour=12, minute=0, second=0, microsecond=0)
+        result = self._record("timetable_next_departures", lambda: timetable.next_departures(moment))
+        result["departures"] = len(timetable.next_departures(moment))
+        timetable.close()
+
+    def colour_conversion(self):
+        """Measures the RGB to XY and XY to RGB conversions."""
+        converter = Converter(GamutC)
+        self._record("rgb_to_xy", lambda: converter.rgb_to_xy(255, 165, 0))
+        self._record("xy_to_rgb", lambda: converter.xy_to_rgb(0.5614, 0.4156))
+
+    def settings_build(self):
+        """Measures building the settings with and without the compiled settings cache."""
+        cache_file_path = self.config_file_path + ".cache"
+
+        def cold_build():
+            if os.path.exists(cache_file_path):
+                os.remove(cache_file_path)
+            self._settings()
+
+        self._record("settings_build_cold", cold_build)
+        self._record("settings_build_cached", self._settings)
+
+    def control_cycle(self):
+        """Measures a full control loop cycle against a fake departure API and a fake bridge."""
+        def cycle():
+            controller._kill_check()
+            controller.run_loop_count = 0
+            controller._run_cycle()
+
+        try:
+            from mhcontroller import Controller
+            board = synthetic_board(100)
+            bridge = Fake_Bridge()
+            controller = Controller(settings=self._settings(), bridge=bridge, source=lambda: board)
+        except ImportError as import_error:
+            logger.warning("Skipping benchmark control_cycle: %s", import_error)
+            self.results["control_cycle"] = {"skipped": str(import_error)}
+            return
+        self._record("control_cycle", cycle, journeys=100)
+        self.results["control_cycle"]["bridge_commands"] = len(bridge.commands)
+
+    def run(self):
+        """Runs every benchmark and returns the results."""
+        try:
+            self.schedule_update()
+            self.gtfs_realtime_update()
+            self.timetable_lookup()
+            self.colour_conversion()
+            self.settings_build()
+            self.control_cycle()
+        finally:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+        return {
+            "version": VERSION,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": datetime.now().isoformat(),
+            "results": self.results,
+            }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the mobiHue hot paths and writes the results as JSON.")
+    parser.add_argument("-o", "--output", help="file to write the JSON results to (default: standard output)")
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum time in seconds spent measuring each benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=BOARD_SIZES, help="departure board sizes to benchmark")
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    report = Benchmark(arguments.min_time, arguments.sizes).run()
+    if arguments.output:
+        with open(arguments.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# mobiHue.py - announces real time bus arrivals using Philipps Hue lights
+# (c) 2017, 2018 Federico Gentile
+# Injectable clock used instead of calling datetime.now(), time() and sleep() directly.
+
+import logging
+import time as _time
+from datetime import datetime, timedelta
+
+
+logger = logging.getLogger("mH." + __name__)
+
+
+class Clock:
+    """Wall clock used during normal operation."""
+
+    def now(self):
+        """Returns the current local date and time."""
+        return datetime.now()
+
+    def time(self):
+        """Returns the current time as seconds since the epoch."""
+        return _time.time()
+
+    def sleep(self, seconds):
+        """Suspends execution for the given number of seconds."""
+        _time.sleep(seconds)
+
+
+class Virtual_Clock(Clock):
+    """Clock starting at a given point in time that only advances when slept on, optionally running faster than real time.
+
+    A speed of 100 sleeps one real second for every 100 virtual seconds, a speed of None does not
+    sleep at all. Once the virtual time reaches until, on_end is called once.
+    """
+
+    def __init__(self, start, speed=100.0, until=None, on_end=None):
+        """Initialises the Virtual_Clock class."""
+        self.start = start
+        self.speed = speed
+        self.until = until
+        self.on_end = on_end
+        self.elapsed = 0.0
+        self.ended = False
+
+    def now(self):
+        """Returns the current virtual local date and time."""
+        return self.start + timedelta(seconds=self.elapsed)
+
+    def time(self):
+        """Returns the current virtual time as seconds since the epoch."""
+        return self.now().timestamp()
+
+    def sleep(self, seconds):
+        """Advances the virtual time, sleeping for a fraction of the given number of seconds."""
+        if self.speed:
+            _time.sleep(seconds / self.speed)
+        self.elapsed += seconds
+        if self.until is not None and not self.ended and self.now() >= self.until:
+            self.ended = True
+            logger.debug("  >> Virtual clock reached its end time: %s", self.until)
+            if self.on_end is not None:
+                self.on_end()
+
+
+_clock = Clock()
+
+
+def get_clock():
+    """Returns the clock currently in use."""
+    return _clock
+
+def set_clock(clock):
+    """Replaces the clock used by the whole program and returns the previous one."""
+    global _clock
+    previous_clock, _clock = _clock, clock
+    return previous_clock
+
+def now():
+    """Returns the current local date and time of the clock in use."""
+    return _clock.now()
+
+def time():
+    """Returns the current time in seconds since the epoch of the clock in use."""
+    return _clock.time()
+
+def sleep(seconds):
+    """Sleeps for the given number of seconds on the clock in use."""
+    _clock.sleep(seconds)
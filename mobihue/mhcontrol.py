@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# mobiHue.py - announces real time bus arrivals using Philipps Hue lights
+# (c) 2017, 2018 Federico Gentile
+# Local Unix socket control interface for status queries and commands.
+
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+
+
+logger = logging.getLogger("mH." + __name__)
+
+DEFAULT_SOCKET_PATH = "/tmp/mobiHue.sock"
+
+
+class Control_Server:
+    """Answers one-line commands on a Unix socket from a background thread, with one JSON line per command.
+
+    Handlers are called with the command's arguments and must not block, as they run alongside
+    the control loop. Responses that are needed often, like the status, should be prepared by
+    the control loop and only handed out here.
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH, handlers=None):
+        """Initialises the Control_Server class."""
+        self.path = path
+        self.handlers = handlers or {}
+        server = self
+
+        class Control_Request_Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    self.wfile.write(server.respond(line.decode("utf-8", "replace")))
+                    self.wfile.flush()
+
+        if os.path.exists(path):
+            os.remove(path)
+        self.server = socketserver.ThreadingUnixStreamServer(path, Control_Request_Handler)
+        self.server.daemon_threads = True
+        os.chmod(path, 0o600)
+        self.thread = threading.Thread(target=self.server.serve_forever, name="control", daemon=True)
+
+    def respond(self, line):
+        """Returns the encoded response to a single command line."""
+        arguments = line.split()
+        if not arguments:
+            return b'{"error": "empty command"}\n'
+        handler = self.handlers.get(arguments[0].lower())
+        if handler is None:
+            return json.dumps({"error": "unknown command", "commands": sorted(self.handlers)}).encode("utf-8") + b"\n"
+        try:
+            response = handler(*arguments[1:])
+        except Exception as handler_error:
+            logger.warning("Control command %r failed: %s", line.strip(), handler_error)
+            return json.dumps({"error": str(handler_error)}).encode("utf-8") + b"\n"
+        if isinstance(response, bytes):
+            return response
+        return json.dumps(response, default=str).encode("utf-8") + b"\n"
+
+    def start(self):
+        """Starts answering commands."""
+        self.thread.start()
+        logger.info("Control socket listening on %s.", self.path)
+        return self
+
+    def stop(self):
+        """Stops answering commands and removes the socket."""
+        self.server.shutdown()
+        self.server.server_close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        return True
+
+
+def control_request(command, path=DEFAULT_SOCKET_PATH, timeout=1.0):
+    """Sends a single command to a running program and returns its decoded response."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as control_socket:
+        control_socket.settimeout(timeout)
+        control_socket.connect(path)
+        control_socket.sendall(command.encode("utf-8") + b"\n")
+        response = b""
+        while not response.endswith(b"\n"):
+            chunk = control_socket.recv(65536)
+            if not chunk:
+                break
+            response += chunk
+    return json.loads(response.decode("utf-8"))
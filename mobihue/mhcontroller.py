@@ -7,13 +7,33 @@
 
 import logging
 import logging.handlers
-from time import sleep, time
+import os
+import sys
+import gc
+import json
+import subprocess
+import threading
+from time import perf_counter
+from mhclock import now, sleep
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from service import find_syslog, Service
 from settings import Settings
 from schedule import Schedule
 from huecontrols import Hue_Control
 from signalhandler import Signal_Handler
 from mhplugin import Pluginmanager
+from mobifunctions import SAMPLED, Background_Log_Handler
+import mhmetrics
+import mhtrace
+from mhwatchdog import Watchdog
+from mhhistory import History, History_Recorder
+from mhpredictor import Delay_Predictor
+from mhbackends import create_backend
+from mhtimetable import Timetable
+import mhmemory
+from mhcontrol import Control_Server
+from mhidle import Idle_Planner
 
 
 logger = logging.getLogger("mH." + __name__)
@@ -24,9 +44,15 @@ class Controller(Service):
 
     SENSOR_IGNORE_BUTTONS = (2000, 2001, 2002, 2003, 3000, 3001, 3002, 3003)
     SENSOR_NO_RESET_BUTTONS = (2000, 2001, 2002, 2003, 3000, 3001, 3002, 3003, 4000, 4001, 4002, 4003)
+    STATUS_DEPARTURES = 5
+    RESTART_SECTIONS = ("use_on_switch", "metrics", "profiling", "watchdog", "history", "prediction", "backend", "control")
 
-    def __init__(self, as_service=False, with_logger=None):
-        """Initialises the Controller class."""
+    def __init__(self, as_service=False, with_logger=None, settings=None, bridge=None, source=None):
+        """Initialises the Controller class. Settings, a bridge object and a departure board source can be injected instead of being read from the configuration file and the network."""
+        self.injected_settings = settings
+        self.injected_bridge = bridge
+        self.injected_source = source
+        self.watchdog = None
         if as_service:
             super(Controller, self).__init__("mobiHue", pid_dir="/tmp")
             self.is_service = True
@@ -34,6 +60,8 @@ class Controller(Service):
             if with_logger is not None:
                 self.original_logger = with_logger
                 self.logger = logging.getLogger("mH." + __name__)
+                # Handlers behind a background handler are not found among the logger's handlers by the daemon context
+                self.files_preserve = [stream for handler in with_logger.handlers if isinstance(handler, Background_Log_Handler) for stream in handler.file_handles()]
             global logger
             logger = self.logger
         elif not as_service:
@@ -46,40 +74,136 @@ class Controller(Service):
         return cls(True, with_logger)
 
     def _deferred_init(self):
-        """Deferred initialisation of the class, used in case the class is used as a service."""
-        self.settings = Settings()
-        self.schedule = Schedule(self.settings.transport, self.settings.stop, self.settings.mobiliteit_url, self.settings.zones)
-        self._cyclable_init()
-        self.plugin_mgr = Pluginmanager(True)
+        """Deferred initialisation of the class, used in case the class is used as a service.
+
+        Capturing the bridge state, loading the plugins and fetching the first schedule do not
+        depend on each other and are run concurrently once the settings are available.
+        """
+        self.startup_start = perf_counter()
+        self.startup_timings = {}
+        if self.injected_settings is None:
+            self.settings = self._timed("settings", Settings)
+        else:
+            self.settings = self.injected_settings
+        self.metrics_server = None
+        if getattr(self.settings, "metrics", None):
+            self.metrics_server = mhmetrics.Metrics_Server(**self.settings.metrics).start()
+        if getattr(self.settings, "tracing", None):
+            mhtrace.configure(**self.settings.tracing)
+        self.profiler = mhtrace.Sampling_Profiler(**(getattr(self.settings, "profiling", None) or {}))
+        self.memory_settings = getattr(self.settings, "memory", None) or {}
+        if self.memory_settings.get("tracemalloc"):
+            mhmemory.start_tracing()
+        self.history = None
+        if getattr(self.settings, "history", None):
+            self.history = History_Recorder(**self.settings.history)
+        backend = create_backend(**(getattr(self.settings, "backend", None) or {}))
+        backend.connection_timeout = getattr(self.settings, "connection_timeout", 10)
+        self.schedule = Schedule(self.settings.transport, self.settings.stop, self.settings.mobiliteit_url, self.settings.zones, self.settings.transport_index, self.settings.zone_thresholds, self.injected_source, backend)
+        self.predictor = None
+        if getattr(self.settings, "prediction", None) is not None:
+            self.predictor = Delay_Predictor(self.settings.prediction.get("min_samples", 5))
+            if self.history is not None:
+                self._timed("prediction", self.predictor.load_history, History(self.history.directory), self.settings.prediction.get("weeks", 4))
+            self.schedule.predictor = self.predictor
+        if getattr(self.settings, "timetable", None):
+            self.schedule.timetable = Timetable(**self.settings.timetable)
+        self.idle_planner = None
+        if getattr(self.settings, "idle", None):
+            self.idle_planner = Idle_Planner(**self.settings.idle)
+        self.paused = False
+        # Set from the control socket thread and acted upon by the control loop
+        self.refresh_requested = threading.Event()
+        self.pause_requested = threading.Event()
+        self.status_response = b"{}\n"
+        self.cache_times = {"settings": perf_counter()}
+        # Outside of the active hours, the departure API is not called until they begin
+        quiet = self.idle_planner is not None and self.idle_planner.quiet_until(now()) is not None
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            hue_control_future = executor.submit(self._timed, "hue_control", Hue_Control, bridge=self.injected_bridge, **self.settings.hue)
+            plugin_mgr_future = executor.submit(self._timed, "plugins", Pluginmanager, True)
+            schedule_future = None if quiet else executor.submit(self._timed, "first_update", self.schedule.update)
+            hue_control = hue_control_future.result()
+            self.plugin_mgr = plugin_mgr_future.result()
+            if schedule_future is not None:
+                schedule_future.result()
+        self.cache_times["schedule"] = self.cache_times["bridge_state"] = perf_counter()
+        self.signal_handler = Signal_Handler(handle_sigint=not self.is_service, handle_sigusr1=True, handle_sigusr2=True)
+        self._cyclable_init(hue_control)
+        self.schedule_primed = not quiet
+        self._publish_status()
+        self.control_server = None
+        if getattr(self.settings, "control", None):
+            self.control_server = Control_Server(handlers={
+                "status": lambda: self.status_response,
+                "stats": self._stats,
+                "refresh": self._request_refresh,
+                "pause": lambda: self._set_paused(True),
+                "resume": lambda: self._set_paused(False),
+                "loglevel": self._set_log_level,
+                }, **self.settings.control).start()
+        self.startup_timings["total"] = perf_counter() - self.startup_start
+        logger.info("Start-up timings: %s", ", ".join("{} {:.1f} ms".format(stage, duration * 1000) for stage, duration in self.startup_timings.items()))
         self.initialised = True
 
-    def _cyclable_init(self):
-        if not self.is_service:
-            self.signal_handler = Signal_Handler()
-        self.hue_control = Hue_Control(**self.settings.hue)
+    def _timed(self, stage, func, *args, **kwargs):
+        """Runs a start-up stage and records how long it took."""
+        stage_start = perf_counter()
+        result = func(*args, **kwargs)
+        self.startup_timings[stage] = perf_counter() - stage_start
+        return result
+
+    def _cyclable_init(self, hue_control=None):
+        if hue_control is None:
+            hue_control = Hue_Control(bridge=self.injected_bridge, **self.settings.hue)
+            self.cache_times["bridge_state"] = perf_counter()
+            self.schedule_primed = False
+        self.hue_control = hue_control
         self.last_zone = None
         self.current_zone = None
         self.sensor_last_action = None
         self.run_loop_count = 0
+        self.idle_until = None
+        self.idle_quiet = False
+        self.idle_overridden = False
         self.sigterm_caught = False
         self.sigint_caught = False
 
     def _schedule_to_light(self):
         """Sets the Hue light colour according to the estimated time of arrival of the next bus."""
-        self.schedule.update()
-        if self.schedule.next_departure is None:
-            self.current_zone = "warning"
-            logger.debug("  >> No next departure found. Warning zone enabled.")
+        if self.schedule_primed:
+            logger.debug("  >> Using the schedule fetched during start-up.")
+            self.schedule_primed = False
         else:
-            self.current_zone = self.schedule.next_departure.zone
-        if self.current_zone != self.last_zone or (self.hue_control.light_mode == "states" and self.settings.zones[self.current_zone]["hue_state"]["alert"] != "none"):
+            self.schedule.update()
+            self.cache_times["schedule"] = perf_counter()
+        with mhtrace.span("zone"):
+            if self.schedule.next_departure is None:
+                self.current_zone = "warning"
+                logger.debug("  >> No next departure found. Warning zone enabled.")
+            else:
+                self.current_zone = self.schedule.next_departure.zone
+            if self.hue_control.transitions is not None:
+                # Zone changes carried out by bridge schedules since the last update need no command
+                self.last_zone = self.hue_control.transitions.expected_zone(now()) or self.last_zone
+            zone_changed = self.current_zone != self.last_zone or (self.hue_control.light_mode == "states" and self.settings.zones[self.current_zone]["hue_state"]["alert"] != "none")
+        if self.hue_control.light_mode == "entertainment" and self.schedule.next_departure is not None:
+            self.hue_control.slave.countdown(self.schedule.next_departure.eta.total_seconds())
+        if zone_changed:
             logger.debug("  >> Zone change detected, synching light to schedule.")
-            self.hue_control.slave.set_zone(self.current_zone)
+            with mhtrace.span("bridge_write", zone=self.current_zone):
+                self.hue_control.slave.set_zone(self.current_zone)
+            mhmetrics.zone_changes.inc()
+            if "first_colour" not in self.startup_timings:
+                self.startup_timings["first_colour"] = perf_counter() - self.startup_start
+                logger.info("First colour shown %.1f ms after start-up began.", self.startup_timings["first_colour"] * 1000)
             self.last_zone = self.current_zone
-            return True
         else:
-            logger.debug("  >> No zone change detected. Light still in sync with schedule.")
-            return False
+            logger.debug("  >> No zone change detected. Light still in sync with schedule.", extra=SAMPLED)
+        if self.hue_control.transitions is not None and self.schedule.last_update:
+            with mhtrace.span("bridge_schedules"):
+                self.hue_control.transitions.update([self.schedule.last_update + bus.eta for bus in self.schedule.all_departures or []], self.schedule.zone_thresholds)
+        return zone_changed
 
     def _reset_check(self):
         """Checks if a reset to the Hue light's original state is warranted."""
@@ -89,7 +213,7 @@ class Controller(Service):
             logger.debug("  >> Reset check: Reset is warranted.")
             return True
         else:
-            logger.debug("  >> Reset check: No reset needed.")
+            logger.debug("  >> Reset check: No reset needed.", extra=SAMPLED)
             return False
 
     def _kill_check(self):
@@ -104,10 +228,10 @@ class Controller(Service):
                     logger.debug("  >> Kill check positive: Sensor actioned with hot button.")
                     return True
                 else:
-                    logger.debug("  >> Kill check negative: Sensor actioned, but no hot button pressed.")
+                    logger.debug("  >> Kill check negative: Sensor actioned, but no hot button pressed.", extra=SAMPLED)
                     return False
             else:
-                logger.debug("  >> Kill check negative: No sensor action, no SIGINT, no SIGTERM received.")
+                logger.debug("  >> Kill check negative: No sensor action, no SIGINT, no SIGTERM received.", extra=SAMPLED)
                 return False
         elif self.sigint_caught:
             logger.debug("  >> Kill check positive: SIGINT received.")
@@ -117,23 +241,94 @@ class Controller(Service):
             return True
 
     def _sigint_check(self):
-        """Checks if SIGINT was received in case the Controller was initialised in standalone mode."""
+        """Checks if SIGINT was received in case the Controller was initialised in standalone mode. Once caught, it stays caught."""
         if not self.is_service:
-            self.sigint_caught = self.signal_handler.sigint_caught
+            self.sigint_caught = self.sigint_caught or self.signal_handler.sigint_caught
             return self.sigint_caught
         elif self.is_service:
             self.sigint_caught = False
             return False
 
     def _sigterm_check(self):
-        """Checks if SIGTERM was received in case the Controller was initialised as a service."""
+        """Checks if SIGTERM was received in case the Controller was initialised as a service. Once caught, it stays caught."""
         if self.is_service:
-            self.sigterm_caught = self.got_sigterm()
+            self.sigterm_caught = self.sigterm_caught or self.got_sigterm()
             return self.sigterm_caught
         elif not self.is_service:
             self.sigterm_caught = False
             return False
 
+    def _reload_check(self):
+        """Reloads the settings if a SIGHUP was received or the configuration file has changed."""
+        if self.signal_handler.sighup_caught:
+            logger.info("SIGHUP received, reloading configuration.")
+        elif self.settings.file_has_changed():
+            logger.info("Configuration file changed, reloading configuration.")
+        else:
+            return False
+        return self._reload_settings()
+
+    def _diagnostics_check(self):
+        """Starts or stops the sampling profiler if a SIGUSR1 was received and logs a memory report if a SIGUSR2 was received."""
+        if self.signal_handler.sigusr1_caught:
+            self.profiler.toggle()
+        if self.signal_handler.sigusr2_caught:
+            mhmemory.log_memory_report()
+
+    def _reload_settings(self):
+        """Re-reads the configuration file and only rebuilds the parts of the program affected by the changes."""
+        try:
+            new_settings = Settings(self.settings.full_config_file_path)
+        except Exception as reload_error:
+            logger.error("Could not reload configuration, keeping the running configuration: %s", reload_error)
+            self.settings.acknowledge_file_change()
+            return False
+        changed = self.settings.changed_sections(new_settings)
+        logger.info("Changed configuration sections: %s", ", ".join(sorted(changed)) if changed else "none")
+        if changed & {"transport", "stop", "mobiliteit_url", "zones"}:
+            self.schedule.configure(new_settings.transport, new_settings.stop, new_settings.mobiliteit_url, new_settings.zones, new_settings.transport_index, new_settings.zone_thresholds)
+            self.run_loop_count = 0
+            logger.debug("  >> Schedule reconfigured, refreshing on next tick.")
+        if "hue" in changed:
+            old_hue, new_hue = self.settings.hue, new_settings.hue
+            if any(old_hue.get(key) != new_hue.get(key) for key in Hue_Control.CONNECTION_SETTINGS) or ("states" in old_hue) != ("states" in new_hue):
+                logger.info("Hue connection settings changed, reconnecting to the bridge.")
+                if self.hue_control.transitions is not None:
+                    self.hue_control.transitions.clear()
+                self.hue_control.slave.reset()
+                self.hue_control = Hue_Control(bridge=self.injected_bridge, **new_hue)
+                self.cache_times["bridge_state"] = perf_counter()
+                self.hue_control.slave.on()
+            else:
+                self.hue_control.update_zones(new_hue.get("states"), new_hue.get("scenes"))
+                # Installed bridge schedules still carry the previous states or scenes
+                if self.hue_control.transitions is not None:
+                    self.hue_control.transitions.clear()
+            # Writes the current zone with its new state or scene on this tick
+            self.last_zone = None
+            self.run_loop_count = 0
+        if "connection_timeout" in changed:
+            self.schedule.backend.connection_timeout = getattr(new_settings, "connection_timeout", 10)
+        if "tracing" in changed:
+            mhtrace.configure(**(getattr(new_settings, "tracing", None) or {}))
+        if "memory" in changed:
+            self.memory_settings = getattr(new_settings, "memory", None) or {}
+            if self.memory_settings.get("tracemalloc"):
+                mhmemory.start_tracing()
+            else:
+                mhmemory.stop_tracing()
+        if "idle" in changed:
+            self.idle_planner = Idle_Planner(**new_settings.idle) if getattr(new_settings, "idle", None) else None
+        if "timetable" in changed:
+            if self.schedule.timetable is not None:
+                self.schedule.timetable.close()
+            self.schedule.timetable = Timetable(**new_settings.timetable) if getattr(new_settings, "timetable", None) else None
+        for section in sorted(changed & set(self.RESTART_SECTIONS)):
+            logger.warning("Changes to %s only take effect after a restart.", section)
+        self.settings = new_settings
+        self.cache_times["settings"] = perf_counter()
+        return True
+
     def _run_with_on_switch(self):
         """Provides a runtime-wrapper to operate the program with an on-switch."""
         self.on_switch_running = True
@@ -141,47 +336,235 @@ class Controller(Service):
             if self.hue_control.on_switch.poll():
                 logger.info("On-switch actioned. Starting runtime.")
                 self._cyclable_init()
+                # Starting with the on-switch overrides quiet hours or a service gap in progress
+                self.idle_overridden = True
                 self._run_core()
                 if not self.sigint_caught and not self.sigterm_caught:
                     logger.info("Watching on-switch ...")
             else:
-                logger.debug("  >> On-switch not actioned. Polling again in 1 second.")
+                logger.debug("  >> On-switch not actioned. Polling again in 1 second.", extra=SAMPLED)
                 self._sigterm_check()
                 self._sigint_check()
+                self._reload_check()
+                self._diagnostics_check()
+            self._heartbeat()
             sleep(1)
         logger.info("Stopping on-switch polling routine as SIGINT or SIGTERM has been received.")
 
     def _run_core(self):
         """Provides the core runtime for the synchronisation of the lights to the schedule."""
-        logger.info("Turning light on if needed.")
-        self.hue_control.slave.on()
+        if not self._quiet_check():
+            logger.info("Turning light on if needed.")
+            self.hue_control.slave.on()
         self.plugin_mgr.begin()
+        last_tick = None
         while not self._kill_check():
-            if self.run_loop_count == 0:
-                logger.info("Synching light to schedule.")
-                self._schedule_to_light()
-                logger.info("Next bus: %s", str(self.schedule.next_departure))
-                self.plugin_mgr.data(self.schedule.all_departures)
-            elif self.run_loop_count == self.settings.interval:
-                self.run_loop_count = -1
-            self.run_loop_count += 1
+            tick_start = perf_counter()
+            if last_tick is not None:
+                mhmetrics.tick_lag_seconds.observe(max(0.0, tick_start - last_tick - 1))
+            last_tick = tick_start
+            self._run_cycle()
+            if self.idle_until is not None:
+                self._idle()
+                last_tick = None
+            self._heartbeat()
             sleep(1)
         logger.info("Synchronisation stopped. Resetting light if needed.")
         self.plugin_mgr.end()
+        if self.hue_control.transitions is not None:
+            self.hue_control.transitions.clear()
         if self.sigint_caught or self.sigterm_caught or self._reset_check():
             self.hue_control.slave.reset()
+        elif self.hue_control.light_mode == "entertainment":
+            self.hue_control.slave.stop()
+
+    def _control_check(self):
+        """Carries out the refresh, pause and resume requests received over the control socket."""
+        if self.refresh_requested.is_set():
+            self.refresh_requested.clear()
+            self.run_loop_count = 0
+        paused = self.pause_requested.is_set()
+        if paused != self.paused:
+            logger.info("Synchronisation %s over the control socket.", "paused" if paused else "resumed")
+            self.paused = paused
+            self._publish_status()
+
+    def _run_cycle(self):
+        """Runs a single one second tick of the synchronisation loop."""
+        self._reload_check()
+        self._diagnostics_check()
+        self._control_check()
+        if self.paused:
+            if self.hue_control.transitions is not None and self.hue_control.transitions.installed:
+                self.hue_control.transitions.clear()
+            # The schedule is refreshed as soon as synchronisation resumes
+            self.run_loop_count = 0
+            return
+        if self.run_loop_count == 0:
+            if self._quiet_check():
+                return
+            with mhtrace.span("cycle"):
+                logger.info("Synching light to schedule.")
+                self._schedule_to_light()
+                logger.info("Next bus: %s", self.schedule.next_departure)
+                if self.history is not None:
+                    self.history.observe_events(self.schedule.events, self.settings.stop)
+                if self.predictor is not None:
+                    self.predictor.observe_events(self.schedule.events)
+                with mhtrace.span("plugins"):
+                    self.plugin_mgr.data(self.schedule.all_departures)
+                    self.plugin_mgr.events(self.schedule.events)
+                self._idle_check()
+            mhtrace.flush()
+            self._publish_status()
+            if self.memory_settings.get("bounded"):
+                self.schedule.events = []
+                gc.collect()
+        elif self.run_loop_count >= self.settings.interval:
+            self.run_loop_count = -1
+        self.run_loop_count += 1
+
+    def _next_departure_moment(self):
+        """Returns when the next watched departure leaves, looking further ahead in the static timetable if the departure board has none."""
+        if self.schedule.next_departure is not None and self.schedule.last_update:
+            return self.schedule.last_update + self.schedule.next_departure.eta
+        if self.schedule.timetable is not None:
+            scheduled_departures = self.schedule.timetable.next_departures(now(), timedelta(days=1))
+            if scheduled_departures:
+                return scheduled_departures[0][0]
+        return None
+
+    def _quiet_check(self):
+        """Decides before a schedule update whether the controller is outside of the active hours, so that neither the departure API nor the bridge is called."""
+        if self.idle_planner is None or self.idle_overridden:
+            return False
+        idle_until = self.idle_planner.quiet_until(now())
+        if idle_until is None:
+            return False
+        self.idle_until = idle_until
+        self.idle_quiet = True
+        return True
+
+    def _idle_check(self):
+        """Decides after a schedule update whether the controller may idle, outside of the active hours or until the next departure."""
+        if self.idle_planner is None:
+            return False
+        current_time = now()
+        next_departure = self._next_departure_moment()
+        idle_until = self.idle_planner.idle_until(current_time, next_departure, self.schedule.zone_thresholds, next_departure is None and self.schedule.board_empty)
+        if idle_until is None:
+            self.idle_overridden = False
+        elif not self.idle_overridden:
+            self.idle_until = idle_until
+            self.idle_quiet = self.idle_planner.quiet_until(current_time) is not None
+        return self.idle_until is not None
+
+    def _idle(self):
+        """Sleeps until the idle period ends without calling the departure API or the bridge.
+
+        Signals, a configuration change, a refresh, pause or resume over the control socket and the
+        on-switch end the idle period early. The on-switch is the only sensor still polled, as it cannot be noticed otherwise.
+        """
+        logger.info("%s, idling until %s.", "Outside of active hours" if self.idle_quiet else "No departure due for a while", self.idle_until)
+        if self.hue_control.transitions is not None:
+            self.hue_control.transitions.clear()
+        if self.idle_quiet:
+            self.hue_control.slave.reset()
+        elif self.hue_control.light_mode == "entertainment":
+            self.hue_control.slave.stop()
+        self._publish_status()
+        idle_until = self.idle_until
+        while now() < idle_until:
+            if self._sigint_check() or self._sigterm_check() or self._reload_check() or self.refresh_requested.is_set() or self.pause_requested.is_set() != self.paused:
+                break
+            self._diagnostics_check()
+            if self.settings.use_on_switch and self.hue_control.on_switch.poll():
+                logger.info("On-switch actioned. Leaving idle mode.")
+                self.idle_overridden = True
+                break
+            self._heartbeat()
+            sleep(1)
+        logger.info("Leaving idle mode.")
+        if self.idle_quiet and not self.sigint_caught and not self.sigterm_caught and not self.pause_requested.is_set():
+            self.hue_control.slave.on()
+        self.idle_until = None
+        self.last_zone = None
+        self.run_loop_count = 0
+        self._publish_status()
+
+    def _publish_status(self):
+        """Prepares the response to status queries, so that answering them touches neither the departure API nor the bridge."""
+        self.status_response = json.dumps({
+            "zone": self.current_zone,
+            "paused": self.paused,
+            "idle_until": self.idle_until,
+            "last_update": self.schedule.last_update or None,
+            "next_departures": [
+                {"line": bus.line, "direction": bus.direction, "time": bus.time, "rtTime": bus.rtTime, "eta": bus.eta.total_seconds(), "zone": bus.zone, "confidence": bus.confidence}
+                for bus in (self.schedule.all_departures or [])[:self.STATUS_DEPARTURES]
+                ],
+            }, default=str).encode("utf-8") + b"\n"
+
+    def _stats(self):
+        """Returns the age of the cached schedule, settings and bridge state in seconds along with the start-up and per-stage timings."""
+        current_time = perf_counter()
+        return {
+            "cache_ages": {cache: round(current_time - cached, 3) for cache, cached in self.cache_times.items()},
+            "startup_timings": {stage: round(duration * 1000, 3) for stage, duration in self.startup_timings.items()},
+            "stage_timings": mhmetrics.registry.timings(),
+            }
+
+    def _request_refresh(self):
+        """Makes the next tick fetch the schedule and synchronise the light, ending an idle period."""
+        self.refresh_requested.set()
+        return {"refresh": True}
+
+    def _set_paused(self, paused):
+        """Asks the control loop to pause or resume the synchronisation of the light on its next tick."""
+        if paused:
+            self.pause_requested.set()
+        else:
+            self.pause_requested.clear()
+        return {"paused": paused}
+
+    def _set_log_level(self, level):
+        """Changes the level of the program's logger."""
+        logging.getLogger("mH").setLevel(level.upper())
+        return {"loglevel": logging.getLevelName(logging.getLogger("mH").level)}
+
+    def _heartbeat(self):
+        """Tells the watchdog that the control loop is alive."""
+        if self.watchdog is not None:
+            self.watchdog.heartbeat()
+
+    def _on_stall(self):
+        """Called from the watchdog thread when the control loop has stalled. Restarts the service if configured to."""
+        if self.settings.watchdog.get("restart") and self.is_service:
+            logger.error("Requesting a restart of the stalled service.")
+            subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.realpath(__file__)), "mobiHue.py"), "restart"], start_new_session=True)
 
     def run(self):
         """Main program runtime."""
         if not self.initialised:
             logger.info("Launched as a service, running deferred initialisation.")
             self._deferred_init()
+        if getattr(self.settings, "watchdog", None):
+            self.watchdog = Watchdog(self.settings.watchdog.get("deadline", 60), on_stall=self._on_stall)
+            self.watchdog.start()
         if self.settings.use_on_switch:
             logger.info("Watching on-switch ...")
             self._run_with_on_switch()
         elif not self.settings.use_on_switch:
             logger.info("Not using on-switch.")
             self._run_core()
+        if self.watchdog is not None:
+            self.watchdog.stop()
+        if self.history is not None:
+            self.history.close()
+        if self.control_server is not None:
+            self.control_server.stop()
         if self.is_service:
             logger.info("Service halted.")
+            # The daemon ends with os._exit(), which would drop the records still queued for the background handler
+            logging.shutdown()
 
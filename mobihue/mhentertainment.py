@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# mobiHue.py - announces real time bus arrivals using Philipps Hue lights
+# (c) 2017, 2018 Federico Gentile
+# Hue Entertainment API streaming output for smooth high rate effects.
+
+import colorsys
+import logging
+import math
+import socket
+import struct
+import threading
+from time import perf_counter, sleep
+from huecontrols import Light
+from mhexception import Mobihue_Exception
+from rgb_xy import Converter, GamutC
+import mhmetrics
+import mhrecorder
+
+
+logger = logging.getLogger("mH." + __name__)
+
+COLOUR_SPACE_XY = 0x01
+# "HueStream", version 1.0, sequence number, reserved, colour space, reserved
+PACKET_HEADER = struct.Struct(">9sBBBHBB")
+# device type (0 = light), light id, x, y, brightness
+PACKET_LIGHT = struct.Struct(">BHHHH")
+LIGHTS_PER_PACKET = 10
+DEFAULT_PORT = 2100
+
+frames_sent = mhmetrics.registry.counter("mobihue_entertainment_frames_total", "Frames streamed to the entertainment group.")
+
+
+def huestream_packets(frame, sequence=0):
+    """Returns the HueStream packets for a frame given as (light id, x, y, brightness) tuples, with all values but the id between 0 and 1."""
+    header = PACKET_HEADER.pack(b"HueStream", 1, 0, sequence & 0xff, 0, COLOUR_SPACE_XY, 0)
+    packets = []
+    for start in range(0, len(frame), LIGHTS_PER_PACKET):
+        packets.append(header + b"".join(
+            PACKET_LIGHT.pack(0, int(light_id), round(min(max(x, 0.0), 1.0) * 0xffff), round(min(max(y, 0.0), 1.0) * 0xffff), round(min(max(brightness, 0.0), 1.0) * 0xffff))
+            for light_id, x, y, brightness in frame[start:start + LIGHTS_PER_PACKET]
+            ))
+    return packets
+
+
+def solid(xy, brightness=1.0):
+    """Returns an effect showing a steady colour."""
+    def render(elapsed, index, count):
+        return xy[0], xy[1], brightness
+    return render
+
+def pulse(xy, period=1.0, low=0.15):
+    """Returns an effect smoothly pulsing a colour, travelling across the lights as a wave. The period can be a callable, read on every frame, so that it follows a countdown."""
+    phase = [0.0, 0.0]
+
+    def render(elapsed, index, count):
+        if index == 0:
+            # Integrate the phase so that period changes do not make the pulse jump
+            phase[0] += (elapsed - phase[1]) / max(period() if callable(period) else period, 0.05)
+            phase[1] = elapsed
+        wave = 0.5 + 0.5 * math.cos(2 * math.pi * (phase[0] - index / max(count, 1)))
+        return xy[0], xy[1], low + (1.0 - low) * wave
+    return render
+
+def colour_loop(period=10.0, brightness=1.0):
+    """Returns an effect cycling through all hues, spread out across the lights."""
+    converter = Converter(GamutC)
+
+    def render(elapsed, index, count):
+        red, green, blue = colorsys.hsv_to_rgb((elapsed / period + index / max(count, 1)) % 1.0, 1.0, 1.0)
+        x, y = converter.rgb_to_xy(red * 255, green * 255, blue * 255)
+        return x, y, brightness
+    return render
+
+
+class Entertainment_Stream:
+    """Streams frames rendered by an effect to an entertainment group over UDP at a fixed rate from a background thread.
+
+    Real bridges only accept DTLS encrypted streams, which requires the optional python-mbedtls
+    package. Unencrypted streams are meant for local stand-ins such as the simulator's receiver.
+    """
+
+    def __init__(self, host, username, client_key, light_ids, rate=25, port=DEFAULT_PORT, encrypted=True):
+        """Initialises the Entertainment_Stream class."""
+        if encrypted and not client_key:
+            raise Mobihue_Exception("Encrypted entertainment streaming needs the client key of the bridge user, please set it in the entertainment settings.")
+        self.address = (host, port)
+        self.username = username
+        self.client_key = client_key
+        self.light_ids = list(light_ids)
+        self.rate = rate
+        self.encrypted = encrypted
+        self.effect = solid((0.3127, 0.329), 0.0)
+        self.sequence = 0
+        self.connection = None
+        self.running = False
+        self.thread = None
+
+    def _connect(self):
+        """Opens the UDP or DTLS connection to the bridge."""
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if not self.encrypted:
+            udp_socket.connect(self.address)
+            return udp_socket
+        try:
+            from mbedtls import tls
+        except ImportError:
+            udp_socket.close()
+            raise Mobihue_Exception("Entertainment streaming to a Hue bridge needs DTLS, please install python-mbedtls.")
+        configuration = tls.DTLSConfiguration(
+            pre_shared_key=(self.username, bytes.fromhex(self.client_key)),
+            ciphers=("TLS-PSK-WITH-AES-128-GCM-SHA256",),
+            validate_certificates=False,
+            )
+        dtls_socket = tls.ClientContext(configuration).wrap_socket(udp_socket, server_hostname=None)
+        dtls_socket.connect(self.address)
+        dtls_socket.do_handshake()
+        return dtls_socket
+
+    def set_effect(self, effect):
+        """Replaces the effect rendered from the next frame on."""
+        self.effect = effect
+
+    def send_frame(self, elapsed):
+        """Renders and sends a single frame."""
+        count = len(self.light_ids)
+        frame = [(light_id,) + self.effect(elapsed, index, count) for index, light_id in enumerate(self.light_ids)]
+        for packet in huestream_packets(frame, self.sequence):
+            self.connection.send(packet)
+        self.sequence += 1
+        frames_sent.inc()
+
+    def _run(self):
+        """Sends frames at the configured rate until stopped. Late frames are skipped rather than sent in a burst."""
+        start = perf_counter()
+        frame_count = 0
+        while self.running:
+            elapsed = perf_counter() - start
+            try:
+                self.send_frame(elapsed)
+            except OSError as stream_error:
+                logger.warning("Could not send entertainment frame: %s", stream_error)
+            frame_count = max(frame_count + 1, int(elapsed * self.rate))
+            delay = start + frame_count / self.rate - perf_counter()
+            if delay > 0:
+                sleep(delay)
+
+    def start(self):
+        """Connects and starts streaming."""
+        if not self.running:
+            self.connection = self._connect()
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name="entertainment", daemon=True)
+            self.thread.start()
+            logger.info("Streaming to entertainment group at %s Hz.", self.rate)
+        return True
+
+    def stop(self):
+        """Stops streaming and closes the connection."""
+        if self.running:
+            self.running = False
+            self.thread.join()
+            self.connection.close()
+            self.connection = None
+            logger.info("Entertainment streaming stopped after %d frames.", self.sequence)
+        return True
+
+
+class Entertainment_Manager:
+    """Drives the lights of an entertainment group through a stream, rendering the zone effects locally instead of using the bridge's alerts and effects."""
+
+    def __init__(self, bridge, ip, key, states, group_id, client_key=None, rate=25, port=DEFAULT_PORT, encrypted=True):
+        """Initialise the Entertainment_Manager class."""
+        self.bridge = bridge
+        self.states = states
+        self.hue_group = self.bridge.groups[group_id]
+        group = self.hue_group()
+        mhrecorder.record("initial/groups/{}".format(group_id), group)
+        light_ids = group["lights"]
+        logger.debug("  >> Lights of entertainment group %s: %s", group_id, light_ids)
+        self.lights = [Light(self.bridge, light_id) for light_id in light_ids]
+        self.stream = Entertainment_Stream(ip.split(":")[0], key, client_key, light_ids, rate, port, encrypted)
+        self.eta_seconds = None
+        self.state_has_changed = False
+
+    def _countdown_period(self):
+        """Returns the pulse period, which shortens as the next departure approaches."""
+        if self.eta_seconds is None:
+            return 1.0
+        return min(max(self.eta_seconds / 60, 0.25), 2.0)
+
+    def _effect(self, state):
+        """Returns the effect rendering a zone state."""
+        brightness = state.get("bri", 254) / 254
+        if state.get("alert", "none") != "none":
+            return pulse(state["xy"], self._countdown_period)
+        elif state.get("effect", "none") == "colorloop":
+            return colour_loop(brightness=brightness)
+        return solid(state["xy"], brightness)
+
+    def set_zone(self, zone):
+        """Streams the effect for a given zone."""
+        logger.debug("  >> Streaming effect for zone: %s. State: %s", zone, self.states[zone])
+        if not self.stream.running:
+            with mhmetrics.bridge_command_seconds.time(endpoint="groups/stream"):
+                self.hue_group(stream={"active": True})
+            self.stream.start()
+        self.stream.set_effect(self._effect(self.states[zone]))
+        self.state_has_changed = True
+        return True
+
+    def countdown(self, eta_seconds):
+        """Sets the time left until the next departure, which paces pulsing effects."""
+        self.eta_seconds = eta_seconds
+
+    def stop(self):
+        """Stops streaming and hands the lights back to the bridge."""
+        if self.stream.running:
+            self.stream.stop()
+            with mhmetrics.bridge_command_seconds.time(endpoint="groups/stream"):
+                self.hue_group(stream={"active": False})
+        return True
+
+    def on(self):
+        """Turns all lights of the entertainment group on."""
+        for current_light in self.lights:
+            current_light.on()
+        return True
+
+    def reset(self):
+        """Stops streaming and resets all lights of the entertainment group to their initial state."""
+        self.stop()
+        for current_light in self.lights:
+            if self.state_has_changed:
+                current_light.state_has_changed = True
+            current_light.reset()
+        return True
+
+    @property
+    def initial_on(self):
+        """Returns True if any light of the entertainment group was on at program start."""
+        return any(current_light.initial_on for current_light in self.lights)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# mobiHue.py - announces real time bus arrivals using Philipps Hue lights
+# (c) 2017, 2018 Federico Gentile
+# In-memory stand-in for a qhue Bridge, used by the benchmarks and the replay mode.
+
+import collections
+import copy
+import logging
+
+
+logger = logging.getLogger("mH." + __name__)
+
+
+class Fake_Resource:
+    """Mimics a qhue resource on top of an in-memory bridge state."""
+
+    def __init__(self, bridge, path):
+        """Initialises the Fake_Resource class."""
+        self._bridge = bridge
+        self._path = path
+
+    def __getitem__(self, key):
+        """Returns the sub-resource for the given key."""
+        return type(self)(self._bridge, self._path + (str(key),))
+
+    def __getattr__(self, name):
+        """Returns the sub-resource for the given name."""
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __call__(self, **kwargs):
+        """Reads the resource or, if keyword arguments are given, writes them to it. Creating and deleting resources is supported through the http_method argument, like in qhue."""
+        http_method = kwargs.pop("http_method", None)
+        node = self._bridge.state
+        for key in self._path:
+            node = node.setdefault(key, {})
+        if http_method == "delete":
+            self._bridge.commands.append(("/".join(self._path), None))
+            parent = self._bridge.state
+            for key in self._path[:-1]:
+                parent = parent[key]
+            del parent[self._path[-1]]
+            return [{"success": "/" + "/".join(self._path) + " deleted"}]
+        if http_method == "post":
+            self._bridge.commands.append(("/".join(self._path), kwargs))
+            new_id = str(max([int(key) for key in node if key.isdigit()] + [0]) + 1)
+            node[new_id] = kwargs
+            return [{"success": {"id": new_id}}]
+        if not kwargs:
+            return copy.deepcopy(node)
+        self._bridge.commands.append(("/".join(self._path), kwargs))
+        node.update(kwargs)
+        return [{"success": {key: value}} for key, value in kwargs.items()]
+
+
+class Fake_Bridge:
+    """In-process stand-in for a qhue Bridge with a single colour light and no network access."""
+
+    def __init__(self, max_commands=None):
+        """Initialises the Fake_Bridge class. Only the last max_commands commands are kept if a limit is given."""
+        self.commands = collections.deque(maxlen=max_commands)
+        self.state = {
+            "lights": {"1": {"state": {"on": True, "bri": 254, "xy": [0.3, 0.3], "alert": "none", "effect": "none", "colormode": "xy", "reachable": True, "mode": "homeautomation"}}},
+            "sensors": {"2": {"state": {"buttonevent": 1002, "lastupdated": "2018-01-01T00:00:00"}}, "3": {"state": {"status": 0}}},
+            "scenes": {},
+            "groups": {"0": {"action": {}}},
+            }
+
+    def __getattr__(self, name):
+        """Returns the top level resource for the given name."""
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return Fake_Resource(self, (name,))
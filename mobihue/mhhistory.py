@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# mobiHue.py - announces real time bus arrivals using Philipps Hue lights
+# (c) 2017, 2018 Federico Gentile
+# Append-only departure and delay history with fixed-width records, rolled daily and memory-mapped for reads.
+
+import logging
+import mmap
+import os
+import queue
+import statistics
+import struct
+import threading
+import zlib
+from datetime import date, timedelta
+import mhclock
+import mhmetrics
+
+
+logger = logging.getLogger("mH." + __name__)
+
+# observed, scheduled, delay in seconds, stop hash, real time flag, line, direction
+RECORD = struct.Struct("<IIiIB7s32s")
+FILE_PATTERN = "history-{:%Y%m%d}.bin"
+
+dropped_records = mhmetrics.registry.counter("mobihue_history_dropped_total", "History records dropped because the writer queue was full.")
+
+
+def stop_hash(stop_id):
+    """Returns the 32 bit hash a stop id is stored as."""
+    return zlib.crc32(str(stop_id).encode("utf-8"))
+
+def _encode(text, length):
+    """Returns the text as a fixed-width byte string, truncated if needed."""
+    return str(text).encode("utf-8")[:length]
+
+def _decode(raw):
+    """Returns the text of a fixed-width byte string."""
+    return raw.rstrip(b"\0").decode("utf-8", "ignore")
+
+
+class History_Recorder:
+    """Appends observed departures to daily history files from a background thread so that the control loop never blocks on disk."""
+
+    def __init__(self, directory, queue_size=10000):
+        """Initialises the History_Recorder class."""
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.queue = queue.Queue(queue_size)
+        self.history_file = None
+        self.file_day = None
+        self.thread = threading.Thread(target=self._write, name="history", daemon=True)
+        self.thread.start()
+        logger.info("Recording departure history to %s.", directory)
+
+    def observe(self, bus, stop_id):
+        """Queues a single observed departure. Records are dropped rather than blocking if the writer falls behind."""
+        observed = mhclock.time()
+        real_time = bool(bus.rtTime)
+        delay = int((bus.rtTime - bus.time).total_seconds()) if real_time else 0
+        record = RECORD.pack(int(observed), int(bus.time.timestamp()), delay, stop_hash(stop_id), real_time, _encode(bus.line, 7), _encode(bus.direction, 32))
+        try:
+            self.queue.put_nowait((date.fromtimestamp(observed), record))
+        except queue.Full:
+            dropped_records.inc()
+            return False
+        return True
+
+    def observe_events(self, events, stop_id):
+        """Queues every departure that was added or whose delay changed since the last update."""
+        for event in events:
+            if event.type in ("departure_added", "delay_changed"):
+                self.observe(event.bus, stop_id)
+
+    def _open(self, day):
+        """Switches to the history file of the given day."""
+        if self.history_file is not None:
+            self.history_file.close()
+        self.history_file = open(os.path.join(self.directory, FILE_PATTERN.format(day)), "ab")
+        self.file_day = day
+
+    def _write(self):
+        """Writes queued records in batches until stopped."""
+        while True:
+            item = self.queue.get()
+            batch = [item]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                for entry in batch:
+                    if entry is None:
+                        if self.history_file is not None:
+                            self.history_file.close()
+                        return
+                    day, record = entry
+                    if day != self.file_day:
+                        self._open(day)
+                    self.history_file.write(record)
+                self.history_file.flush()
+            except IOError as io_error:
+                logger.error("Could not write departure history: %s", io_error)
+
+    def close(self):
+        """Writes all queued records and stops the writer thread."""
+        self.queue.put(None)
+        self.thread.join()
+        return True
+
+
+class History:
+    """Reads the departure history and answers delay distribution queries."""
+
+    def __init__(self, directory):
+        """Initialises the History class."""
+        self.directory = directory
+
+    def records(self, start, end):
+        """Yields (observed, scheduled, delay, stop hash, real time, line, direction) tuples of all departures scheduled between start and end."""
+        start_timestamp = start.timestamp()
+        end_timestamp = end.timestamp()
+        # Departures are observed up to a day before they are scheduled
+        day = start.date() - timedelta(days=1)
+        while day <= end.date():
+            path = os.path.join(self.directory, FILE_PATTERN.format(day))
+            day += timedelta(days=1)
+            if not os.path.exists(path) or os.path.getsize(path) < RECORD.size:
+                continue
+            with open(path, "rb") as history_file, mmap.mmap(history_file.fileno(), 0, access=mmap.ACCESS_READ) as history_map:
+                usable = len(history_map) - len(history_map) % RECORD.size
+                for observed, scheduled, delay, stop, real_time, line, direction in RECORD.iter_unpack(memoryview(history_map)[:usable]):
+                    if start_timestamp <= scheduled < end_timestamp:
+                        yield observed, scheduled, delay, stop, bool(real_time), _decode(line), _decode(direction)
+
+    def departures(self, start, end, line=None, direction=None, stop_id=None):
+        """Returns the last observed delay in seconds of every departure scheduled between start and end, keyed by line, scheduled time, direction and stop hash."""
+        line = str(line) if line is not None else None
+        wanted_stop = stop_hash(stop_id) if stop_id is not None else None
+        latest = {}
+        for observed, scheduled, delay, stop, real_time, record_line, record_direction in self.records(start, end):
+            if not real_time or (line is not None and record_line != line):
+                continue
+            if direction is not None and direction not in record_direction:
+                continue
+            if wanted_stop is not None and stop != wanted_stop:
+                continue
+            key = (record_line, scheduled, record_direction, stop)
+            if key not in latest or latest[key][0] <= observed:
+                latest[key] = (observed, delay)
+        return {key: delay for key, (observed, delay) in latest.items()}
+
+    def delays(self, line, start, end, direction=None, stop_id=None):
+        """Returns the last observed delay in seconds of every departure of a line scheduled between start and end, keyed by scheduled time, direction and stop hash."""
+        return {key[1:]: delay for key, delay in self.departures(start, end, line, direction, stop_id).items()}
+
+    @staticmethod
+    def _distribution(delays):
+        """Returns summary statistics of a list of delays in seconds."""
+        delays = sorted(delays)
+        if not delays:
+            return {"count": 0}
+        return {
+            "count": len(delays),
+            "mean": statistics.mean(delays),
+            "median": statistics.median(delays),
+            "p90": delays[min(len(delays) - 1, int(len(delays) * 0.9))],
+            "max": delays[-1],
+            "on_time_share": sum(1 for delay in delays if delay < 60) / len(delays),
+            }
+
+    def delay_distribution(self, line, start, end, direction=None, stop_id=None):
+        """Returns summary statistics of the delays of a line between start and end."""
+        return self._distribution(self.delays(line, start, end, direction, stop_id).values())
+
+    def delay_distribution_over_time(self, line, start, end, window=timedelta(hours=1), direction=None, stop_id=None):
+        """Returns a list of (window start, delay distribution) pairs covering start to end, reading the history only once."""
+        window_seconds = window.total_seconds()
+        windows = [[] for _ in range(int((end - start).total_seconds() // window_seconds) + 1)]
+        for (scheduled, record_direction, stop), delay in self.delays(line, start, end, direction, stop_id).items():
+            windows[int((scheduled - start.timestamp()) // window_seconds)].append(delay)
+        return [(start + window * index, self._distribution(delays)) for index, delays in enumerate(windows) if start + window * index < end]
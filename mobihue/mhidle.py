@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# mobiHue.py - announces real time bus arrivals using Philipps Hue lights
+# (c) 2017, 2018 Federico Gentile
+# Quiet hours and service gap detection, telling the controller when it can stop polling.
+
+import logging
+from datetime import datetime, time, timedelta
+
+
+logger = logging.getLogger("mH." + __name__)
+
+
+def parse_time(clock_time):
+    """Returns a HH:MM clock time as a time instance."""
+    hours, minutes = str(clock_time).split(":")
+    return time(int(hours), int(minutes))
+
+
+class Idle_Planner:
+    """Decides until when the controller may idle, either outside the active hours or during a gap in service.
+
+    Active hours may wrap around midnight, e.g. 06:00 to 00:30. A gap starts when the next departure
+    is further away than the largest zone threshold plus the wake margin, and ends margin minutes
+    before that departure enters the zones, so that the schedule is fresh by then. After the last
+    departure of the day, departure boards come back empty, and the board is checked again after a
+    back-off that doubles up to max_empty_backoff minutes while it stays empty.
+    """
+
+    def __init__(self, active_hours=None, gaps=True, margin=5, min_idle=10, empty_backoff=15, max_empty_backoff=60):
+        """Initialises the Idle_Planner class. Idle periods shorter than min_idle minutes are ignored."""
+        self.active_hours = tuple(parse_time(clock_time) for clock_time in active_hours) if active_hours else None
+        self.gaps = gaps
+        self.margin = timedelta(minutes=margin)
+        self.min_idle = timedelta(minutes=min_idle)
+        self.empty_backoff = timedelta(minutes=empty_backoff)
+        self.max_empty_backoff = timedelta(minutes=max_empty_backoff)
+        self.backoff = self.empty_backoff
+
+    def quiet_until(self, moment):
+        """Returns the start of the next active hours if the moment lies outside of them, None otherwise."""
+        if self.active_hours is None:
+            return None
+        start, end = self.active_hours
+        clock_time = moment.time()
+        if (start <= clock_time < end) if start <= end else (clock_time >= start or clock_time < end):
+            return None
+        wake = datetime.combine(moment.date(), start)
+        return wake if wake > moment else wake + timedelta(days=1)
+
+    def gap_until(self, moment, next_departure, zone_thresholds):
+        """Returns the moment to wake up before the next departure if service pauses until then, None otherwise."""
+        if not self.gaps or next_departure is None:
+            return None
+        # A departure enters the zones one minute before the largest threshold is reached
+        return next_departure - timedelta(minutes=zone_thresholds[-1][0] + 1) - self.margin
+
+    def empty_until(self, moment):
+        """Returns the moment to check again after a departure board without any watched departure, backing off further while boards stay empty."""
+        if not self.gaps:
+            return None
+        wake = moment + self.backoff
+        self.backoff = min(self.backoff * 2, self.max_empty_backoff)
+        return wake
+
+    def idle_until(self, moment, next_departure, zone_thresholds, board_empty=False):
+        """Returns until when the controller may idle, or None if it should keep running. An empty board only counts if it was received without any departure, not if the request failed."""
+        if next_departure is not None:
+            self.backoff = self.empty_backoff
+        wake = self.quiet_until(moment)
+        if wake is None and next_departure is not None:
+            wake = self.gap_until(moment, next_departure, zone_thresholds)
+        elif wake is None and board_empty:
+            wake = self.empty_until(moment)
+        if wake is None or wake - moment < self.min_idle:
+            return None
+        return wake
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# mobiHue.py - announces real time bus arrivals using Philipps Hue lights
+# (c) 2017, 2018 Federico Gentile
+# Memory usage reporting for long-running daemons.
+
+import gc
+import logging
+import resource
+import tracemalloc
+
+
+logger = logging.getLogger("mH." + __name__)
+
+
+def rss_kb():
+    """Returns the current resident set size of the process in kilobytes."""
+    try:
+        with open("/proc/self/status", "r") as status_file:
+            for line in status_file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    # Fall back to the peak resident set size where /proc is unavailable
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def start_tracing(frames=1):
+    """Starts tracing Python memory allocations."""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+        logger.info("Tracing memory allocations.")
+    return True
+
+def stop_tracing():
+    """Stops tracing Python memory allocations."""
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+        logger.info("Stopped tracing memory allocations.")
+    return True
+
+def memory_report(top=10):
+    """Returns a dictionary describing the current memory usage, including the largest allocation sites if allocations are being traced."""
+    report = {"rss_kb": rss_kb(), "gc_objects": len(gc.get_objects()), "gc_counts": gc.get_count()}
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        report["traced_kb"] = current // 1024
+        report["traced_peak_kb"] = peak // 1024
+        statistics = tracemalloc.take_snapshot().statistics("lineno")[:top]
+        report["top"] = ["{}: {} KiB in {} blocks".format(stat.traceback, stat.size // 1024, stat.count) for stat in statistics]
+    return report
+
+def log_memory_report(top=10):
+    """Writes a memory report to the log."""
+    report = memory_report(top)
+    logger.info("Memory report: RSS %s KiB, %s tracked objects, traced %s KiB (peak %s KiB).", report["rss_kb"], report["gc_objects"], report.get("traced_kb", "n/a"), report.get("traced_peak_kb", "n/a"))
+    for line in report.get("top", []):
+        logger.info("  - %s", line)
+    return report
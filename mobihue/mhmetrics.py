@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# mobiHue.py - announces real time bus arrivals using Philipps Hue lights
+# (c) 2017, 2018 Federico Gentile
+# Lightweight Prometheus-style metrics and an optional local exporter.
+
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+
+
+logger = logging.getLogger("mH." + __name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_string(label_names, label_values):
+    """Returns the exposition format representation of a label set."""
+    if not label_names:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"')) for name, value in zip(label_names, label_values)) + "}"
+
+
+class Metric:
+    """Base class for all metrics. Values are kept per label value tuple."""
+
+    TYPE = None
+
+    def __init__(self, name, documentation, label_names=()):
+        """Initialises the Metric class."""
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        """Returns the label value tuple for the given labels."""
+        return tuple(labels.get(name, "") for name in self.label_names)
+
+    def samples(self):
+        """Returns (suffix, label names, label values, value) tuples for the exposition."""
+        with self.lock:
+            return [("", self.label_names, key, value) for key, value in self.values.items()]
+
+    def exposition(self):
+        """Returns the metric in the Prometheus text exposition format."""
+        lines = ["# HELP {} {}".format(self.name, self.documentation), "# TYPE {} {}".format(self.name, self.TYPE)]
+        for suffix, label_names, label_values, value in self.samples():
+            lines.append("{}{}{} {}".format(self.name, suffix, _label_string(label_names, label_values), value))
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Monotonically increasing counter."""
+
+    TYPE = "counter"
+
+    def inc(self, amount=1, **labels):
+        """Increments the counter."""
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """Returns the current value of the counter."""
+        return self.values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """Value that can go up and down."""
+
+    TYPE = "gauge"
+
+    def set(self, value, **labels):
+        """Sets the gauge to the given value."""
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def value(self, **labels):
+        """Returns the current value of the gauge."""
+        return self.values.get(self._key(labels), 0)
+
+
+class Timer:
+    """Context manager observing the time spent in its block on a histogram."""
+
+    def __init__(self, histogram, labels):
+        """Initialises the Timer class."""
+        self.histogram = histogram
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Histogram(Metric):
+    """Cumulative histogram with fixed buckets."""
+
+    TYPE = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        """Initialises the Histogram class."""
+        super(Histogram, self).__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        """Records a single observation."""
+        key = self._key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts[0][bisect.bisect_left(self.buckets, value)] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    def time(self, **labels):
+        """Returns a context manager observing the duration of its block."""
+        return Timer(self, labels)
+
+    def count(self, **labels):
+        """Returns the number of observations."""
+        counts = self.values.get(self._key(labels))
+        return counts[2] if counts else 0
+
+    def sum(self, **labels):
+        """Returns the sum of all observations."""
+        counts = self.values.get(self._key(labels))
+        return counts[1] if counts else 0.0
+
+    def samples(self):
+        """Returns the bucket, sum and count samples for the exposition."""
+        samples = []
+        label_names = self.label_names + ("le",)
+        with self.lock:
+            for key, (bucket_counts, total, count) in self.values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), bucket_counts):
+                    cumulative += bucket_count
+                    samples.append(("_bucket", label_names, key + (bound,), cumulative))
+                samples.append(("_sum", self.label_names, key, total))
+                samples.append(("_count", self.label_names, key, count))
+        return samples
+
+
+class Registry:
+    """Holds all metrics of the program."""
+
+    def __init__(self):
+        """Initialises the Registry class."""
+        self.metrics = {}
+
+    def register(self, metric):
+        """Adds a metric to the registry and returns it."""
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, label_names=()):
+        return self.register(Counter(name, documentation, label_names))
+
+    def gauge(self, name, documentation, label_names=()):
+        return self.register(Gauge(name, documentation, label_names))
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, label_names, buckets))
+
+    def exposition(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        return "\n".join(metric.exposition() for metric in self.metrics.values()) + "\n"
+
+    def timings(self):
+        """Returns the observation count and mean in milliseconds of every histogram, by metric name and label set."""
+        timings = {}
+        for metric in self.metrics.values():
+            if metric.TYPE != "histogram":
+                continue
+            with metric.lock:
+                timings[metric.name] = {
+                    _label_string(metric.label_names, key) or "total": {"count": count, "mean_ms": round(total / count * 1000, 3) if count else None}
+                    for key, (bucket_counts, total, count) in metric.values.items()
+                    }
+        return timings
+
+
+registry = Registry()
+
+api_request_seconds = registry.histogram("mobihue_api_request_seconds", "Latency of departure API requests.")
+api_response_bytes = registry.counter("mobihue_api_response_bytes_total", "Bytes received from the departure API.")
+api_retries = registry.counter("mobihue_api_retries_total", "Departure API requests that were retried.")
+api_failures = registry.counter("mobihue_api_failures_total", "Departure API updates that failed after all retries.")
+schedule_update_seconds = registry.histogram("mobihue_schedule_update_seconds", "Time spent parsing and filtering a departure board.")
+journeys = registry.counter("mobihue_journeys_total", "Journeys seen on departure boards by outcome.", ("outcome",))
+journey_cache = registry.counter("mobihue_journey_cache_total", "Journeys reused from or parsed into the journey cache.", ("outcome",))
+bridge_command_seconds = registry.histogram("mobihue_bridge_command_seconds", "Latency of Hue bridge commands by endpoint.", ("endpoint",))
+zone_changes = registry.counter("mobihue_zone_changes_total", "Zone changes applied to the lights.")
+tick_lag_seconds = registry.histogram("mobihue_tick_lag_seconds", "Delay of control loop ticks behind their schedule.")
+plugin_callback_seconds = registry.histogram("mobihue_plugin_callback_seconds", "Time spent in plugin callbacks.", ("plugin", "callback"))
+
+
+class Metrics_Server:
+    """Serves the registry's metrics on a local HTTP port in a background thread."""
+
+    def __init__(self, port=9101, host="127.0.0.1", metrics_registry=None):
+        """Initialises the Metrics_Server class."""
+        metrics_registry = metrics_registry or registry
+
+        class Metrics_Request_Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                payload = metrics_registry.exposition().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Metrics_Request_Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True)
+
+    def start(self):
+        """Starts serving metrics."""
+        self.thread.start()
+        logger.info("Serving metrics on http://%s:%s/metrics", *self.server.server_address)
+        return self
+
+    def stop(self):
+        """Stops serving metrics."""
+        self.server.shutdown()
+        self.server.server_close()
+        return True
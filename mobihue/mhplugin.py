@@ -9,11 +9,68 @@
 import logging
 import logging.handlers
 import os
-from pike.manager import PikeManager
+import sys
+import json
+import hashlib
+import inspect
+import importlib.util
+from time import perf_counter
+import mhmetrics
 
 
 logger = logging.getLogger("mH." + __name__)
 
+PLUGIN_DIRECTORY = os.path.dirname(os.path.realpath(__file__)) + '/plugins'
+MANIFEST_FILE = PLUGIN_DIRECTORY + '/.manifest.json'
+MANIFEST_VERSION = 2
+HOOKS = ("begin", "data", "events", "end")
+EVENT_HOOKS = ("departure_added", "departure_removed", "delay_changed", "zone_changed", "next_departure_changed")
+
+
+def overridden_hooks(plugin_class):
+    """Returns the callbacks and event hooks a plugin class implements itself."""
+    return [hook for hook in HOOKS + EVENT_HOOKS if getattr(plugin_class, hook) is not getattr(Pluginbase, hook)]
+
+
+class Lazy_Plugin:
+    """Stands in for a plugin known from the discovery manifest and only imports it when one of the callbacks it implements is first called."""
+
+    def __init__(self, entry):
+        """Initialises the Lazy_Plugin class."""
+        self.entry = entry
+        self.NAME = entry["name"]
+        self.VERSION = entry["version"]
+        self.AUTHOR = entry["author"]
+        self.USE_EVENTS = entry["use_events"]
+        self.HOOKS = entry["hooks"]
+        self.load_time = None
+        self._plugin = None
+
+    @property
+    def plugin(self):
+        """Imports and instantiates the plugin on first access."""
+        if self._plugin is None:
+            load_start = perf_counter()
+            module = sys.modules.get(self.entry["module"])
+            if module is None:
+                spec = importlib.util.spec_from_file_location(self.entry["module"], self.entry["path"])
+                module = importlib.util.module_from_spec(spec)
+                sys.modules[self.entry["module"]] = module
+                spec.loader.exec_module(module)
+            self._plugin = getattr(module, self.entry["class"])()
+            self.load_time = perf_counter() - load_start
+            logger.info("  - Imported plugin %s in %.1f ms.", self.NAME, self.load_time * 1000)
+        return self._plugin
+
+    def __getattr__(self, name):
+        """Forwards everything else to the actual plugin instance."""
+        return getattr(self.plugin, name)
+
+    def __str__(self):
+        """Returns a human readable representation of the Lazy_Plugin class instance."""
+        return "Lazy plugin instance [name: {}, loaded: {}]".format(self.NAME, self._plugin is not None)
+
+
 class Pluginmanager:
     """A very simple plugin manager."""
 
@@ -21,51 +78,160 @@ class Pluginmanager:
         """Initialises the plugin manager."""
         self.p_mgr = None
         self.plugins = None
+        self.plugin_hooks = None
         self.plugins_loaded = False
+        self.timings = {}
         if quickload:
             self.load_plugins()
     
     def load_plugins(self):
-        """Loads plugins"""
+        """Loads plugins, skipping the directory scan if the discovery manifest is still current."""
         if not self.plugins_loaded:
             logger.info("Loading plugins ...")
-            # Preliminary check to only load classes that inherit from Pluginbase
-            with PikeManager([os.path.dirname(os.path.realpath(__file__)) + '/plugins']) as self.p_mgr:
-                classes = self.p_mgr.get_all_inherited_classes(Pluginbase)
-            logger.debug("  >> %d class(es) inherited from Pluginbase detected: %s", len(classes), str(classes))
-
-            # Second, more thorough checking
-            self.plugins = []
-            for pl_class in classes:
-                if hasattr(pl_class, 'MHPLUGIN') and hasattr(pl_class, 'NAME') and pl_class.MHPLUGIN:
-                    if pl_class.NAME is not None and pl_class.VERSION is not None and pl_class.AUTHOR is not None:
-                        self.plugins.append(pl_class())
-                        logger.info("  - Loaded: " + pl_class.NAME + " - version: " + str(pl_class.VERSION) + " by " + pl_class.AUTHOR)
-                    else:
-                        plugin_str = str(pl_class)
-                        logger.warning("  >> Some mandatory attributes of plugin class %s are undefined. Please correct this and reload the application.", plugin_str)
-            logger.info("%d plugin(s) found.", len(self.plugins))
+            load_start = perf_counter()
+            files = self._plugin_files()
+            manifest = self._read_manifest()
+            if manifest is not None and self._manifest_is_current(manifest, files):
+                logger.debug("  >> Plugin tree unchanged, using discovery manifest.")
+                self.plugins = [Lazy_Plugin(entry) for entry in manifest["plugins"]]
+                self.plugin_hooks = [entry["hooks"] for entry in manifest["plugins"]]
+                if any(manifest["files"][path]["mtime"] != stat["mtime"] for path, stat in files.items()):
+                    self._write_manifest(files, manifest["plugins"])
+                for plugin in self.plugins:
+                    logger.info("  - Found: %s - version: %s by %s", plugin.NAME, plugin.VERSION, plugin.AUTHOR)
+            else:
+                logger.debug("  >> Plugin tree changed or no discovery manifest found, scanning plugins.")
+                self.plugins, entries = self._scan_plugins()
+                self.plugin_hooks = [entry["hooks"] for entry in entries]
+                self._write_manifest(files, entries)
+            self.timings["discovery"] = perf_counter() - load_start
+            logger.info("%d plugin(s) found in %.1f ms.", len(self.plugins), self.timings["discovery"] * 1000)
             self.plugins_loaded = True
 
+    def _scan_plugins(self):
+        """Imports everything in the plugin directory and instantiates all valid plugin classes."""
+        from pike.manager import PikeManager
+        # Preliminary check to only load classes that inherit from Pluginbase
+        with PikeManager([PLUGIN_DIRECTORY]) as self.p_mgr:
+            classes = self.p_mgr.get_all_inherited_classes(Pluginbase)
+        logger.debug("  >> %d class(es) inherited from Pluginbase detected: %s", len(classes), classes)
+
+        # Second, more thorough checking
+        plugins = []
+        entries = []
+        for pl_class in classes:
+            if hasattr(pl_class, 'MHPLUGIN') and hasattr(pl_class, 'NAME') and pl_class.MHPLUGIN:
+                if pl_class.NAME is not None and pl_class.VERSION is not None and pl_class.AUTHOR is not None:
+                    init_start = perf_counter()
+                    plugins.append(pl_class())
+                    self.timings[pl_class.NAME] = perf_counter() - init_start
+                    entries.append({
+                        "path": os.path.realpath(inspect.getsourcefile(pl_class)),
+                        "module": pl_class.__module__,
+                        "class": pl_class.__name__,
+                        "name": pl_class.NAME,
+                        "version": pl_class.VERSION,
+                        "author": pl_class.AUTHOR,
+                        "use_events": pl_class.USE_EVENTS,
+                        "hooks": overridden_hooks(pl_class),
+                        })
+                    logger.info("  - Loaded: %s - version: %s by %s (%.1f ms)", pl_class.NAME, pl_class.VERSION, pl_class.AUTHOR, self.timings[pl_class.NAME] * 1000)
+                else:
+                    logger.warning("  >> Some mandatory attributes of plugin class %s are undefined. Please correct this and reload the application.", pl_class)
+        return plugins, entries
+
+    def _plugin_files(self):
+        """Returns the path, modification time and size of every Python file in the plugin directory."""
+        files = {}
+        for root, dirs, filenames in os.walk(PLUGIN_DIRECTORY):
+            for filename in filenames:
+                if filename.endswith(".py"):
+                    path = os.path.join(root, filename)
+                    stat = os.stat(path)
+                    files[path] = {"mtime": stat.st_mtime, "size": stat.st_size}
+        return files
+
+    def _file_hash(self, path):
+        """Returns the SHA-1 digest of a plugin file."""
+        with open(path, "rb") as plugin_file:
+            return hashlib.sha1(plugin_file.read()).hexdigest()
+
+    def _manifest_is_current(self, manifest, files):
+        """Checks whether the manifest still describes the plugin files on disk. Files are only hashed if their modification time changed."""
+        if set(manifest["files"]) != set(files):
+            return False
+        for path, stat in files.items():
+            known = manifest["files"][path]
+            if known["mtime"] == stat["mtime"] and known["size"] == stat["size"]:
+                continue
+            if known["sha1"] != self._file_hash(path):
+                return False
+            logger.debug("  >> Plugin file %s was touched but its content is unchanged.", path)
+        return True
+
+    def _read_manifest(self):
+        """Returns the discovery manifest or None if there is no usable one."""
+        try:
+            with open(MANIFEST_FILE, "r") as manifest_file:
+                manifest = json.load(manifest_file)
+        except (IOError, ValueError):
+            return None
+        if manifest.get("version") != MANIFEST_VERSION:
+            return None
+        return manifest
+
+    def _write_manifest(self, files, entries):
+        """Stores the discovery results alongside the state of the plugin files they were derived from."""
+        for path, stat in files.items():
+            stat["sha1"] = self._file_hash(path)
+        manifest = {"version": MANIFEST_VERSION, "files": files, "plugins": entries}
+        try:
+            with open(MANIFEST_FILE + ".tmp", "w") as manifest_file:
+                json.dump(manifest, manifest_file)
+            os.replace(MANIFEST_FILE + ".tmp", MANIFEST_FILE)
+        except IOError as io_error:
+            logger.warning("Could not write plugin discovery manifest: %s", io_error)
+
+    def _call(self, plugin, callback, *args):
+        """Calls a plugin callback and records the time spent in it."""
+        with mhmetrics.plugin_callback_seconds.time(plugin=plugin.NAME, callback=callback):
+            getattr(plugin, callback)(*args)
+
     def begin(self):
-        for plugin in self.plugins:
-            plugin.begin()
+        for plugin, hooks in zip(self.plugins, self.plugin_hooks):
+            if "begin" in hooks:
+                self._call(plugin, "begin")
     
     def data(self, data):
-        for plugin in self.plugins:
-            plugin.data(data)
+        for plugin, hooks in zip(self.plugins, self.plugin_hooks):
+            if not plugin.USE_EVENTS and "data" in hooks:
+                self._call(plugin, "data", data)
+
+    def events(self, events):
+        event_types = {event.type for event in events}
+        for plugin, hooks in zip(self.plugins, self.plugin_hooks):
+            # Plugins relying on the default dispatch only get events they have a hook for
+            if plugin.USE_EVENTS and ("events" in hooks or not event_types.isdisjoint(hooks)):
+                self._call(plugin, "events", events)
     
     def end(self):
-        for plugin in self.plugins:
-            plugin.end()
+        for plugin, hooks in zip(self.plugins, self.plugin_hooks):
+            if "end" in hooks:
+                self._call(plugin, "end")
 
 class Pluginbase:
-    """Base class for mobiHue plugins."""
+    """Base class for mobiHue plugins.
+
+    Plugins setting USE_EVENTS to True no longer receive the full schedule through data() and are
+    handed the departure events computed by the schedule on every update instead. The default
+    events() implementation dispatches every event to the hook named after its type.
+    """
 
     MHPLUGIN = True
     NAME = None
     VERSION = None
     AUTHOR = None
+    USE_EVENTS = False
 
     def begin(self):
         raise NotImplementedError
@@ -74,4 +240,23 @@ class Pluginbase:
         raise NotImplementedError
     
     def end(self):
-        raise NotImplementedError
\ No newline at end of file
+        raise NotImplementedError
+
+    def events(self, events):
+        for event in events:
+            getattr(self, event.type)(event)
+
+    def departure_added(self, event):
+        pass
+
+    def departure_removed(self, event):
+        pass
+
+    def delay_changed(self, event):
+        pass
+
+    def zone_changed(self, event):
+        pass
+
+    def next_departure_changed(self, event):
+        pass
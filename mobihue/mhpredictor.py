@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# mobiHue.py - announces real time bus arrivals using Philipps Hue lights
+# (c) 2017, 2018 Federico Gentile
+# Delay prediction for journeys without real time data, based on per line and hour of week statistics.
+
+import logging
+import math
+from datetime import datetime, timedelta
+import mhclock
+
+
+logger = logging.getLogger("mH." + __name__)
+
+HOURS_PER_WEEK = 7 * 24
+OBSERVED_JOURNEYS = 1000
+
+
+def hour_of_week(moment):
+    """Returns the hour of the week of a datetime, 0 being Monday midnight."""
+    return moment.weekday() * 24 + moment.hour
+
+
+class Delay_Statistics:
+    """Running count, mean and variance of delays, updated incrementally using Welford's algorithm."""
+
+    __slots__ = ("count", "mean", "m2")
+
+    def __init__(self):
+        """Initialises the Delay_Statistics class."""
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, delay):
+        """Adds a single delay in seconds."""
+        self.count += 1
+        difference = delay - self.mean
+        self.mean += difference / self.count
+        self.m2 += difference * (delay - self.mean)
+
+    @property
+    def stdev(self):
+        """Returns the sample standard deviation of the delays."""
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+
+class Delay_Predictor:
+    """Predicts the delay of a journey from the delays previously observed on its line at the same hour of the week.
+
+    Statistics are kept in one table of 168 slots per line. Every new observation refreshes the
+    prediction of its slot, so that predicting a journey is a single lookup.
+    The confidence of a prediction grows with the number of samples and shrinks with their spread:
+    count / (count + min_samples) * 60 / (60 + stdev), between 0 and 1.
+    """
+
+    def __init__(self, min_samples=5):
+        """Initialises the Delay_Predictor class."""
+        self.min_samples = min_samples
+        self.statistics = {}
+        self.predictions = {}
+        self.observed = {}
+
+    def observe(self, line, scheduled, delay):
+        """Adds the final delay in seconds of a departure scheduled at the given time."""
+        line = str(line)
+        slot = hour_of_week(scheduled)
+        if line not in self.statistics:
+            self.statistics[line] = [None] * HOURS_PER_WEEK
+            self.predictions[line] = [None] * HOURS_PER_WEEK
+        slot_statistics = self.statistics[line][slot]
+        if slot_statistics is None:
+            slot_statistics = self.statistics[line][slot] = Delay_Statistics()
+        slot_statistics.add(delay)
+        if slot_statistics.count >= self.min_samples:
+            confidence = slot_statistics.count / (slot_statistics.count + self.min_samples) * 60 / (60 + slot_statistics.stdev)
+            self.predictions[line][slot] = (timedelta(seconds=round(slot_statistics.mean)), confidence)
+
+    def observe_events(self, events):
+        """Adds the final delay of every departure with real time data that left the departure board after its real time had passed.
+
+        Departures that vanish earlier, e.g. because an update failed, still have a provisional delay
+        and are ignored. Every journey is only counted once, even if it reappears and leaves again.
+        """
+        current_time = mhclock.now()
+        for event in events:
+            if event.type == "departure_removed" and event.bus.rtTime and event.bus.rtTime <= current_time and event.bus.key not in self.observed:
+                self.observe(event.bus.line, event.bus.time, (event.bus.rtTime - event.bus.time).total_seconds())
+                self.observed[event.bus.key] = None
+                if len(self.observed) > OBSERVED_JOURNEYS:
+                    del self.observed[next(iter(self.observed))]
+
+    def predict(self, line, scheduled):
+        """Returns a (delay, confidence) pair for a journey, or None if too few delays are known for its line and hour of the week."""
+        predictions = self.predictions.get(str(line))
+        if predictions is None:
+            return None
+        return predictions[hour_of_week(scheduled)]
+
+    def load_history(self, history, weeks=4):
+        """Adds the final delays of all departures recorded in the given history during the past weeks.
+
+        Like in observe_events, only departures whose real time has passed count, and they are
+        remembered as observed so that they are not counted again when they leave the board.
+        """
+        end = mhclock.now()
+        start = end - timedelta(weeks=weeks)
+        departed = 0
+        for (line, scheduled, direction, stop), delay in sorted(history.departures(start, end).items(), key=lambda departure: departure[0][1]):
+            if scheduled + delay > end.timestamp():
+                continue
+            scheduled = datetime.fromtimestamp(scheduled)
+            self.observe(line, scheduled, delay)
+            self.observed[(line, direction, scheduled)] = None
+            if len(self.observed) > OBSERVED_JOURNEYS:
+                del self.observed[next(iter(self.observed))]
+            departed += 1
+        logger.info("Delay predictor primed with %d departure(s) from the history.", departed)
+        return departed
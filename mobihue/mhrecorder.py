@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# mobiHue.py - announces real time bus arrivals using Philipps Hue lights
+# (c) 2017, 2018 Federico Gentile
+# Recording of departure board responses and sensor reads, and their replay under a virtual clock.
+
+import bisect
+import gzip
+import json
+import logging
+import threading
+from datetime import datetime
+import mhclock
+from mhfakebridge import Fake_Bridge, Fake_Resource
+
+
+logger = logging.getLogger("mH." + __name__)
+
+_recorder = None
+
+
+class Recorder:
+    """Appends timestamped departure board responses and sensor reads to a gzip compressed JSON lines log."""
+
+    def __init__(self, path):
+        """Initialises the Recorder class."""
+        self.path = path
+        self.log_file = gzip.open(path, "at", encoding="utf-8")
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def record(self, kind, data):
+        """Writes a single record."""
+        line = json.dumps({"t": mhclock.time(), "kind": kind, "data": data})
+        with self.lock:
+            self.log_file.write(line + "\n")
+            self.count += 1
+
+    def close(self):
+        """Flushes and closes the log."""
+        with self.lock:
+            self.log_file.close()
+        logger.info("%d record(s) written to %s.", self.count, self.path)
+
+
+def start_recording(path):
+    """Starts recording to the given file."""
+    global _recorder
+    _recorder = Recorder(path)
+    logger.info("Recording departure board responses and sensor reads to %s.", path)
+    return _recorder
+
+def stop_recording():
+    """Stops recording, if active."""
+    global _recorder
+    if _recorder is not None:
+        _recorder.close()
+        _recorder = None
+
+def record(kind, data):
+    """Records the given data if recording is active."""
+    if _recorder is not None:
+        _recorder.record(kind, data)
+
+
+class Replay_Resource(Fake_Resource):
+    """Bridge resource whose reads return the most recent recorded state for the current virtual time."""
+
+    def __call__(self, **kwargs):
+        """Returns the recorded state on reads and applies writes to the in-memory bridge only."""
+        if not kwargs:
+            recorded = self._bridge.replayer.latest("/".join(self._path))
+            if recorded is not None:
+                return {"state": recorded}
+        return super(Replay_Resource, self).__call__(**kwargs)
+
+
+class Replay_Bridge(Fake_Bridge):
+    """Bridge stand-in answering sensor reads from a recording. Light and group commands are only recorded in memory.
+
+    The lights, scenes and groups read at start-up are seeded from the recording, so that replays
+    work with any light id and in every light mode. Recordings without these reads fall back on the
+    single light of the in-memory bridge.
+    """
+
+    def __init__(self, replayer):
+        """Initialises the Replay_Bridge class."""
+        super(Replay_Bridge, self).__init__()
+        self.replayer = replayer
+        for kind, records in replayer.records.items():
+            if kind.startswith("initial/"):
+                node = self.state
+                *parents, name = kind.split("/")[1:]
+                for key in parents:
+                    node = node.setdefault(key, {})
+                node[name] = records[0]
+
+    def __getattr__(self, name):
+        """Returns the top level resource for the given name."""
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return Replay_Resource(self, (name,))
+
+
+class Replayer:
+    """Feeds recorded departure board responses and sensor reads back according to the virtual clock."""
+
+    def __init__(self, path):
+        """Initialises the Replayer class by loading the whole recording."""
+        self.path = path
+        self.times = {}
+        self.records = {}
+        with gzip.open(path, "rt", encoding="utf-8") as log_file:
+            for line in log_file:
+                entry = json.loads(line)
+                self.times.setdefault(entry["kind"], []).append(entry["t"])
+                self.records.setdefault(entry["kind"], []).append(entry["data"])
+        all_times = [t for times in self.times.values() for t in times]
+        if not all_times:
+            raise ValueError("Recording {} is empty.".format(path))
+        self.start = datetime.fromtimestamp(min(all_times))
+        self.end = datetime.fromtimestamp(max(all_times))
+        logger.info("Loaded recording %s covering %s to %s.", path, self.start, self.end)
+
+    def latest(self, kind):
+        """Returns the most recent record of the given kind at the current virtual time, or None."""
+        times = self.times.get(kind)
+        if not times:
+            return None
+        index = bisect.bisect_right(times, mhclock.time()) - 1
+        return self.records[kind][index] if index >= 0 else None
+
+    def departures(self):
+        """Returns the departure board response recorded most recently, standing in for the Mobiliteit.lu API."""
+        return self.latest("departures") or False
+
+    def bridge(self):
+        """Returns a bridge stand-in answering sensor reads from the recording."""
+        return Replay_Bridge(self)
+
+    def clock(self, speed=100.0, on_end=None):
+        """Returns a virtual clock spanning the recording."""
+        return mhclock.Virtual_Clock(self.start, speed, self.end, on_end)
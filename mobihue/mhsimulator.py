@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# mobiHue.py - announces real time bus arrivals using Philipps Hue lights
+# (c) 2017, 2018 Federico Gentile
+# Local simulator for the Mobiliteit.lu departure API and the Hue bridge.
+
+import argparse
+import copy
+import json
+import logging
+import random
+import socket
+import struct
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep, monotonic
+from urllib.parse import urlsplit, parse_qs
+
+
+logger = logging.getLogger("mH." + __name__)
+
+
+class Departure_Board_Simulator:
+    """Generates HAFAS departureBoard responses whose journeys move closer with time and whose delays drift between requests."""
+
+    LINES = (("5", "Luxembourg, Bertrange"), ("6", "Bertrange, Gare"), ("15", "Merl, Centre"), ("16", "Kirchberg"), ("22", "Cents"), ("30", "Bettembourg"))
+
+    def __init__(self, board_size=20, latency=0.0, error_rate=0.0, delay_drift=30, headway=5, seed=None):
+        """Initialises the Departure_Board_Simulator class. Latency is given in seconds, delay drift in seconds per request and headway in minutes."""
+        self.board_size = board_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.delay_drift = delay_drift
+        self.headway = headway
+        self.random = random.Random(seed)
+        self.epoch = datetime.now().replace(second=0, microsecond=0)
+        self.delays = {}
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def _journey(self, index):
+        """Returns the journey with the given running number, drifting its delay."""
+        line, direction = self.LINES[index % len(self.LINES)]
+        scheduled = self.epoch + timedelta(minutes=index * self.headway / len(self.LINES))
+        delay = max(0, self.delays.get(index, 0) + self.random.uniform(-self.delay_drift, self.delay_drift))
+        self.delays[index] = delay
+        journey = {
+            "Product": {"line": line, "name": "Bus " + line},
+            "direction": direction,
+            "date": scheduled.strftime("%Y-%m-%d"),
+            "time": scheduled.strftime("%H:%M:%S"),
+            "JourneyDetailRef": {"ref": "1|{}|0|82|{}".format(index, scheduled.strftime("%d%m%Y"))},
+            }
+        if index % 4 != 3:
+            real_time = (scheduled + timedelta(seconds=delay)).replace(second=0)
+            journey["rtDate"] = real_time.strftime("%Y-%m-%d")
+            journey["rtTime"] = real_time.strftime("%H:%M:%S")
+        return journey
+
+    def board(self, now=None):
+        """Returns the departure board at the given time."""
+        now = now or datetime.now()
+        with self.lock:
+            first_index = max(0, int((now - self.epoch).total_seconds() // 60 * len(self.LINES) / self.headway))
+            for index in [index for index in self.delays if index < first_index]:
+                del self.delays[index]
+            return {"Departure": [self._journey(index) for index in range(first_index, first_index + self.board_size)]}
+
+    def respond(self):
+        """Returns the status code and body of a simulated API response, honouring the configured latency and error rate."""
+        self.requests += 1
+        if self.latency:
+            sleep(self.random.uniform(0.5, 1.5) * self.latency)
+        if self.random.random() < self.error_rate:
+            self.errors += 1
+            return 503, {"errorCode": "SVC_NO_RESULT", "errorText": "Simulated error"}
+        return 200, self.board()
+
+
+class Token_Bucket:
+    """Simple token bucket used to enforce the Hue bridge's command rate limits."""
+
+    def __init__(self, rate, burst):
+        """Initialises the Token_Bucket class."""
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last_refill = monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Takes a token and returns True, or returns False if the bucket is empty."""
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class Bridge_Simulator:
+    """Stand-in for a Hue bridge exposing lights, groups, scenes and sensors. Records every command and enforces the bridge's rate limits."""
+
+    LIGHT_COMMANDS_PER_SECOND = 10
+    GROUP_COMMANDS_PER_SECOND = 1
+
+    def __init__(self, light_count=3, latency=0.0):
+        """Initialises the Bridge_Simulator class."""
+        self.latency = latency
+        self.commands = []
+        self.lock = threading.Lock()
+        self.light_bucket = Token_Bucket(self.LIGHT_COMMANDS_PER_SECOND, self.LIGHT_COMMANDS_PER_SECOND)
+        self.group_bucket = Token_Bucket(self.GROUP_COMMANDS_PER_SECOND, self.GROUP_COMMANDS_PER_SECOND)
+        light_ids = [str(light_id) for light_id in range(1, light_count + 1)]
+        self.state = {
+            "lights": {light_id: {
+                "name": "Simulated light " + light_id,
+                "type": "Extended color light",
+                "modelid": "LCT015",
+                "state": {"on": False, "bri": 254, "hue": 8417, "sat": 140, "xy": [0.4573, 0.41], "ct": 366, "alert": "none", "effect": "none", "colormode": "xy", "reachable": True, "mode": "homeautomation"},
+                } for light_id in light_ids},
+            "groups": {
+                "0": {"name": "All lights", "lights": light_ids, "action": {"on": False}},
+                "1": {"name": "Simulated entertainment area", "type": "Entertainment", "lights": light_ids, "action": {"on": False}, "stream": {"active": False}},
+                },
+            "scenes": {scene_id: {"name": zone, "lights": light_ids} for scene_id, zone in (("sImminent", "imminent"), ("sClose", "close"), ("sIntermediate", "intermediate"), ("sFurther", "further"), ("sWarning", "warning"))},
+            "sensors": {
+                "2": {"name": "Simulated dimmer switch", "type": "ZLLSwitch", "state": {"buttonevent": 1002, "lastupdated": "2018-01-01T00:00:00"}},
+                "3": {"name": "Simulated on-switch", "type": "CLIPGenericStatus", "state": {"status": 0, "lastupdated": "2018-01-01T00:00:00"}},
+                },
+            "schedules": {},
+            "rules": {},
+            }
+        self.next_id = 1
+
+    def _node(self, path, create=False):
+        """Returns the state node for the given resource path or None if it does not exist."""
+        node = self.state
+        for key in path:
+            if not isinstance(node, dict) or (key not in node and not create):
+                return None
+            node = node.setdefault(key, {})
+        return node
+
+    def _rate_limited(self, path):
+        """Returns True if a command to the given path exceeds the bridge's rate limits."""
+        if path[:1] == ["lights"]:
+            return not self.light_bucket.take()
+        elif path[:1] == ["groups"]:
+            return not self.group_bucket.take()
+        return False
+
+    def _record(self, method, path, body, accepted):
+        """Records a command sent to the bridge."""
+        self.commands.append({"time": datetime.now().isoformat(), "method": method, "path": "/" + "/".join(path), "body": body, "accepted": accepted})
+
+    def respond(self, method, path, body=None):
+        """Returns the status code and body of a simulated bridge response for a request on the given resource path."""
+        if self.latency:
+            sleep(self.latency)
+        address = "/" + "/".join(path)
+        with self.lock:
+            if method == "GET":
+                node = self._node(path)
+                if node is None:
+                    return 200, [{"error": {"type": 3, "address": address, "description": "resource, {}, not available".format(address)}}]
+                return 200, copy.deepcopy(node)
+            if self._rate_limited(path):
+                self._record(method, path, body, False)
+                return 200, [{"error": {"type": 901, "address": address, "description": "Internal error, 503"}}]
+            self._record(method, path, body, True)
+            if method == "PUT":
+                node = self._node(path, create=True)
+                node.update(body or {})
+                if path[:1] == ["sensors"] and path[-1:] == ["state"]:
+                    node["lastupdated"] = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S")
+                if path[:1] == ["groups"] and path[-1:] == ["action"] and "scene" in (body or {}):
+                    for light_id in self.state["scenes"].get(body["scene"], {}).get("lights", []):
+                        self.state["lights"][light_id]["state"]["on"] = True
+                return 200, [{"success": {address + "/" + key: value}} for key, value in (body or {}).items()]
+            elif method == "POST":
+                collection = self._node(path, create=True)
+                new_id = str(self.next_id)
+                self.next_id += 1
+                collection[new_id] = body or {}
+                return 200, [{"success": {"id": new_id}}]
+            elif method == "DELETE":
+                parent = self._node(path[:-1])
+                if parent is None or path[-1] not in parent:
+                    return 200, [{"error": {"type": 3, "address": address, "description": "resource, {}, not available".format(address)}}]
+                del parent[path[-1]]
+                return 200, [{"success": address + " deleted"}]
+            return 405, [{"error": {"type": 4, "address": address, "description": "method, {}, not available for resource, {}".format(method, address)}}]
+
+
+class Entertainment_Receiver:
+    """Unencrypted UDP stand-in for a bridge's entertainment streaming endpoint. Decodes HueStream packets and keeps statistics about them."""
+
+    HEADER = struct.Struct(">9sBBBHBB")
+    LIGHT = struct.Struct(">BHHHH")
+
+    def __init__(self, host="127.0.0.1", port=0):
+        """Initialises the Entertainment_Receiver class. Port 0 picks a free port."""
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.socket.settimeout(0.2)
+        self.lock = threading.Lock()
+        self.packets = 0
+        self.invalid_packets = 0
+        self.first_packet = None
+        self.last_packet = None
+        self.lights = {}
+        self.running = False
+        self.thread = None
+
+    @property
+    def port(self):
+        """Returns the port the receiver listens on."""
+        return self.socket.getsockname()[1]
+
+    def _decode(self, packet):
+        """Decodes a HueStream packet and stores the light states it carries."""
+        protocol, major, minor, sequence, reserved, colour_space, reserved = self.HEADER.unpack_from(packet)
+        if protocol != b"HueStream" or (len(packet) - self.HEADER.size) % self.LIGHT.size:
+            self.invalid_packets += 1
+            return
+        for offset in range(self.HEADER.size, len(packet), self.LIGHT.size):
+            device_type, light_id, first, second, third = self.LIGHT.unpack_from(packet, offset)
+            self.lights[light_id] = {"colour_space": "xy" if colour_space else "rgb", "values": (first / 0xffff, second / 0xffff, third / 0xffff), "sequence": sequence}
+        self.packets += 1
+        self.last_packet = monotonic()
+        if self.first_packet is None:
+            self.first_packet = self.last_packet
+
+    def _receive(self):
+        """Receives packets until stopped."""
+        while self.running:
+            try:
+                packet = self.socket.recv(1024)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            with self.lock:
+                if len(packet) < self.HEADER.size:
+                    self.invalid_packets += 1
+                else:
+                    self._decode(packet)
+
+    @property
+    def packet_rate(self):
+        """Returns the mean number of packets received per second."""
+        with self.lock:
+            if self.first_packet is None or self.last_packet == self.first_packet:
+                return 0.0
+            return (self.packets - 1) / (self.last_packet - self.first_packet)
+
+    def start(self):
+        """Starts receiving in a background thread."""
+        self.running = True
+        self.thread = threading.Thread(target=self._receive, name="entertainment-receiver", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stops receiving and closes the socket."""
+        self.running = False
+        self.thread.join()
+        self.socket.close()
+        return True
+
+
+def _handler_for(departure_board=None, bridge=None):
+    """Returns a request handler class serving the given simulators."""
+
+    class Simulator_Request_Handler(BaseHTTPRequestHandler):
+        """Routes HTTP requests to the departure board or the bridge simulator."""
+
+        def _send_json(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _handle(self, method):
+            url = urlsplit(self.path)
+            parts = [part for part in url.path.split("/") if part]
+            if departure_board is not None and parts[-1:] == ["departureBoard"]:
+                if method != "GET" or "id" not in parse_qs(url.query):
+                    self._send_json(400, {"errorCode": "API_PARAM", "errorText": "Missing stop id"})
+                else:
+                    self._send_json(*departure_board.respond())
+            elif bridge is not None and parts[:1] == ["debug"] and parts[1:2] == ["commands"]:
+                self._send_json(200, bridge.commands)
+            elif bridge is not None and parts[:1] == ["api"] and len(parts) >= 2:
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"null") if length else None
+                self._send_json(*bridge.respond(method, parts[2:], body))
+            else:
+                self._send_json(404, {"error": "unknown resource"})
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_PUT(self):
+            self._handle("PUT")
+
+        def do_POST(self):
+            self._handle("POST")
+
+        def do_DELETE(self):
+            self._handle("DELETE")
+
+        def log_message(self, format, *args):
+            logger.debug("  >> %s - %s", self.address_string(), format % args)
+
+    return Simulator_Request_Handler
+
+
+class Simulator:
+    """Serves the departure board and bridge simulators on local HTTP ports in background threads."""
+
+    def __init__(self, departure_board=None, bridge=None, host="127.0.0.1", api_port=8081, bridge_port=8082, entertainment_port=8083):
+        """Initialises the Simulator class. Port 0 picks a free port."""
+        self.departure_board = departure_board or Departure_Board_Simulator()
+        self.bridge = bridge or Bridge_Simulator()
+        self.entertainment = Entertainment_Receiver(host, entertainment_port)
+        self.api_server = ThreadingHTTPServer((host, api_port), _handler_for(departure_board=self.departure_board))
+        self.bridge_server = ThreadingHTTPServer((host, bridge_port), _handler_for(bridge=self.bridge))
+        self.threads = []
+
+    @property
+    def mobiliteit_url(self):
+        """Returns the value to use for the mobiliteit_url setting."""
+        return "http://{}:{}/departureBoard?accessId=cdt&format=json&".format(*self.api_server.server_address)
+
+    @property
+    def hue_ip(self):
+        """Returns the value to use for the hue.ip setting."""
+        return "{}:{}".format(*self.bridge_server.server_address)
+
+    def start(self):
+        """Starts serving in background threads."""
+        for server in (self.api_server, self.bridge_server):
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        self.entertainment.start()
+        logger.info("Simulator running. mobiliteit_url: %s - hue ip: %s - entertainment port: %s", self.mobiliteit_url, self.hue_ip, self.entertainment.port)
+        return self
+
+    def stop(self):
+        """Stops serving and closes the sockets."""
+        for server in (self.api_server, self.bridge_server):
+            server.shutdown()
+            server.server_close()
+        for thread in self.threads:
+            thread.join()
+        self.entertainment.stop()
+        return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a local departure API and Hue bridge simulator.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--bridge-port", type=int, default=8082)
+    parser.add_argument("--entertainment-port", type=int, default=8083, help="UDP port receiving unencrypted entertainment streams")
+    parser.add_argument("--board-size", type=int, default=20, help="journeys per departure board")
+    parser.add_argument("--latency", type=float, default=0.0, help="mean departure API latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of departure API requests that fail")
+    parser.add_argument("--delay-drift", type=float, default=30, help="maximum change of a journey's delay per request in seconds")
+    parser.add_argument("--lights", type=int, default=3, help="number of simulated lights")
+    parser.add_argument("--bridge-latency", type=float, default=0.0, help="bridge response latency in seconds")
+    parser.add_argument("--record", help="file to write all recorded bridge commands to on exit")
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)-8s] %(name)15s ~ %(message)s")
+    simulator = Simulator(
+        Departure_Board_Simulator(arguments.board_size, arguments.latency, arguments.error_rate, arguments.delay_drift),
+        Bridge_Simulator(arguments.lights, arguments.bridge_latency),
+        arguments.host, arguments.api_port, arguments.bridge_port, arguments.entertainment_port,
+        ).start()
+    try:
+        while True:
+            sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.stop()
+        logger.info("%d departure requests (%d failed), %d bridge commands recorded, %d entertainment packets received.", simulator.departure_board.requests, simulator.departure_board.errors, len(simulator.bridge.commands), simulator.entertainment.packets)
+        if arguments.record:
+            with open(arguments.record, "w") as record_file:
+                json.dump(simulator.bridge.commands, record_file, indent=2)
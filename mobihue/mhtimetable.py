@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# mobiHue.py - announces real time bus arrivals using Philipps Hue lights
+# (c) 2017, 2018 Federico Gentile
+# Compact static timetable index built from a GTFS zip, used when no real time data is available.
+
+import argparse
+import bisect
+import csv
+import io
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import zipfile
+from datetime import datetime, timedelta
+
+
+logger = logging.getLogger("mH." + __name__)
+
+MAGIC = b"MHTT"
+INDEX_VERSION = 1
+# magic, index version, metadata length, departure count
+HEADER = struct.Struct("<4sHII")
+WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+
+
+def _gtfs_seconds(gtfs_time):
+    """Returns a GTFS HH:MM:SS time, which may exceed 24 hours, as seconds since the start of the service day."""
+    hours, minutes, seconds = gtfs_time.strip().split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+def _gtfs_date(gtfs_date):
+    """Returns a GTFS YYYYMMDD date as an integer that compares like the date."""
+    return int(gtfs_date)
+
+def _read_table(gtfs_zip, name):
+    """Yields the rows of a GTFS table as dictionaries. Missing optional tables yield nothing."""
+    if name not in gtfs_zip.namelist():
+        return
+    with gtfs_zip.open(name) as raw_table:
+        yield from csv.DictReader(io.TextIOWrapper(raw_table, encoding="utf-8-sig"))
+
+
+def build_index(gtfs_path, stop_id, lines, index_path):
+    """Builds the timetable index of the given stop and lines from a GTFS zip. Returns the number of departures indexed."""
+    lines = {str(line) for line in lines}
+    with zipfile.ZipFile(gtfs_path) as gtfs_zip:
+        route_lines = {}
+        for route in _read_table(gtfs_zip, "routes.txt"):
+            line = route.get("route_short_name") or route["route_id"]
+            if not lines or line in lines:
+                route_lines[route["route_id"]] = (line, route.get("route_long_name", ""))
+        trips = {}
+        for trip in _read_table(gtfs_zip, "trips.txt"):
+            if trip["route_id"] in route_lines:
+                trips[trip["trip_id"]] = trip
+        patterns = []
+        pattern_indexes = {}
+        services = []
+        service_indexes = {}
+        departures = []
+        for stop_time in _read_table(gtfs_zip, "stop_times.txt"):
+            if stop_time["stop_id"] != stop_id or stop_time["trip_id"] not in trips:
+                continue
+            trip = trips[stop_time["trip_id"]]
+            line, long_name = route_lines[trip["route_id"]]
+            pattern = (line, stop_time.get("stop_headsign") or trip.get("trip_headsign") or long_name, int(trip.get("direction_id") or 0))
+            if pattern not in pattern_indexes:
+                pattern_indexes[pattern] = len(patterns)
+                patterns.append(pattern)
+            if trip["service_id"] not in service_indexes:
+                service_indexes[trip["service_id"]] = len(services)
+                services.append(trip["service_id"])
+            departures.append((_gtfs_seconds(stop_time["departure_time"] or stop_time["arrival_time"]), pattern_indexes[pattern], service_indexes[trip["service_id"]]))
+        calendars = {service_id: {"weekdays": 0, "start": 0, "end": 0, "added": [], "removed": []} for service_id in services}
+        for calendar in _read_table(gtfs_zip, "calendar.txt"):
+            if calendar["service_id"] in calendars:
+                calendars[calendar["service_id"]].update(
+                    weekdays=sum(1 << day for day, name in enumerate(WEEKDAYS) if calendar[name].strip() == "1"),
+                    start=_gtfs_date(calendar["start_date"]),
+                    end=_gtfs_date(calendar["end_date"]),
+                    )
+        for calendar_date in _read_table(gtfs_zip, "calendar_dates.txt"):
+            if calendar_date["service_id"] in calendars:
+                calendars[calendar_date["service_id"]]["added" if calendar_date["exception_type"].strip() == "1" else "removed"].append(_gtfs_date(calendar_date["date"]))
+    if len(patterns) > 0xffff or len(services) > 0xffff:
+        raise ValueError("Too many distinct lines, directions or service calendars at stop {} for the timetable index.".format(stop_id))
+    departures.sort()
+    metadata = json.dumps({
+        "stop_id": stop_id,
+        "built": datetime.now().isoformat(),
+        "patterns": patterns,
+        "services": [calendars[service_id] for service_id in services],
+        }).encode("utf-8")
+    padding = b"\0" * (-(HEADER.size + len(metadata)) % 4)
+    temporary_path = index_path + ".tmp"
+    with open(temporary_path, "wb") as index_file:
+        index_file.write(HEADER.pack(MAGIC, INDEX_VERSION, len(metadata) + len(padding), len(departures)))
+        index_file.write(metadata + padding)
+        index_file.write(struct.pack("<{}I".format(len(departures)), *(departure[0] for departure in departures)))
+        index_file.write(struct.pack("<{}H".format(len(departures)), *(departure[1] for departure in departures)))
+        index_file.write(struct.pack("<{}H".format(len(departures)), *(departure[2] for departure in departures)))
+    os.replace(temporary_path, index_path)
+    logger.info("Indexed %d departure(s) of %d line and direction pattern(s) at stop %s.", len(departures), len(patterns), stop_id)
+    return len(departures)
+
+
+class Timetable:
+    """Memory-mapped static timetable index answering next scheduled departure queries without network access.
+
+    Departure times are stored as seconds since the start of the service day in one sorted array,
+    with the line and direction pattern and the service calendar of each departure in two parallel
+    arrays, so that a query is a binary search followed by a short scan.
+    """
+
+    def __init__(self, path, horizon=120):
+        """Initialises the Timetable class. Departures up to horizon minutes ahead are returned."""
+        self.path = path
+        self.horizon = timedelta(minutes=horizon)
+        with open(path, "rb") as index_file:
+            self.index_map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, metadata_length, count = HEADER.unpack_from(self.index_map)
+        if magic != MAGIC or version != INDEX_VERSION:
+            raise ValueError("{} is not a version {} timetable index.".format(path, INDEX_VERSION))
+        metadata_end = HEADER.size + metadata_length
+        metadata = json.loads(bytes(self.index_map[HEADER.size:metadata_end]).rstrip(b"\0"))
+        self.stop_id = metadata["stop_id"]
+        self.patterns = [tuple(pattern) for pattern in metadata["patterns"]]
+        self.services = metadata["services"]
+        for service in self.services:
+            service["added"] = set(service["added"])
+            service["removed"] = set(service["removed"])
+        # The arrays are little-endian, matching the native byte order of the platforms mobiHue runs on
+        index_view = memoryview(self.index_map)
+        self.times = index_view[metadata_end:metadata_end + 4 * count].cast("I")
+        self.pattern_ids = index_view[metadata_end + 4 * count:metadata_end + 6 * count].cast("H")
+        self.service_ids = index_view[metadata_end + 6 * count:metadata_end + 8 * count].cast("H")
+        self.active_services = {}
+        logger.info("Loaded timetable index %s with %d departure(s) built on %s.", path, count, metadata["built"])
+
+    def _active_services(self, day):
+        """Returns a list telling for every service calendar whether it runs on the given day."""
+        if day not in self.active_services:
+            gtfs_date = int(day.strftime("%Y%m%d"))
+            weekday = 1 << day.weekday()
+            self.active_services[day] = [
+                gtfs_date not in service["removed"] and (gtfs_date in service["added"] or (service["weekdays"] & weekday != 0 and service["start"] <= gtfs_date <= service["end"]))
+                for service in self.services
+                ]
+            if len(self.active_services) > 8:
+                self.active_services.pop(next(iter(self.active_services)))
+        return self.active_services[day]
+
+    def next_departures(self, moment, horizon=None):
+        """Returns (scheduled datetime, line, direction) tuples of all departures between moment and moment plus the horizon, in order."""
+        end = moment + (horizon or self.horizon)
+        departures = []
+        # Trips of the previous service day may run past midnight
+        day = moment.date() - timedelta(days=1)
+        while day <= end.date():
+            midnight = datetime.combine(day, datetime.min.time())
+            active = self._active_services(day)
+            position = bisect.bisect_left(self.times, max(0, int((moment - midnight).total_seconds())))
+            end_seconds = (end - midnight).total_seconds()
+            while position < len(self.times) and self.times[position] < end_seconds:
+                if active[self.service_ids[position]]:
+                    line, direction, direction_id = self.patterns[self.pattern_ids[position]]
+                    departures.append((midnight + timedelta(seconds=self.times[position]), line, direction))
+                position += 1
+            day += timedelta(days=1)
+        departures.sort()
+        return departures
+
+    def departure_board(self, moment):
+        """Returns the next scheduled departures as a departure board without real time data."""
+        return {"Departure": [
+            {"Product": {"line": line}, "direction": direction, "date": scheduled.strftime("%Y-%m-%d"), "time": scheduled.strftime("%H:%M:%S")}
+            for scheduled, line, direction in self.next_departures(moment)
+            ]}
+
+    def merge(self, board, moment):
+        """Returns the scheduled departures with the journeys of a real time departure board laid over them.
+
+        Journeys of the board replace scheduled departures of the same line and scheduled time and
+        are added otherwise. Without a usable board, only the scheduled departures are returned.
+        """
+        static_board = self.departure_board(moment)
+        if not board or "Departure" not in board:
+            logger.warning("No real time departures available, using the static timetable.")
+            return static_board
+        journeys = {(str(journey["Product"]["line"]), journey["date"], journey["time"]): journey for journey in static_board["Departure"]}
+        for journey in board["Departure"]:
+            journeys[(str(journey["Product"]["line"]), journey["date"], journey["time"])] = journey
+        merged_board = dict(board)
+        merged_board["Departure"] = list(journeys.values())
+        return merged_board
+
+    def close(self):
+        """Releases the memory map."""
+        self.times.release()
+        self.pattern_ids.release()
+        self.service_ids.release()
+        self.index_map.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Builds the static timetable index of a stop from a GTFS zip.")
+    parser.add_argument("gtfs", help="GTFS zip file")
+    parser.add_argument("stop_id", help="GTFS stop id of the stop to index")
+    parser.add_argument("lines", nargs="*", help="lines to index (default: all lines serving the stop)")
+    parser.add_argument("-o", "--output", default="timetable.idx", help="index file to write (default: timetable.idx)")
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if not build_index(arguments.gtfs, arguments.stop_id, arguments.lines, arguments.output):
+        logger.error("No departures found for stop %s.", arguments.stop_id)
+        sys.exit(1)
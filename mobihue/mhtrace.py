@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# mobiHue.py - announces real time bus arrivals using Philipps Hue lights
+# (c) 2017, 2018 Federico Gentile
+# Per-cycle tracing spans in the trace event format and an on-demand sampling profiler.
+
+import json
+import logging
+import os
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+from time import perf_counter, sleep
+
+
+logger = logging.getLogger("mH." + __name__)
+
+
+class Span:
+    """Context manager recording the duration of its block as a complete trace event."""
+
+    def __init__(self, tracer, name, args):
+        """Initialises the Span class."""
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.add(self.name, self.start, perf_counter() - self.start, self.args)
+        return False
+
+
+class Null_Span:
+    """Span used while tracing is disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_SPAN = Null_Span()
+
+
+class Tracer:
+    """Writes spans to a size-rotated file in the trace event format, readable by chrome://tracing and Perfetto.
+
+    Each file holds a JSON array whose closing bracket is omitted, which the format explicitly allows.
+    Events are buffered and written out by flush(), which the controller calls once per cycle.
+    """
+
+    def __init__(self, path=None, max_bytes=10 * 1024 * 1024, backup_count=3):
+        """Initialises the Tracer class. Tracing is disabled if no path is given."""
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.enabled = path is not None
+        self.events = []
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.trace_file = None
+
+    def span(self, name, **args):
+        """Returns a context manager tracing its block under the given name."""
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, args)
+
+    def add(self, name, start, duration, args=None):
+        """Buffers a complete event. Start and duration are given in perf_counter seconds."""
+        event = {"name": name, "ph": "X", "ts": round(start * 1e6), "dur": round(duration * 1e6), "pid": self.pid, "tid": threading.get_ident()}
+        if args:
+            event["args"] = args
+        with self.lock:
+            self.events.append(event)
+
+    def _open(self):
+        """Opens a fresh trace file."""
+        self.trace_file = open(self.path, "w")
+        self.trace_file.write("[\n")
+
+    def _rotate(self):
+        """Closes the current trace file and shifts the backups."""
+        self.trace_file.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            if os.path.exists("{}.{}".format(self.path, index)):
+                os.replace("{}.{}".format(self.path, index), "{}.{}".format(self.path, index + 1))
+        if self.backup_count > 0:
+            os.replace(self.path, self.path + ".1")
+        self._open()
+
+    def flush(self):
+        """Writes all buffered events to the trace file."""
+        if not self.enabled or not self.events:
+            return
+        with self.lock:
+            events, self.events = self.events, []
+        try:
+            if self.trace_file is None:
+                self._open()
+            for event in events:
+                self.trace_file.write(json.dumps(event) + ",\n")
+            self.trace_file.flush()
+            if self.trace_file.tell() > self.max_bytes:
+                self._rotate()
+        except IOError as io_error:
+            logger.warning("Could not write trace events, disabling tracing: %s", io_error)
+            self.enabled = False
+
+    def close(self):
+        """Flushes and closes the trace file."""
+        self.flush()
+        if self.trace_file is not None:
+            self.trace_file.close()
+            self.trace_file = None
+
+
+class Sampling_Profiler:
+    """Periodically samples the stack of a thread and dumps the result in the collapsed stack format used by flame graph tools."""
+
+    def __init__(self, directory="/tmp", interval=0.005, thread_id=None):
+        """Initialises the Sampling_Profiler class. Profiles the main thread unless a thread id is given."""
+        self.directory = directory
+        self.interval = interval
+        self.thread_id = thread_id or threading.main_thread().ident
+        self.samples = Counter()
+        self.running = False
+        self.thread = None
+
+    def _sample(self):
+        """Collects stack samples until stopped."""
+        while self.running:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append("{}:{}".format(os.path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+            sleep(self.interval)
+
+    def start(self):
+        """Starts sampling."""
+        if not self.running:
+            self.samples.clear()
+            self.running = True
+            self.thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+            self.thread.start()
+            logger.info("Sampling profiler started.")
+        return True
+
+    def stop(self):
+        """Stops sampling and dumps the collected samples. Returns the path of the dump."""
+        if not self.running:
+            return None
+        self.running = False
+        self.thread.join()
+        path = os.path.join(self.directory, "mobihue-profile-{}.folded".format(datetime.now().strftime("%Y%m%d-%H%M%S")))
+        try:
+            with open(path, "w") as profile_file:
+                for stack, count in self.samples.most_common():
+                    profile_file.write("{} {}\n".format(stack, count))
+        except IOError as io_error:
+            logger.error("Could not write profile: %s", io_error)
+            return None
+        logger.info("Sampling profiler stopped, %d samples written to %s.", sum(self.samples.values()), path)
+        return path
+
+    def toggle(self):
+        """Starts the profiler if it is stopped and stops it otherwise."""
+        if self.running:
+            return self.stop()
+        return self.start()
+
+
+tracer = Tracer()
+
+
+def configure(path=None, max_bytes=10 * 1024 * 1024, backup_count=3):
+    """Enables tracing to the given file, or disables it if no path is given. The previous trace file is closed."""
+    global tracer
+    tracer.close()
+    tracer = Tracer(path, max_bytes, backup_count)
+    if path is not None:
+        logger.info("Tracing spans to %s.", path)
+    return tracer
+
+def span(name, **args):
+    """Returns a context manager tracing its block on the configured tracer."""
+    return tracer.span(name, **args)
+
+def flush():
+    """Writes buffered spans of the configured tracer."""
+    tracer.flush()
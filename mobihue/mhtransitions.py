@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# mobiHue.py - announces real time bus arrivals using Philipps Hue lights
+# (c) 2017, 2018 Federico Gentile
+# Compiles upcoming zone transitions into Hue bridge schedules, so that the bridge switches colours itself.
+
+import bisect
+import logging
+from datetime import timedelta
+from mhclock import now
+import mhmetrics
+
+
+logger = logging.getLogger("mH." + __name__)
+
+SCHEDULE_NAME = "mobiHue zone"
+LOCALTIME_PATTERN = "%Y-%m-%dT%H:%M:%S"
+
+
+def zone_for(eta, zone_thresholds):
+    """Returns the zone for an estimated time of arrival, using the same rule as the schedule."""
+    eta_minutes = int(eta.total_seconds() // 60)
+    for minutes, zone_name in zone_thresholds:
+        if eta_minutes <= minutes:
+            return zone_name
+    return "further"
+
+def zone_timeline(departures, zone_thresholds, start, end):
+    """Returns the (moment, zone) changes the light goes through between start and end, given the departure moments of the schedule.
+
+    The first entry is the zone at start. A departure is followed until it leaves, after which the
+    next departure determines the zone.
+    """
+    timeline = []
+    segment_start = start
+    for departure in sorted(departure for departure in departures if departure > start):
+        timeline.append((segment_start, zone_for(departure - segment_start, zone_thresholds)))
+        # Zone limits are inclusive minutes, so a zone starts one minute before its limit is reached
+        for minutes, zone_name in reversed(zone_thresholds):
+            moment = departure - timedelta(minutes=minutes + 1)
+            if segment_start < moment < end:
+                timeline.append((moment, zone_name))
+        if departure >= end:
+            break
+        segment_start = departure
+    changes = []
+    for moment, zone_name in timeline:
+        if not changes or changes[-1][1] != zone_name:
+            changes.append((moment, zone_name))
+    return changes
+
+
+class Transition_Scheduler:
+    """Keeps the upcoming zone transitions installed as schedules with absolute timestamps on the bridge and only rewrites those that changed."""
+
+    def __init__(self, bridge, key, slave, light_mode, horizon=30, max_schedules=10, lead=2):
+        """Initialises the Transition_Scheduler class. Transitions up to horizon minutes ahead are installed, but none sooner than lead seconds."""
+        self.bridge = bridge
+        self.key = key
+        self.slave = slave
+        self.light_mode = light_mode
+        self.horizon = timedelta(minutes=horizon)
+        self.max_schedules = max_schedules
+        self.lead = timedelta(seconds=lead)
+        self.installed = {}
+        self.plan = []
+        self._remove_leftovers()
+
+    def _remove_leftovers(self):
+        """Deletes schedules left on the bridge by a previous run."""
+        for schedule_id, bridge_schedule in self.bridge.schedules().items():
+            if bridge_schedule.get("name") == SCHEDULE_NAME:
+                self.bridge.schedules[schedule_id](http_method="delete")
+                logger.debug("  >> Deleted leftover bridge schedule %s.", schedule_id)
+
+    def _command(self, zone):
+        """Returns the bridge command setting the lights to a zone."""
+        if self.light_mode == "scenes":
+            return {"address": "/api/{}/groups/0/action".format(self.key), "method": "PUT", "body": {"scene": self.slave.scene_ids[zone]}}
+        return {"address": "/api/{}/lights/{}/state".format(self.key, self.slave.hue_light_id), "method": "PUT", "body": self.slave.states[zone]}
+
+    def update(self, departures, zone_thresholds):
+        """Installs the zone transitions of the given departure moments, deleting schedules that no longer apply. Returns True if the bridge schedules were changed."""
+        current_time = now()
+        changes = zone_timeline(departures, zone_thresholds, current_time, current_time + self.horizon)[1:]
+        # Transitions due within the lead time are only kept if they are already installed
+        self.plan = [(moment, zone_name) for moment, zone_name in changes if moment >= current_time + self.lead or (moment.strftime(LOCALTIME_PATTERN), zone_name) in self.installed][:self.max_schedules]
+        planned = {(moment.strftime(LOCALTIME_PATTERN), zone_name) for moment, zone_name in self.plan}
+        # Schedules that have fired were deleted by the bridge itself
+        current_localtime = current_time.strftime(LOCALTIME_PATTERN)
+        for transition in [transition for transition in self.installed if transition[0] <= current_localtime]:
+            del self.installed[transition]
+        obsolete = set(self.installed) - planned
+        missing = planned - set(self.installed)
+        for transition in obsolete:
+            with mhmetrics.bridge_command_seconds.time(endpoint="schedules"):
+                self.bridge.schedules[self.installed.pop(transition)](http_method="delete")
+        for localtime, zone_name in sorted(missing):
+            with mhmetrics.bridge_command_seconds.time(endpoint="schedules"):
+                response = self.bridge.schedules(name=SCHEDULE_NAME, description=zone_name, command=self._command(zone_name), localtime=localtime, autodelete=True, http_method="post")
+            self.installed[(localtime, zone_name)] = response[0]["success"]["id"]
+        if obsolete or missing:
+            logger.debug("  >> Bridge schedules rewritten: %d deleted, %d created.", len(obsolete), len(missing))
+        return bool(obsolete or missing)
+
+    def expected_zone(self, moment):
+        """Returns the zone the bridge has switched the lights to by the given moment, or None if no installed transition has fired yet.
+
+        A transition counts as fired just after its moment, when the schedule's estimated times of
+        arrival place the lights in the new zone as well.
+        """
+        index = bisect.bisect_left([planned_moment for planned_moment, zone_name in self.plan], moment) - 1
+        return self.plan[index][1] if index >= 0 else None
+
+    def clear(self):
+        """Deletes all installed schedules."""
+        for schedule_id in self.installed.values():
+            self.bridge.schedules[schedule_id](http_method="delete")
+        if self.installed:
+            logger.debug("  >> %d bridge schedule(s) deleted.", len(self.installed))
+        self.installed = {}
+        self.plan = []
+        return True
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# mobiHue.py - announces real time bus arrivals using Philipps Hue lights
+# (c) 2017, 2018 Federico Gentile
+# Watchdog detecting a stalled control loop.
+
+import logging
+import sys
+import threading
+import traceback
+from time import monotonic
+import mhmetrics
+
+
+logger = logging.getLogger("mH." + __name__)
+
+stalls = mhmetrics.registry.counter("mobihue_stalls_total", "Control loop ticks that exceeded the watchdog deadline.")
+
+
+def dump_stacks():
+    """Logs the current stack of every thread."""
+    thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+    for thread_id, frame in sys._current_frames().items():
+        logger.error("Stack of thread %s (%s):\n%s", thread_names.get(thread_id, "unknown"), thread_id, "".join(traceback.format_stack(frame)))
+
+
+class Watchdog(threading.Thread):
+    """Background thread checking that the control loop keeps sending heartbeats."""
+
+    def __init__(self, deadline=60.0, check_interval=1.0, on_stall=None):
+        """Initialises the Watchdog class. on_stall is called from the watchdog thread once per stall."""
+        super(Watchdog, self).__init__(name="watchdog", daemon=True)
+        self.deadline = deadline
+        self.check_interval = check_interval
+        self.on_stall = on_stall
+        self.last_heartbeat = monotonic()
+        self.stalled = False
+        self.stall_count = 0
+        self.stopped = threading.Event()
+
+    def heartbeat(self):
+        """Signals that the control loop is alive."""
+        self.last_heartbeat = monotonic()
+        if self.stalled:
+            logger.warning("Control loop recovered from stall.")
+            self.stalled = False
+
+    def run(self):
+        """Checks the heartbeat until stopped."""
+        while not self.stopped.wait(self.check_interval):
+            silence = monotonic() - self.last_heartbeat
+            if silence > self.deadline and not self.stalled:
+                self.stalled = True
+                self.stall_count += 1
+                stalls.inc()
+                logger.error("Control loop stalled: no heartbeat for %.1f seconds (deadline %.1f seconds). Dumping stacks.", silence, self.deadline)
+                dump_stacks()
+                if self.on_stall is not None:
+                    self.on_stall()
+
+    def stop(self):
+        """Stops the watchdog."""
+        self.stopped.set()
@@ -9,7 +9,7 @@
 import logging
 import logging.handlers
 from mhcontroller import Controller
-from mobifunctions import print_welcome
+from mobifunctions import print_welcome, Background_Log_Handler, Sampling_Filter
 
 # Logging setup
 logger = logging.getLogger("mH")
@@ -19,7 +19,9 @@ logging_consolehandler = logging.StreamHandler()
 logging_formatter = logging.Formatter('%(asctime)s [%(levelname)-8s] %(name)15s ~ %(message)s', datefmt='%Y/%m/%d %H:%M:%S')
 logging_filehandler.setFormatter(logging_formatter)
 logging_consolehandler.setFormatter(logging_formatter)
-logger.addHandler(logging_consolehandler)
+logging_backgroundhandler = Background_Log_Handler(logging_consolehandler)
+logging_backgroundhandler.addFilter(Sampling_Filter(60))
+logger.addHandler(logging_backgroundhandler)
 
 
 requests_logger = logging.getLogger("requests.packages.urllib3.connectionpool")
@@ -40,24 +42,68 @@ if __name__ == "__main__":
 
     import sys
 
-    if len(sys.argv) != 2:
-        sys.exit("Syntax: %s standalone | start | stop | status" % sys.argv[0])
+    syntax = "Syntax: %s standalone | start | stop | restart | status [socket] | control <command> [argument] [socket] | record <file> | replay <file> [speed]" % sys.argv[0]
+    if len(sys.argv) < 2:
+        sys.exit(syntax)
 
     cmd = sys.argv[1].lower()
 
+    if cmd in ("record", "replay", "control") and len(sys.argv) < 3 or cmd not in ("record", "replay", "control", "status") and len(sys.argv) != 2:
+        sys.exit(syntax)
+
+    if cmd in ("status", "control"):
+        import json
+        import os
+        from mhcontrol import control_request, DEFAULT_SOCKET_PATH
+        arguments = sys.argv[2:]
+        socket_path = arguments.pop() if arguments and os.path.sep in arguments[-1] else DEFAULT_SOCKET_PATH
+        try:
+            print(json.dumps(control_request(" ".join(arguments) if cmd == "control" else "status", socket_path), indent=2))
+            sys.exit(0)
+        except OSError as control_error:
+            if cmd == "control":
+                sys.exit("Could not reach the control socket %s: %s" % (socket_path, control_error))
+
     if cmd == "standalone":
         print_welcome()
         logger.info("Starting synchronisation module ...")
         controller = Controller()
         controller.run()
         logger.info("Exiting program ...")
+    elif cmd == "record":
+        import mhrecorder
+        print_welcome()
+        mhrecorder.start_recording(sys.argv[2])
+        try:
+            Controller().run()
+        finally:
+            mhrecorder.stop_recording()
+        logger.info("Exiting program ...")
+    elif cmd == "replay":
+        import os
+        import signal
+        import mhclock
+        from mhrecorder import Replayer
+        print_welcome()
+        replayer = Replayer(sys.argv[2])
+        speed = float(sys.argv[3]) if len(sys.argv) > 3 else 100.0
+        mhclock.set_clock(replayer.clock(speed or None, on_end=lambda: os.kill(os.getpid(), signal.SIGINT)))
+        logger.info("Replaying %s at %sx speed ...", sys.argv[2], speed)
+        Controller(bridge=replayer.bridge(), source=replayer.departures).run()
+        logger.info("Replay finished.")
     else:
-        logger.addHandler(logging_filehandler)
+        logging_backgroundhandler.add_target(logging_filehandler)
         service = Controller.as_service(logger)
         if cmd == "start":
             service.start()
         elif cmd == "stop":
             service.stop()
+        elif cmd == "restart":
+            service.stop(block=10)
+            if service.is_running():
+                logger.warning("Service did not stop within 10 seconds, killing it.")
+                service.kill(block=10)
+            service.start()
         elif cmd == "status":
             if service.is_running():
                 print("mobiHue service is running.")
@@ -6,10 +6,22 @@
 # Auxiliary functions for mobiHue
 
 import logging
+import logging.handlers
+import functools
+import importlib
+import os
+import queue
+import threading
+from time import monotonic
 
 
 logger = logging.getLogger("mH." + __name__)
 
+VERSION = "0.3.0"
+
+# Pass as extra to mark repetitive per-tick messages for rate-limited sampling.
+SAMPLED = {"sampled": True}
+
 
 def print_welcome():
     """Print welcome message on launch."""
@@ -18,4 +30,130 @@ def print_welcome():
     logger.info("mobiHue starting ...")
 
 def backoff_handler(details):
-    logger.warning("Backing off {wait:0.1f} seconds afters {tries} tries calling function {target} with args {args} and kwargs {kwargs}".format(**details))
\ No newline at end of file
+    logger.warning("Backing off %.1f seconds afters %s tries calling function %s with args %s and kwargs %s", details["wait"], details["tries"], details["target"], details["args"], details["kwargs"])
+
+def build_transport_index(transport):
+    """Returns a lookup table mapping each configured line number to the (partial) directions to watch out for."""
+    transport_index = {}
+    for bus in transport:
+        transport_index.setdefault(str(bus["number"]), []).append(bus["direction"])
+    return transport_index
+
+def build_zone_thresholds(zones):
+    """Returns the upper minute limit of every zone with a limit, in ascending order."""
+    return sorted((zones[zone_name]["minutes"], zone_name) for zone_name in ("imminent", "close", "intermediate"))
+
+
+class Lazy_Module:
+    """Stands in for a module and only imports it when one of its attributes is first accessed."""
+
+    def __init__(self, name):
+        """Initialises the Lazy_Module class."""
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        """Imports the module on first use and forwards the attribute access to it."""
+        if self._module is None:
+            logger.debug("  >> Importing module %s on first use.", self._name)
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+
+def lazy_import(name):
+    """Returns a placeholder for the given module that defers the actual import until first use."""
+    return Lazy_Module(name)
+
+def retry_on_timeout(func):
+    """Retries the decorated function with an exponential backoff on request timeouts. The backoff and requests modules are only imported on the first call."""
+    retrying_func = []
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not retrying_func:
+            import backoff
+            import requests
+            retrying_func.append(backoff.on_exception(backoff.expo, requests.exceptions.Timeout, max_tries=3, on_backoff=backoff_handler)(func))
+        return retrying_func[0](*args, **kwargs)
+    return wrapper
+
+
+class Sampling_Filter(logging.Filter):
+    """Lets through at most one record per interval for every message marked as sampled and reports how many were suppressed."""
+
+    def __init__(self, interval=60.0):
+        """Initialises the Sampling_Filter class."""
+        super(Sampling_Filter, self).__init__()
+        self.interval = interval
+        self.last_seen = {}
+        self.suppressed = {}
+
+    def filter(self, record):
+        if not getattr(record, "sampled", False):
+            return True
+        key = (record.name, record.msg)
+        current_time = monotonic()
+        last_seen = self.last_seen.get(key)
+        if last_seen is not None and current_time - last_seen < self.interval:
+            self.suppressed[key] = self.suppressed.get(key, 0) + 1
+            return False
+        self.last_seen[key] = current_time
+        suppressed = self.suppressed.pop(key, 0)
+        if suppressed and isinstance(record.args, tuple):
+            record.msg = str(record.msg) + " (%d similar message(s) suppressed)"
+            record.args = record.args + (suppressed,)
+        return True
+
+
+class Background_Log_Handler(logging.handlers.QueueHandler):
+    """Queues log records and hands them to the target handlers on a background thread.
+
+    Records are queued unformatted, so both formatting and I/O happen off the calling thread. The
+    listener thread is started lazily by the first record of each process, which keeps logging
+    working after the fork into a daemon.
+    """
+
+    def __init__(self, *target_handlers):
+        """Initialises the Background_Log_Handler class."""
+        super(Background_Log_Handler, self).__init__(queue.SimpleQueue())
+        self.target_handlers = list(target_handlers)
+        self.listener = None
+        self.listener_pid = None
+        self.listener_lock = threading.Lock()
+
+    def add_target(self, handler):
+        """Adds a target handler, restarting the listener if it is already running in this process."""
+        self.target_handlers.append(handler)
+        if self.listener_pid == os.getpid():
+            with self.listener_lock:
+                self.listener.stop()
+                self.listener_pid = None
+
+    def _start_listener(self):
+        """Starts the listener thread for the current process."""
+        with self.listener_lock:
+            if self.listener_pid != os.getpid():
+                self.queue = queue.SimpleQueue() if self.listener_pid is not None else self.queue
+                self.listener = logging.handlers.QueueListener(self.queue, *self.target_handlers, respect_handler_level=True)
+                self.listener.start()
+                self.listener_pid = os.getpid()
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        if self.listener_pid != os.getpid():
+            self._start_listener()
+        super(Background_Log_Handler, self).enqueue(record)
+
+    def file_handles(self):
+        """Returns the open streams of the target handlers, which have to stay open when daemonising."""
+        return [handler.stream for handler in self.target_handlers if getattr(handler, "stream", None)]
+
+    def close(self):
+        """Stops the listener after it has handled all queued records."""
+        with self.listener_lock:
+            if self.listener_pid == os.getpid():
+                self.listener.stop()
+                self.listener_pid = None
+        super(Background_Log_Handler, self).close()
@@ -6,10 +6,13 @@
 # HAFAS / Mobiliteit.lu schedule module
 
 import logging
-import requests
 import operator
 from datetime import datetime, timedelta
-from time import sleep
+from mhclock import now
+from mobifunctions import SAMPLED, build_transport_index, build_zone_thresholds
+from mhbackends import Hafas_Backend
+import mhmetrics
+import mhtrace
 
 
 logger = logging.getLogger("mH." + __name__)
@@ -18,8 +21,8 @@ logger = logging.getLogger("mH." + __name__)
 class Bus:
     """Holds journey information for a single Bus at a time."""
 
-    def __init__(self, line, direction, time, rtTime, eta, delay, zone):
-        """Initialise the Bus class."""
+    def __init__(self, line, direction, time, rtTime, eta, delay, zone, confidence=1.0):
+        """Initialise the Bus class. The confidence ranges from 0 for a bare scheduled time to 1 for real time data."""
         self.line = line
         self.direction = direction
         self.time = time
@@ -27,155 +30,214 @@ class Bus:
         self.eta = eta
         self.delay = delay
         self.zone = zone
+        self.confidence = confidence
 
     def __str__(self):
         """Returns a human readable representation of the Bus class instance."""
-        return "Bus instance [line: {}, direction: {}, time: {}, real time: {}, eta: {}, delay: {}, zone: {}]".format(self.line, self.direction, self.time, self.rtTime, self.eta, self.delay, self.zone)
+        return "Bus instance [line: {}, direction: {}, time: {}, real time: {}, eta: {}, delay: {}, zone: {}, confidence: {:.2f}]".format(self.line, self.direction, self.time, self.rtTime, self.eta, self.delay, self.zone, self.confidence)
 
     def __repr__(self):
         """Returns an object representation of the Bus class instance."""
-        return "Bus({}, {}, {}, {}, {}, {}, {})".format(self.line, self.direction, self.time, self.rtTime, self.eta, self.delay, self.zone)
+        return "Bus({}, {}, {}, {}, {}, {}, {}, {})".format(self.line, self.direction, self.time, self.rtTime, self.eta, self.delay, self.zone, self.confidence)
+
+    @property
+    def key(self):
+        """Returns a key identifying the journey across schedule updates."""
+        return (str(self.line), self.direction, self.time)
+
+
+class Departure_Event:
+    """Describes a single change between two consecutive schedule updates."""
+
+    ADDED = "departure_added"
+    REMOVED = "departure_removed"
+    DELAY_CHANGED = "delay_changed"
+    ZONE_CHANGED = "zone_changed"
+    NEXT_CHANGED = "next_departure_changed"
+
+    def __init__(self, event_type, bus, previous=None):
+        """Initialise the Departure_Event class."""
+        self.type = event_type
+        self.bus = bus
+        self.previous = previous
+
+    def __str__(self):
+        """Returns a human readable representation of the Departure_Event class instance."""
+        return "Departure event [type: {}, bus: {}, previous: {}]".format(self.type, self.bus, self.previous)
+
+    def __repr__(self):
+        """Returns an object representation of the Departure_Event class instance."""
+        return "Departure_Event({}, {!r}, {!r})".format(self.type, self.bus, self.previous)
 
 
 class Schedule:
     """Connects to the Mobiliteit.lu API and returns all relevant timetable data for the program."""
 
-    def __init__(self, transport, stop_id, api_base_url, zones):
-        """Initialise the Schedule class."""
-        self.transport = transport
-        self.stop_id = stop_id
-        self.api_base_url = api_base_url
-        self.api_final_url = self.api_base_url + self.stop_id
-        self.zones = zones
-        self.allowed_error_count = 3
-        self.connection_timeout = None
+    def __init__(self, transport, stop_id, api_base_url, zones, transport_index=None, zone_thresholds=None, source=None, backend=None):
+        """Initialise the Schedule class. Departures are fetched from the Mobiliteit.lu API unless another transit backend is given, or a callable returning departure board JSON as source."""
+        self.backend = backend if backend is not None else Hafas_Backend()
+        self.configure(transport, stop_id, api_base_url, zones, transport_index, zone_thresholds)
+        self.source = source if source is not None else self.backend.departure_board
+        self.predictor = None
+        self.timetable = None
         self.last_update = False
+        self.board_empty = False
         self.next_departure = None
         self.last_departure = None
         self.all_departures = None
         self.total_departures = None
+        self.events = []
 
-    def _mobi_api_request(self):
-        """Executes a Mobiliteit.lu API HTTP request."""
-        for self.error_count in range(self.allowed_error_count):
-            try:
-                self.api_request = requests.get(self.api_final_url, timeout=self.connection_timeout, headers={"host":"travelplanner.mobiliteit.lu"})
-                self.api_request.raise_for_status()
-            except (requests.ConnectionError, requests.HTTPError, requests.TooManyRedirects, requests.Timeout) as e:
-                if self.error_count < self.allowed_error_count - 1:
-                    logger.warning("The HTTP request to the Mobiliteit.lu API raised an exception. Waiting 2 seconds. Try %s of %s ...", str(self.error_count + 2), str(self.allowed_error_count))
-                    sleep(2)
-                    continue
-                else:
-                    logger.error("The HTTP request to the Mobiliteit.lu API failed an raised exceptions for a total of %s tries. Returning empty result.", str(self.allowed_error_count))
-                    return False
-            break
-        return self.api_request
-
-    def _mobi_api_json(self):
-        """Executes the Mobiliteit.lu API request function and turns the result into a JSON object."""
-        self.api_request = self._mobi_api_request()
-        if not self.api_request:
-            return False
-        else:
-            try:
-                self.api_json = self.api_request.json()
-            except ValueError:
-                logger.critical("A JSON decoding error was encountered.")
-                raise
-            else:
-                return self.api_json
+    def configure(self, transport, stop_id, api_base_url, zones, transport_index=None, zone_thresholds=None):
+        """Sets the stop, the transport filters and the zones used to build the schedule. Can be called again on a running instance."""
+        self.transport = transport
+        self.stop_id = stop_id
+        self.api_base_url = api_base_url
+        self.backend.configure(stop_id, api_base_url)
+        self.zones = zones
+        self.transport_index = transport_index if transport_index is not None else build_transport_index(transport)
+        self.zone_thresholds = zone_thresholds if zone_thresholds is not None else build_zone_thresholds(zones)
+        self.journey_cache = {}
+
+    def _is_watched(self, journey):
+        """Returns True if the journey's line and direction are among the configured transport."""
+        directions = self.transport_index.get(str(journey["Product"]["line"]))
+        return directions is not None and any(direction in journey["direction"] for direction in directions)
+
+    HAFAS_DATETIME_PATTERN = "%Y-%m-%d %H:%M:%S"
 
     def _string_to_datetime(self, journey, is_real_time):
         """"Converts strings of scheduled and realtime date-times to datetime objects."""
-        self.hafas_datetime_pattern = "%Y-%m-%d %H:%M:%S"
         if is_real_time:
-            return datetime.strptime(journey["rtDate"]+" "+journey["rtTime"], self.hafas_datetime_pattern)
+            return datetime.strptime(journey["rtDate"]+" "+journey["rtTime"], self.HAFAS_DATETIME_PATTERN)
         elif not is_real_time:
-            return datetime.strptime(journey["date"]+" "+journey["time"], self.hafas_datetime_pattern)
+            return datetime.strptime(journey["date"]+" "+journey["time"], self.HAFAS_DATETIME_PATTERN)
 
     def _eta_to_zone(self, eta):
         """Returns the appropriate zone for a given estimated time of arrival."""
-        self.eta_minutes = eta.seconds // 60
-        if self.eta_minutes <= self.zones["imminent"]["minutes"]:
-            # Bus or train arrival imminent
-            self.zone_name = "imminent"
-        elif self.eta_minutes <= self.zones["close"]["minutes"]:
-            # Bus or train close
-            self.zone_name = "close"
-        elif self.eta_minutes <= self.zones["intermediate"]["minutes"]:
-            # Bus or train at intermediate distance
-            self.zone_name = "intermediate"
-        elif self.eta_minutes > self.zones["intermediate"]["minutes"]:
-            # Bus or train at safe distance
-            self.zone_name = "further"
-        return self.zone_name
-
-    def _parseJourneyTimes(self, journey, time_anchor):
-        """Calculates all relevant date-times for a given journey."""
-        self.scheduled_time = self._string_to_datetime(journey, False)
+        eta_minutes = eta.seconds // 60
+        for minutes, zone_name in self.zone_thresholds:
+            if eta_minutes <= minutes:
+                return zone_name
+        # Bus or train at safe distance
+        return "further"
+
+    def _parseJourneyTimes(self, journey):
+        """Returns the line, direction, scheduled time, real time, delay, confidence and expected arrival of a journey. Without real time data, the delay is predicted if a predictor is set."""
+        scheduled_time = self._string_to_datetime(journey, False)
+        confidence = 1.0
         if "rtTime" in journey:
-            self.rtTime = self._string_to_datetime(journey,True)
-            self.eta = self.rtTime - time_anchor
-            self.temp_delay = self.rtTime - self.scheduled_time
-            if self.temp_delay.seconds > 0:
-                self.delay = self.temp_delay
-            elif self.temp_delay.seconds == 0:
-                self.delay = False
+            rtTime = self._string_to_datetime(journey,True)
+            arrival = rtTime
+            temp_delay = rtTime - scheduled_time
+            if temp_delay.seconds > 0:
+                delay = temp_delay
+            elif temp_delay.seconds == 0:
+                delay = False
         elif "rtTime" not in journey:
-            self.rtTime = False
-            self.delay = False
-            self.eta = self.scheduled_time - time_anchor
-        self.current_zone = self._eta_to_zone(self.eta)
-        self.parsed_journey_times = {
-            "time": self.scheduled_time,
-            "rtTime": self.rtTime,
-            "eta": self.eta,
-            "delay": self.delay,
-            "zone": self.current_zone,
-        }
-        return self.parsed_journey_times
+            rtTime = False
+            prediction = self.predictor.predict(journey["Product"]["line"], scheduled_time) if self.predictor is not None else None
+            if prediction is None:
+                delay = False
+                confidence = 0.0
+                arrival = scheduled_time
+            else:
+                predicted_delay, confidence = prediction
+                delay = predicted_delay if predicted_delay > timedelta(0) else False
+                arrival = scheduled_time + predicted_delay
+        return (journey["Product"]["line"], journey["direction"], scheduled_time, rtTime, delay, confidence, arrival)
+
+    def _journey_identity(self, journey):
+        """Returns a key identifying a journey across departure boards, using the HAFAS journey reference if there is one."""
+        reference = journey.get("JourneyDetailRef")
+        if reference:
+            return reference["ref"]
+        return (str(journey["Product"]["line"]), journey["date"], journey["time"])
 
     def update(self):
+        """Fetches the departure board, lays it over the static timetable if one is set, and parses it. The raw response is released as soon as it has been parsed."""
+        with mhtrace.span("fetch"):
+            raw_schedule = self.source()
+        if self.timetable is not None:
+            raw_schedule = self.timetable.merge(raw_schedule, now())
+        with mhtrace.span("parse"), mhmetrics.schedule_update_seconds.time():
+            return self._parse_schedule(raw_schedule)
+
+    def _parse_schedule(self, raw_schedule):
         """Parses the raw Mobiliteit.lu response and returns a final list of all relevant buses and all relevant times in accordance with the settings."""
-        self.raw_schedule = self._mobi_api_json()
-        self.parsed_schedule = []
-        self.current_time = datetime.now().replace(second=0, microsecond=0)
-        if not self.raw_schedule or "Departure" not in self.raw_schedule:
+        parsed_schedule = []
+        # Estimated times of arrival use the exact time, like the zone transitions left to bridge schedules
+        current_time = now()
+        self.last_update = current_time
+        # Tells a board without any departures apart from a failed request
+        self.board_empty = bool(raw_schedule) and not raw_schedule.get("Departure")
+        if not raw_schedule or "Departure" not in raw_schedule:
             logger.warning("No departure data included in API response!")
             self._assign_schedule_variables(False)
             return False
-        elif "Departure" in self.raw_schedule:
-            logger.debug("  >> Departure data with %s journeys found.", str(len(self.raw_schedule["Departure"])))
-            for self.journey in self.raw_schedule["Departure"]:
-                if any(str(self.bus["number"]) == str(self.journey["Product"]["line"]) and self.bus["direction"] in self.journey["direction"] for self.bus in self.transport):
-                    self.departure_times = self._parseJourneyTimes(self.journey, self.current_time)
-                    self.new_bus = {
-                        "line": self.journey["Product"]["line"],
-                        "direction": self.journey["direction"],
-                        "time": self.departure_times["time"],
-                        "rtTime": self.departure_times["rtTime"],
-                        "eta": self.departure_times["eta"],
-                        "delay": self.departure_times["delay"],
-                        "zone": self.departure_times["zone"],
-                        }
-                    logger.debug("    - Adding bus: %s", str(self.new_bus))
-                    self.parsed_schedule.append(Bus(**self.new_bus))
-            self.parsed_schedule.sort(key=operator.attrgetter("eta"))
-            if len(self.parsed_schedule) > 0:
-                logger.debug("    -- Total of %s buses added.", str(len(self.parsed_schedule)))
-                self._assign_schedule_variables(self.parsed_schedule)
+        elif "Departure" in raw_schedule:
+            logger.debug("  >> Departure data with %s journeys found.", len(raw_schedule["Departure"]), extra=SAMPLED)
+            journey_cache = {}
+            cache_misses = 0
+            for journey in raw_schedule["Departure"]:
+                # Journeys are only parsed and filtered again if their times or direction changed since the last update
+                identity = self._journey_identity(journey)
+                fingerprint = (journey["date"], journey["time"], journey.get("rtDate"), journey.get("rtTime"), journey["direction"])
+                cached = self.journey_cache.get(identity)
+                if cached is None or cached[0] != fingerprint:
+                    cached = (fingerprint, self._parseJourneyTimes(journey) if self._is_watched(journey) else None)
+                    cache_misses += 1
+                journey_cache[identity] = cached
+                if cached[1] is not None:
+                    line, direction, scheduled_time, rtTime, delay, confidence, arrival = cached[1]
+                    eta = arrival - current_time
+                    new_bus = Bus(line, direction, scheduled_time, rtTime, eta, delay, self._eta_to_zone(eta), confidence)
+                    logger.debug("    - Adding bus: %s", new_bus, extra=SAMPLED)
+                    parsed_schedule.append(new_bus)
+            mhmetrics.journey_cache.inc(len(raw_schedule["Departure"]) - cache_misses, outcome="hit")
+            mhmetrics.journey_cache.inc(cache_misses, outcome="miss")
+            self.journey_cache = journey_cache
+            parsed_schedule.sort(key=operator.attrgetter("eta"))
+            mhmetrics.journeys.inc(len(parsed_schedule), outcome="kept")
+            mhmetrics.journeys.inc(len(raw_schedule["Departure"]) - len(parsed_schedule), outcome="dropped")
+            if len(parsed_schedule) > 0:
+                logger.debug("    -- Total of %s buses added.", len(parsed_schedule))
+                self._assign_schedule_variables(parsed_schedule)
                 return True
-            elif len(self.parsed_schedule) == 0:
+            elif len(parsed_schedule) == 0:
                 logger.debug("    -- No buses added.")
                 self._assign_schedule_variables(False)
                 return False
-        self.last_update = self.current_time
+
+    def _diff_departures(self, previous, current):
+        """Compares two parsed schedules and returns the list of departure events between them."""
+        previous_by_key = {bus.key: bus for bus in previous or []}
+        current_by_key = {bus.key: bus for bus in current or []}
+        events = []
+        for key, bus in current_by_key.items():
+            previous_bus = previous_by_key.get(key)
+            if previous_bus is None:
+                events.append(Departure_Event(Departure_Event.ADDED, bus))
+                continue
+            if previous_bus.delay != bus.delay:
+                events.append(Departure_Event(Departure_Event.DELAY_CHANGED, bus, previous_bus))
+            if previous_bus.zone != bus.zone:
+                events.append(Departure_Event(Departure_Event.ZONE_CHANGED, bus, previous_bus))
+        for key, previous_bus in previous_by_key.items():
+            if key not in current_by_key:
+                events.append(Departure_Event(Departure_Event.REMOVED, previous_bus, previous_bus))
+        previous_next = previous[0] if previous else None
+        current_next = current[0] if current else None
+        if (previous_next.key if previous_next else None) != (current_next.key if current_next else None):
+            events.append(Departure_Event(Departure_Event.NEXT_CHANGED, current_next, previous_next))
+        return events
 
     def _assign_schedule_variables(self, parsed_schedule):
         """Assigns schedule data to the right internal variables."""
+        self.events = self._diff_departures(self.all_departures, parsed_schedule)
+        logger.debug("  >> %d departure event(s) since last update.", len(self.events), extra=SAMPLED)
         if parsed_schedule is not False:
-            logger.debug("  >> Assigning non-empty schedule variables.")
+            logger.debug("  >> Assigning non-empty schedule variables.", extra=SAMPLED)
             self.next_departure = parsed_schedule[0]
             self.last_departure = parsed_schedule[-1]
             self.all_departures = parsed_schedule
@@ -7,11 +7,12 @@
 
 import yaml
 import logging
-import sys
 import os
+import pickle
+import hashlib
 from rgb_xy import Converter, GamutC
-from webcolors import name_to_rgb
 from mhexception import Mobihue_Exception
+from mobifunctions import VERSION, build_transport_index, build_zone_thresholds
 
 
 logger = logging.getLogger("mH." + __name__)
@@ -20,19 +21,31 @@ logger = logging.getLogger("mH." + __name__)
 class Settings:
     """A class that loads and holds the settings."""
 
-    def __init__(self):
-        """Initialise the program's settings."""
+    CACHE_FORMAT = 1
+    # Instance attributes that configuration keys must not overwrite
+    RESERVED_NAMES = ("config", "directory", "full_config_file_path", "cache_file_path", "mtime", "cache_key", "converter")
+
+    def __init__(self, config_file_path=None):
+        """Initialise the program's settings, using the compiled settings cache if the configuration file is unchanged."""
         try:
             self.directory = os.path.dirname(os.path.realpath(__file__))
-            self.full_config_file_path = self.directory + "/config.yaml"
-            self.stream = open(self.full_config_file_path, "r")
+            self.full_config_file_path = config_file_path or self.directory + "/config.yaml"
+            self.cache_file_path = self.full_config_file_path + ".cache"
+            stream = open(self.full_config_file_path, "rb")
+            self.mtime = os.fstat(stream.fileno()).st_mtime
         except IOError:
             logger.error("Could not find configuration file under: %s", self.full_config_file_path)
             raise
         else:
-            with self.stream:
+            with stream:
+                raw_config = stream.read()
+            self.cache_key = self._cache_key(raw_config)
+            self.config = self._read_cache()
+            if self.config is not None:
+                logger.info("Configuration loaded from compiled settings cache.")
+            else:
                 try:
-                    self.config = yaml.safe_load(self.stream)
+                    self.config = yaml.safe_load(raw_config)
                     logger.info("Configuration file loaded successfully.")
                     self.converter = Converter(GamutC)
                     if self._use_scene_mode():
@@ -41,47 +54,108 @@ class Settings:
                     else:
                         logger.debug("  >> Using states to set the Hue lights.")
                         self._build_hue_zone_state()
+                    self._build_schedule_index()
                 except yaml.YAMLError as yaml_error:
-                    logger.error("A YAML error was raised while reading the configuration file: " + str(yaml_error))
+                    logger.error("A YAML error was raised while reading the configuration file: %s", yaml_error)
                     raise
+                self._write_cache()
+            for key, value in self.config.items():
+                if key in self.RESERVED_NAMES or hasattr(type(self), key):
+                    logger.warning("Ignoring configuration key %s, which is a reserved name.", key)
+                else:
+                    setattr(self, key, value)
 
     def __getattr__(self, name):
-        """Helper function to access the config dictionary like a class attribute."""
-        return self.config[name]
+        """Helper function to access configuration values missing from the instance attributes."""
+        try:
+            return self.__dict__["config"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def _cache_key(self, raw_config):
+        """Returns the key identifying a compiled settings cache for the given configuration file content."""
+        return hashlib.sha256(raw_config + "|{}|{}".format(VERSION, self.CACHE_FORMAT).encode()).hexdigest()
+
+    def _read_cache(self):
+        """Returns the compiled configuration from the settings cache or None if the cache is missing or stale."""
+        try:
+            with open(self.cache_file_path, "rb") as cache_file:
+                cache_key, config = pickle.load(cache_file)
+        except Exception as cache_error:
+            # Caches written by other versions of the program may fail to unpickle in many ways
+            logger.debug("  >> Compiled settings cache unreadable: %s", cache_error)
+            return None
+        if cache_key != self.cache_key:
+            logger.debug("  >> Compiled settings cache is stale.")
+            return None
+        return config
+
+    def _write_cache(self):
+        """Stores the compiled configuration in the settings cache."""
+        try:
+            with open(self.cache_file_path + ".tmp", "wb") as cache_file:
+                pickle.dump((self.cache_key, self.config), cache_file, pickle.HIGHEST_PROTOCOL)
+            os.replace(self.cache_file_path + ".tmp", self.cache_file_path)
+        except IOError as io_error:
+            logger.warning("Could not write compiled settings cache: %s", io_error)
+
+    def changed_sections(self, other):
+        """Returns the names of all top-level configuration sections that differ between these and other settings."""
+        return {key for key in set(self.config) | set(other.config) if self.config.get(key) != other.config.get(key)}
+
+    def file_has_changed(self):
+        """Returns True if the configuration file has been modified since these settings were loaded."""
+        try:
+            return os.path.getmtime(self.full_config_file_path) != self.mtime
+        except OSError:
+            return False
+
+    def acknowledge_file_change(self):
+        """Marks the current state of the configuration file as seen, e.g. after a failed reload."""
+        try:
+            self.mtime = os.path.getmtime(self.full_config_file_path)
+        except OSError:
+            pass
 
     def _colour_name_to_xy(self, colour_name):
         """Transforms a plain colour name to the XY format used by the Hue system."""
-        self.colour_rgb = name_to_rgb(colour_name)
-        self.colour_xy = self.converter.rgb_to_xy(self.colour_rgb[0], self.colour_rgb[1], self.colour_rgb[2])
-        return self.colour_xy
+        from webcolors import name_to_rgb
+        colour_rgb = name_to_rgb(colour_name)
+        colour_xy = self.converter.rgb_to_xy(colour_rgb[0], colour_rgb[1], colour_rgb[2])
+        return colour_xy
 
     def _build_hue_zone_state(self):
         """Build a ready made Hue light state from the zone settings of the config file."""
         self.config["hue"]["states"] = {}
-        for self.zone_key, self.zone_value in self.config["zones"].items():
-            if self.zone_value["effect"] == "None":
-                self.zone_alert, self.zone_effect = "none", "none"
-            elif self.zone_value["effect"] == "blink":
-                self.zone_alert, self.zone_effect = "lselect", "none"
-            elif self.zone_value["effect"] == "colourloop":
-                self.zone_alert, self.zone_effect = "none", "colorloop"
+        for zone_key, zone_value in self.config["zones"].items():
+            if zone_value["effect"] == "None":
+                zone_alert, zone_effect = "none", "none"
+            elif zone_value["effect"] == "blink":
+                zone_alert, zone_effect = "lselect", "none"
+            elif zone_value["effect"] == "colourloop":
+                zone_alert, zone_effect = "none", "colorloop"
             else:
-                logger.error("Invalid value found in effect settings: "+self.zone_value["effect"])
-                sys.exit("Aborting ...")
-            self.zone_xy_colour = self._colour_name_to_xy(self.zone_value["colour"])
-            self.config["zones"][self.zone_key]["hue_state"] = {"xy": self.zone_xy_colour, "alert": self.zone_alert, "effect": self.zone_effect}
-            self.config["hue"]["states"][self.zone_key] = self.config["zones"][self.zone_key]["hue_state"]
+                raise Mobihue_Exception("Invalid value found in effect settings: {}".format(zone_value["effect"]))
+            zone_xy_colour = self._colour_name_to_xy(zone_value["colour"])
+            self.config["zones"][zone_key]["hue_state"] = {"xy": zone_xy_colour, "alert": zone_alert, "effect": zone_effect}
+            self.config["hue"]["states"][zone_key] = self.config["zones"][zone_key]["hue_state"]
+        return self.config
+
+    def _build_schedule_index(self):
+        """Precomputes the transport lookup table and zone thresholds used by the schedule."""
+        self.config["transport_index"] = build_transport_index(self.config["transport"])
+        self.config["zone_thresholds"] = build_zone_thresholds(self.config["zones"])
         return self.config
 
     def _scrape_hue_scenes(self):
         """Collects all Hue scene IDs entered in the zone section of the configuration file and appends it to the Hue section."""
-        self.scene_list = {self.current_zone_key: self.current_zone_val["scene"] for self.current_zone_key, self.current_zone_val in self.config["zones"].items()}
-        self.config["hue"]["scenes"] = self.scene_list
+        scene_list = {current_zone_key: current_zone_val["scene"] for current_zone_key, current_zone_val in self.config["zones"].items()}
+        self.config["hue"]["scenes"] = scene_list
         return self.config
 
     def _use_scene_mode(self):
         """Returns true or false depending on whether or not the program should use the scenes indicated in the configuration file."""
-        if any(self.current_zone_val["scene"] is None for self.current_zone_key, self.current_zone_val in self.config["zones"].items()):
+        if any(current_zone_val["scene"] is None for current_zone_key, current_zone_val in self.config["zones"].items()):
             return False
         else:
             return True
@@ -15,11 +15,23 @@ logger = logging.getLogger("mH." + __name__)
 class Signal_Handler:
     """This class handles signals and exposes a catch to other modules."""
 
-    def __init__(self):
-        """Initialise the Signal_Handler class."""
+    def __init__(self, handle_sigint=True, handle_sigusr1=False, handle_sigusr2=False):
+        """Initialise the Signal_Handler class. SIGUSR1 and SIGUSR2 keep their default action unless handled."""
         self._sigint_caught = False
         self._sigint_response = None
-        signal.signal(signal.SIGINT, self._sigint_handler)
+        self._sighup_caught = False
+        self._sighup_response = None
+        self._sigusr1_caught = False
+        self._sigusr1_response = None
+        self._sigusr2_caught = False
+        self._sigusr2_response = None
+        if handle_sigint:
+            signal.signal(signal.SIGINT, self._sigint_handler)
+        signal.signal(signal.SIGHUP, self._sighup_handler)
+        if handle_sigusr1:
+            signal.signal(signal.SIGUSR1, self._sigusr1_handler)
+        if handle_sigusr2:
+            signal.signal(signal.SIGUSR2, self._sigusr2_handler)
 
     def _sigint_handler(self, signum, frame):
         """Gets called when a SIGINT is caught."""
@@ -31,4 +43,40 @@ class Signal_Handler:
         """Returns whether or not a SIGINT has been received and resets the Signal handler."""
         self._sigint_response = self._sigint_caught
         self._sigint_caught = False
-        return self._sigint_response
\ No newline at end of file
+        return self._sigint_response
+
+    def _sighup_handler(self, signum, frame):
+        """Gets called when a SIGHUP is caught."""
+        self._sighup_caught = True
+        logger.debug("  >> SIGHUP caught.")
+
+    @property
+    def sighup_caught(self):
+        """Returns whether or not a SIGHUP has been received and resets the Signal handler."""
+        self._sighup_response = self._sighup_caught
+        self._sighup_caught = False
+        return self._sighup_response
+
+    def _sigusr1_handler(self, signum, frame):
+        """Gets called when a SIGUSR1 is caught."""
+        self._sigusr1_caught = True
+        logger.debug("  >> SIGUSR1 caught.")
+
+    @property
+    def sigusr1_caught(self):
+        """Returns whether or not a SIGUSR1 has been received and resets the Signal handler."""
+        self._sigusr1_response = self._sigusr1_caught
+        self._sigusr1_caught = False
+        return self._sigusr1_response
+
+    def _sigusr2_handler(self, signum, frame):
+        """Gets called when a SIGUSR2 is caught."""
+        self._sigusr2_caught = True
+        logger.debug("  >> SIGUSR2 caught.")
+
+    @property
+    def sigusr2_caught(self):
+        """Returns whether or not a SIGUSR2 has been received and resets the Signal handler."""
+        self._sigusr2_response = self._sigusr2_caught
+        self._sigusr2_caught = False
+        return self._sigusr2_response
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# mobiHue.py - announces real time bus arrivals using Philipps Hue lights
+# (c) 2017, 2018 Federico Gentile
+# Shared fixtures running the program against a fake bridge, a fake departure API and a virtual clock.
+
+import os
+import signal
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "mobihue"))
+
+import mhclock
+import mhplugin
+from mhbenchmark import BENCHMARK_CONFIG
+
+
+def write_settings(path, config=BENCHMARK_CONFIG):
+    """Writes a configuration file and returns the settings read from it."""
+    from settings import Settings
+    path.write_text(config)
+    return Settings(str(path))
+
+
+@pytest.fixture
+def settings(tmp_path):
+    """Returns the benchmark settings, read from a temporary configuration file."""
+    return write_settings(tmp_path / "config.yaml")
+
+
+@pytest.fixture
+def schedule_settings(tmp_path):
+    """Returns the benchmark settings with zone transitions left to bridge schedules."""
+    return write_settings(tmp_path / "config.yaml", BENCHMARK_CONFIG.replace(" light_id: 1\n", " light_id: 1\n bridge_schedules: {}\n"))
+
+
+@pytest.fixture(autouse=True)
+def isolated_process(tmp_path, monkeypatch):
+    """Keeps plugins, signal handlers and the clock of one test from leaking into the others."""
+    plugin_directory = tmp_path / "plugins"
+    plugin_directory.mkdir()
+    monkeypatch.setattr(mhplugin, "PLUGIN_DIRECTORY", str(plugin_directory))
+    monkeypatch.setattr(mhplugin, "MANIFEST_FILE", str(plugin_directory / ".manifest.json"))
+    handled_signals = (signal.SIGINT, signal.SIGHUP, signal.SIGUSR1, signal.SIGUSR2)
+    handlers = {signum: signal.getsignal(signum) for signum in handled_signals}
+    clock = mhclock.get_clock()
+    yield
+    mhclock.set_clock(clock)
+    for signum, handler in handlers.items():
+        signal.signal(signum, handler)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# mobiHue.py - announces real time bus arrivals using Philipps Hue lights
+# (c) 2017, 2018 Federico Gentile
+# Control loop checks against a fake bridge, a fake departure API and a virtual clock.
+
+import os
+import signal
+from datetime import datetime, timedelta
+
+import mhclock
+from mhbenchmark import synthetic_board
+from mhcontroller import Controller
+from mhfakebridge import Fake_Bridge
+
+
+class Bounded_Clock(mhclock.Virtual_Clock):
+    """Virtual clock failing the test instead of running forever once the virtual time passes a limit."""
+
+    def __init__(self, start, limit, **kwargs):
+        super(Bounded_Clock, self).__init__(start, None, **kwargs)
+        self.limit = limit
+
+    def sleep(self, seconds):
+        super(Bounded_Clock, self).sleep(seconds)
+        assert self.now() < self.limit, "control loop still running at {}".format(self.now())
+
+
+def test_sigint_stops_idle_controller(settings):
+    start = datetime(2026, 10, 19, 2, 55)
+    mhclock.set_clock(Bounded_Clock(start, start + timedelta(hours=6), until=start + timedelta(minutes=5), on_end=lambda: os.kill(os.getpid(), signal.SIGINT)))
+    settings.idle = {"active_hours": ["06:00", "00:30"]}
+    board = synthetic_board(10, now=start)
+    controller = Controller(settings=settings, bridge=Fake_Bridge(), source=lambda: board)
+    controller.run()
+    assert controller.sigint_caught
+    assert mhclock.now() < start + timedelta(minutes=6)
+
+
+def single_departure_board(departure):
+    """Returns a departure board with one watched departure without real time data."""
+    return {"Departure": [{"Product": {"line": "5"}, "direction": "Luxembourg, Bertrange", "date": departure.strftime("%Y-%m-%d"), "time": departure.strftime("%H:%M:%S")}]}
+
+
+def run_ticks(controller, until):
+    """Runs the control loop one virtual second at a time until the given moment."""
+    while mhclock.now() < until:
+        controller._run_cycle()
+        mhclock.sleep(1)
+
+
+def test_bridge_schedules_are_not_undone(schedule_settings):
+    start = datetime(2026, 10, 19, 11, 59, 57)
+    mhclock.set_clock(mhclock.Virtual_Clock(start, None))
+    departure = datetime(2026, 10, 19, 12, 10)
+    board = single_departure_board(departure)
+    bridge = Fake_Bridge()
+    controller = Controller(settings=schedule_settings, bridge=bridge, source=lambda: board)
+    run_ticks(controller, datetime(2026, 10, 19, 12, 0, 30))
+    assert controller.current_zone == "further"
+    bridge.commands.clear()
+    # The bridge switches to intermediate at 12:04 and close at 12:07 on its own
+    run_ticks(controller, datetime(2026, 10, 19, 12, 8, 55))
+    assert [path for path, body in bridge.commands if path == "lights/1/state"] == []
+    assert controller.current_zone == "close"
+
+
+def test_reload_rewrites_zone_states(schedule_settings):
+    start = datetime(2026, 10, 19, 11, 59, 57)
+    mhclock.set_clock(mhclock.Virtual_Clock(start, None))
+    departure = datetime(2026, 10, 19, 12, 10)
+    board = single_departure_board(departure)
+    bridge = Fake_Bridge()
+    controller = Controller(settings=schedule_settings, bridge=bridge, source=lambda: board)
+    run_ticks(controller, datetime(2026, 10, 19, 12, 4, 30))
+    old_close_state = schedule_settings.hue["states"]["close"]
+    with open(schedule_settings.full_config_file_path) as config_file:
+        config = config_file.read()
+    with open(schedule_settings.full_config_file_path, "w") as config_file:
+        config_file.write(config.replace("close:        {minutes: 2, scene: , colour: red", "close:        {minutes: 2, scene: , colour: blue").replace("intermediate: {minutes: 5, scene: , colour: orange", "intermediate: {minutes: 5, scene: , colour: blue"))
+    bridge.commands.clear()
+    controller._reload_settings()
+    run_ticks(controller, datetime(2026, 10, 19, 12, 4, 40))
+    new_close_state = controller.settings.hue["states"]["close"]
+    assert new_close_state != old_close_state
+    assert [body for path, body in bridge.commands if path == "lights/1/state"] == [controller.settings.hue["states"]["intermediate"]]
+    assert [bridge_schedule["command"]["body"] for bridge_schedule in bridge.state["schedules"].values() if bridge_schedule["description"] == "close"] == [new_close_state]
+
+
+def test_quiet_hours_start_leaves_api_and_bridge_alone(settings):
+    start = datetime(2026, 10, 19, 2, 0)
+    mhclock.set_clock(Bounded_Clock(start, start + timedelta(hours=1), until=start + timedelta(minutes=10), on_end=lambda: os.kill(os.getpid(), signal.SIGINT)))
+    settings.idle = {"active_hours": ["06:00", "00:30"]}
+    requests = []
+
+    def source():
+        requests.append(mhclock.now())
+        return synthetic_board(10, now=mhclock.now())
+
+    bridge = Fake_Bridge()
+    controller = Controller(settings=settings, bridge=bridge, source=source)
+    controller.run()
+    assert requests == []
+    assert list(bridge.commands) == []
+
+
+def test_pause_ends_quiet_hours_idle(settings):
+    start = datetime(2026, 10, 19, 2, 0)
+    mhclock.set_clock(Bounded_Clock(start, start + timedelta(hours=1)))
+    settings.idle = {"active_hours": ["06:00", "00:30"]}
+    board = synthetic_board(10, now=start)
+    bridge = Fake_Bridge()
+    controller = Controller(settings=settings, bridge=bridge, source=lambda: board)
+    controller._run_cycle()
+    assert controller.idle_until == datetime(2026, 10, 19, 6, 0)
+    controller._set_paused(True)
+    controller._idle()
+    controller._run_cycle()
+    assert controller.paused
+    assert mhclock.now() < start + timedelta(seconds=5)
+    assert list(bridge.commands) == []
+
+
+def test_reload_applies_sections_or_warns(settings, caplog):
+    mhclock.set_clock(mhclock.Virtual_Clock(datetime(2026, 10, 19, 12, 0), None))
+    board = synthetic_board(10, now=mhclock.now())
+    controller = Controller(settings=settings, bridge=Fake_Bridge(), source=lambda: board)
+    with open(settings.full_config_file_path, "a") as config_file:
+        config_file.write("memory: {bounded: True}\nmetrics: {port: 9999}\nwatchdog: {deadline: 30}\nconnection_timeout: 3\n")
+    controller._reload_settings()
+    assert controller.memory_settings == {"bounded": True}
+    assert controller.schedule.backend.connection_timeout == 3
+    warnings = [record.getMessage() for record in caplog.records if record.levelname == "WARNING"]
+    assert "Changes to metrics only take effect after a restart." in warnings
+    assert "Changes to watchdog only take effect after a restart." in warnings
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# mobiHue.py - announces real time bus arrivals using Philipps Hue lights
+# (c) 2017, 2018 Federico Gentile
+# Entertainment streaming checks against the simulator's unencrypted receiver.
+
+from time import sleep
+
+import pytest
+
+from mhentertainment import Entertainment_Stream, solid
+from mhexception import Mobihue_Exception
+from mhsimulator import Entertainment_Receiver
+
+
+def test_encrypted_stream_needs_client_key():
+    with pytest.raises(Mobihue_Exception):
+        Entertainment_Stream("127.0.0.1", "user", None, [1, 2, 3])
+
+
+def test_stream_rate_and_frames():
+    receiver = Entertainment_Receiver().start()
+    stream = Entertainment_Stream("127.0.0.1", "user", None, range(1, 13), rate=25, port=receiver.port, encrypted=False)
+    stream.set_effect(solid((0.5, 0.4), 0.8))
+    try:
+        stream.start()
+        sleep(2)
+    finally:
+        stream.stop()
+        sleep(0.1)
+        receiver.stop()
+    # Twelve lights take two packets per frame
+    assert receiver.invalid_packets == 0
+    assert receiver.packets >= 2 * 40
+    assert 2 * 20 <= receiver.packet_rate <= 2 * 30
+    assert sorted(receiver.lights) == list(range(1, 13))
+    for light in receiver.lights.values():
+        assert light["colour_space"] == "xy"
+        assert light["values"] == pytest.approx((0.5, 0.4, 0.8), abs=1e-4)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# mobiHue.py - announces real time bus arrivals using Philipps Hue lights
+# (c) 2017, 2018 Federico Gentile
+# GTFS-Realtime decoder checks against the equivalent HAFAS departure board.
+
+from datetime import datetime, timedelta
+
+import mhclock
+from mhbackends import Gtfs_Realtime_Backend
+from mhbenchmark import _field
+from schedule import Schedule
+
+ZONES = {"imminent": {"minutes": 0}, "close": {"minutes": 2}, "intermediate": {"minutes": 5}}
+TRANSPORT = [{"number": 5, "direction": "Bertrange"}, {"number": 15, "direction": "Merl"}]
+# route id, line, direction id, direction, minutes until the scheduled departure, delay in seconds or None without real time data
+TRIPS = (
+    ("route-5", "5", 0, "Luxembourg, Bertrange", 1, 60),
+    ("route-5", "5", 1, "Gare Centrale", 2, 0),
+    ("route-15", "15", 0, "Merl, Centre", 4, 180),
+    ("route-5", "5", 0, "Luxembourg, Bertrange", 9, None),
+    ("route-16", "16", 0, "Kirchberg", 3, 120),
+    ("route-15", "15", 0, "Merl, Centre", 25, 240),
+    )
+
+
+def equivalent_feed_and_board(moment):
+    """Returns a GTFS-Realtime TripUpdates feed and the HAFAS departure board describing the same trips."""
+    entities = []
+    board = {"Departure": []}
+    for index, (route_id, line, direction_id, direction, minutes, delay) in enumerate(TRIPS):
+        scheduled = moment + timedelta(minutes=minutes)
+        real_time = scheduled + timedelta(seconds=delay or 0)
+        departure = _field(1, delay or 0) + _field(2, int(real_time.timestamp()))
+        stop_time_update = _field(1, 3) + _field(4, "1001") + _field(3, departure) + (_field(5, 2) if delay is None else b"")
+        other_stop_update = _field(1, 4) + _field(4, "1002") + _field(3, _field(2, int(real_time.timestamp()) + 90))
+        trip = _field(1, "trip-{}".format(index)) + _field(5, route_id) + _field(6, direction_id)
+        entities.append(_field(2, _field(1, "entity-{}".format(index)) + _field(3, _field(1, trip) + _field(2, stop_time_update) + _field(2, other_stop_update))))
+        journey = {"Product": {"line": line}, "direction": direction, "date": scheduled.strftime("%Y-%m-%d"), "time": scheduled.strftime("%H:%M:%S")}
+        if delay is not None:
+            journey["rtDate"] = real_time.strftime("%Y-%m-%d")
+            journey["rtTime"] = real_time.strftime("%H:%M:%S")
+        board["Departure"].append(journey)
+    feed = _field(1, _field(1, "2.0") + _field(3, int(moment.timestamp()))) + b"".join(entities)
+    return feed, board
+
+
+def summary(schedule):
+    """Returns what the light and the plugins see of every parsed departure."""
+    return [(str(bus.line), bus.direction, bus.time, bus.rtTime, bus.delay, bus.eta, bus.zone) for bus in schedule.all_departures or []]
+
+
+def test_gtfs_realtime_matches_hafas(tmp_path):
+    moment = datetime(2026, 10, 19, 12, 0)
+    feed, board = equivalent_feed_and_board(moment)
+    feed_path = tmp_path / "equivalence.pb"
+    feed_path.write_bytes(feed)
+    hafas_schedule = Schedule(TRANSPORT, "id=1", "http://127.0.0.1/", ZONES, source=lambda: board)
+    backend = Gtfs_Realtime_Backend(str(feed_path), "1001", routes={route_id: line for route_id, line, direction_id, direction, minutes, delay in TRIPS}, directions={"{}:{}".format(route_id, direction_id): direction for route_id, line, direction_id, direction, minutes, delay in TRIPS})
+    gtfs_schedule = Schedule(TRANSPORT, "id=1", "http://127.0.0.1/", ZONES, backend=backend)
+    # Both schedules are updated at the same virtual moment, so that their estimated times of arrival match
+    mhclock.set_clock(mhclock.Virtual_Clock(moment + timedelta(seconds=30), None))
+    hafas_schedule.update()
+    gtfs_schedule.update()
+    assert len(summary(hafas_schedule)) == 4
+    assert summary(gtfs_schedule) == summary(hafas_schedule)
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# mobiHue.py - announces real time bus arrivals using Philipps Hue lights
+# (c) 2017, 2018 Federico Gentile
+# Delay predictor checks, comparing a predictor primed from the history with one that kept running.
+
+from datetime import datetime, timedelta
+
+import mhclock
+from mhhistory import History, History_Recorder
+from mhpredictor import Delay_Predictor, hour_of_week
+from schedule import Bus, Departure_Event
+
+
+def bus(scheduled, delay_minutes):
+    """Returns a bus on line 5 with real time data."""
+    return Bus("5", "Luxembourg, Bertrange", scheduled, scheduled + timedelta(minutes=delay_minutes), timedelta(0), delay_minutes > 0, "further", 1.0)
+
+
+def test_history_priming_matches_continuous_running(tmp_path):
+    start = datetime(2026, 10, 19, 12, 0)
+    clock = mhclock.Virtual_Clock(start, None)
+    mhclock.set_clock(clock)
+    recorder = History_Recorder(str(tmp_path))
+    running = Delay_Predictor(min_samples=1)
+    departed = bus(start + timedelta(minutes=5), 2)
+    provisional = bus(start + timedelta(minutes=10), 1)
+    for observed in (departed, provisional):
+        recorder.observe(observed, "1")
+    clock.sleep(9 * 60)
+    provisional = bus(provisional.time, 4)
+    recorder.observe(provisional, "1")
+    running.observe_events([Departure_Event(Departure_Event.REMOVED, departed, departed)])
+    recorder.close()
+    # At 12:09, the departed bus left at 12:07 while the other one is still expected at 12:14
+    restarted = Delay_Predictor(min_samples=1)
+    assert restarted.load_history(History(str(tmp_path))) == 1
+    assert restarted.predict("5", departed.time) == running.predict("5", departed.time)
+    assert restarted.predictions["5"] == running.predictions["5"]
+    # Leaving the board after a restart does not count the departed bus a second time
+    restarted.observe_events([Departure_Event(Departure_Event.REMOVED, departed, departed)])
+    assert restarted.statistics["5"][hour_of_week(departed.time)].count == 1
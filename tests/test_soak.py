@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# mobiHue.py - announces real time bus arrivals using Philipps Hue lights
+# (c) 2017, 2018 Federico Gentile
+# Memory soak of the control loop in memory-bounded mode against varying departure boards.
+
+import itertools
+import tracemalloc
+
+from mhbenchmark import synthetic_board
+from mhcontroller import Controller
+from mhfakebridge import Fake_Bridge
+
+WARMUP_CYCLES = 200
+CYCLES = 1000
+MAX_GROWTH_KB = 256
+
+
+def test_control_loop_memory_stays_flat(settings):
+    boards = itertools.cycle([synthetic_board(100, seed=seed) for seed in range(10)])
+    settings.memory = {"bounded": True}
+    # The fake bridge would otherwise keep every command, which is not memory of the program
+    controller = Controller(settings=settings, bridge=Fake_Bridge(max_commands=100), source=lambda: next(boards))
+
+    def cycle():
+        controller._kill_check()
+        controller.run_loop_count = 0
+        controller._run_cycle()
+
+    tracemalloc.start()
+    try:
+        for _ in range(WARMUP_CYCLES):
+            cycle()
+        baseline, _ = tracemalloc.get_traced_memory()
+        for _ in range(CYCLES):
+            cycle()
+        final, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert (final - baseline) / 1024 <= MAX_GROWTH_KB